@@ -1,98 +1,851 @@
 import os
+import re
+import sys
 import glob
 import json
+import time
+import uuid
+import hashlib
+import datetime
+import argparse
+import threading
+import subprocess
+import itertools
+import dataclasses
+import queue
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
 from rapidfuzz import fuzz
-from src.modules.vision.service import OCRService
+from src.modules.vision.service import OCRService, ocr_config_fingerprint
+from src.modules.vision.backends import create_backend
+from src.modules.extraction.service import ExtractionService, current_extractor_version
+from src.modules.generator.service import PrescriptionGenerator, ScanSettings
+from src.modules.normalization.service import load_default_normalizer
+from src.modules.evaluation.service import MetricsService, FIELDS
+from src.modules.dataset.service import ShardedDataset, is_sharded_dataset, MANIFEST_NAME
 
 # Configuration
-SYNTHETIC_DIR = "/app/uploads/synthetic"
-RESULTS_DIR = "/app/uploads/benchmark_results"
+SYNTHETIC_DIR = os.getenv("SYNTHETIC_DIR", "/app/uploads/synthetic")
+RESULTS_DIR = os.getenv("BENCHMARK_RESULTS_DIR", "/app/uploads/benchmark_results")
+# Run the regression gate compares against (see set_baseline)
+BASELINE_PATH = os.path.join(RESULTS_DIR, "baseline.json")
+MIMIC_CSV_PATH = "/app/uploads/mimic_prescriptions.csv"
+# Processes used by run_full_benchmark
+BENCHMARK_WORKERS = int(os.getenv("BENCHMARK_WORKERS", str(os.cpu_count() or 1)))
+# Per-run directories (results, status, cancel marker)
+RUNS_DIR = os.path.join(RESULTS_DIR, "runs")
+RUN_ID_PATTERN = re.compile(r"[0-9A-Za-z_-]+")
+# Documents between two progress updates / cancel checks
+PROGRESS_EVERY = int(os.getenv("BENCHMARK_PROGRESS_EVERY", "10"))
+# In-memory sweep: stages (generation replaces decoding) and queue bound between them
+STREAM_STAGES = ("generate", "normalize", "ocr", "extraction")
+STREAM_QUEUE_SIZE = 16
+_STREAM_DONE = object()
+# Packed (sharded) synthetic dataset, preferred by the benchmark when present
+SYNTHETIC_SHARDS_DIR = os.getenv("SYNTHETIC_SHARDS_DIR", "/app/uploads/synthetic_shards")
+# Documents per pool task
+BENCHMARK_CHUNK_SIZE = 8
+# Timed stages of a document, in pipeline order
+STAGES = ("decode", "normalize", "ocr", "extraction")
+
+# Regression gate limits, per group of metrics: relative change for
+# throughput/latency, absolute points for similarity (0-100) and F1 (0-1)
+REGRESSION_THRESHOLDS = {"throughput": 0.10, "latency": 0.20, "similarity": 1.0, "f1": 0.02}
+# (metric, path in the run summary, higher is better, threshold group)
+REGRESSION_CHECKS = [
+    ("docs_per_second", ("docs_per_second",), True, "throughput"),
+    ("latency_p50_ms", ("latency_ms", "p50"), False, "latency"),
+    ("latency_p95_ms", ("latency_ms", "p95"), False, "latency"),
+    ("latency_p99_ms", ("latency_ms", "p99"), False, "latency"),
+    ("average_similarity_score", ("average_similarity_score",), True, "similarity"),
+    ("average_f1", ("average_f1",), True, "f1"),
+] + [(f"f1_{field}", ("field_f1", field), True, "f1") for field in FIELDS]
+# Similarity drop (points) from which a single document is listed as regressed
+DOCUMENT_SCORE_DROP = 5.0
+
+# Per-process services of the benchmark pool
+_bench_ocr = None
+_bench_extraction = None
+_bench_metrics = None
+_bench_datasets = {}
+
+def _init_benchmark_worker(ocr_service: OCRService = None):
+    global _bench_ocr, _bench_extraction, _bench_metrics
+    # One document per process at a time (Tesseract is single-threaded, see backends)
+    _bench_ocr = ocr_service or OCRService(workers=1)
+    _bench_extraction = ExtractionService(normalizer=load_default_normalizer())
+    _bench_metrics = MetricsService()
+
+def _open_dataset(dataset_dir: str) -> ShardedDataset:
+    # Memory-mapped once per process and version of the dataset: the worker
+    # process outlives the runs, and the shards may be regenerated in between
+    stat = os.stat(os.path.join(dataset_dir, MANIFEST_NAME))
+    version = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+    cached = _bench_datasets.get(dataset_dir)
+    if cached is None or cached[0] != version:
+        _bench_datasets[dataset_dir] = (version, ShardedDataset(dataset_dir))
+    return _bench_datasets[dataset_dir][1]
+
+def _benchmark_document(ref) -> dict:
+    """
+    OCR + extraction of one synthetic document (see list_documents), with
+    per-stage wall times (ms). For shards, decode includes reading the bytes
+    from the mapping.
+    """
+    kind, source, key = ref
+    if kind == "shard":
+        name, image_bytes, truth_bytes = _open_dataset(source)[key]
+        truth = json.loads(truth_bytes.tobytes())
+        load_image = lambda: _bench_ocr.decode_image(image_bytes)
+    else:
+        name = os.path.basename(source)
+        with open(key) as f:
+            truth = json.load(f)
+        load_image = lambda: _bench_ocr.load_image(source)
+    ocr, extracted, error = {"text": ""}, {"medicines": []}, None
+
+    # Clock reading after each completed stage
+    marks = [time.perf_counter()]
+    try:
+        img = load_image()
+        marks.append(time.perf_counter())
+        page = _bench_ocr.normalize(img)
+        marks.append(time.perf_counter())
+        ocr = _bench_ocr.read(page)
+        marks.append(time.perf_counter())
+        extracted = _bench_extraction.extract_from_text(ocr["text"])
+        marks.append(time.perf_counter())
+    except Exception as e:
+        print(f"OCR Error on {name}: {e}")
+        error = str(e)
+    timings = _stage_timings(marks, STAGES)
+    return _result_row(_bench_metrics, name, truth, ocr, extracted, timings, error)
+
+def _stage_timings(marks: list, stages: tuple) -> dict:
+    """ms between consecutive clock readings; stages not reached count 0."""
+    return {
+        stage: (marks[i + 1] - marks[i]) * 1000 if i + 1 < len(marks) else 0.0
+        for i, stage in enumerate(stages)
+    }
+
+def _result_row(metrics_service: MetricsService, name: str, truth: list, ocr: dict, extracted: dict,
+                timings: dict, error: str) -> dict:
+    """`ocr` is an OCRService.read result."""
+    ocr_text = ocr["text"]
+    truth_text = ground_truth_text(truth)
+    # Compare (Levenshtein Ratio); fuzz.ratio returns 0-100 similarity
+    score = fuzz.ratio(truth_text.lower(), ocr_text.lower())
+    # Medicine- and field-level agreement of the extraction with the generated data
+    metrics = metrics_service.calculate_metrics(extracted, ground_truth_structured(truth))
+    return {
+        "filename": name,
+        "score": round(score, 2),
+        "f1": metrics["f1_score"],
+        **{f"f1_{field}": value for field, value in metrics["field_f1"].items()},
+        "truth_length": len(truth_text),
+        "ocr_length": len(ocr_text),
+        "medicines": len(extracted["medicines"]),
+        "ocr_confidence": round(ocr["confidence"], 2) if ocr.get("confidence") is not None else None,
+        "ocr_tier": ocr.get("tier"),
+        **{f"{stage}_ms": round(ms, 2) for stage, ms in timings.items()},
+        "total_ms": round(sum(timings.values()), 2),
+        "error": error,
+        "truth_snippet": truth_text[:50].replace("\n", " "),
+        "ocr_snippet": ocr_text[:50].replace("\n", " ")
+    }
+
+def ground_truth_text(data: list) -> str:
+    # Concatenate all text parts in the order they appear
+    # We join them with newlines or spaces to mimic natural reading
+    full_text = []
+    for item in data:
+        if "text" in item:
+            full_text.append(item["text"])
+    
+    return "\n".join(full_text)
+
+def ground_truth_structured(data: list) -> dict:
+    """
+    Medicines of a synthetic document, in the extraction output format
+    (the instruction is the posology line drawn under the drug).
+    """
+    medicines = []
+    for item in data:
+        if item.get("label") == "DRUG":
+            medicines.append({"drug_name": item["text"], "dosage": item.get("strength", ""), "raw_instruction": ""})
+        elif item.get("label") == "INSTRUCTION" and medicines:
+            medicines[-1]["raw_instruction"] = item["text"]
+    return {"medicines": medicines}
+
+def _percentiles(values_ms) -> dict:
+    if not len(values_ms):
+        return {"mean": None, "p50": None, "p95": None, "p99": None}
+    values = np.asarray(values_ms, dtype=float)
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"mean": round(float(values.mean()), 2), "p50": round(float(p50), 2),
+            "p95": round(float(p95), 2), "p99": round(float(p99), 2)}
+
+def _present(results: list, key: str) -> list:
+    # Results written by older versions lack the columns added since (F1, stages...)
+    return [r[key] for r in results if r.get(key) is not None]
+
+def _mean(values: list, digits: int):
+    return round(float(np.mean(values)), digits) if values else None
+
+def summarize_results(results: list, wall_time: float, stages: tuple = STAGES) -> dict:
+    """
+    Accuracy, throughput and latency/stage percentiles of per-document results.
+    Metrics missing from the results (older runs) are None.
+    """
+    scores = [r["score"] for r in results]
+    # Latencies of failed documents would only measure the failure
+    timed = [r for r in results if not r.get("error")]
+    return {
+        "total_documents": len(results),
+        "errors": len(results) - len(timed),
+        "average_similarity_score": round(float(np.mean(scores)), 2) if scores else 0,
+        "average_f1": _mean(_present(results, "f1"), 4),
+        "field_f1": {field: _mean(_present(results, f"f1_{field}"), 4) for field in FIELDS},
+        "wall_time_s": round(wall_time, 2),
+        "docs_per_second": round(len(results) / wall_time, 2) if wall_time else None,
+        "latency_ms": _percentiles(_present(timed, "total_ms")),
+        # Share of documents that needed the full resolution OCR pass
+        "ocr_escalation_rate": _mean([tier == 2 for tier in _present(timed, "ocr_tier")], 4),
+        "stages_ms": {stage: _percentiles(_present(timed, f"{stage}_ms")) for stage in stages}
+    }
+
+def _now() -> str:
+    return datetime.datetime.utcnow().isoformat()
+
+class BenchmarkRun:
+    """
+    Files of one benchmark run, kept under RUNS_DIR/<run_id>/:
+    status.json (state, progress, config, final summary), results.jsonl
+    (one line per document, appended as they complete), results.csv and
+    report.json once finished, and a `cancel` marker set through the API.
+    """
+    STATES = ("queued", "running", "completed", "cancelled", "failed")
+
+    def __init__(self, run_id: str):
+        if not RUN_ID_PATTERN.fullmatch(run_id or ""):
+            raise ValueError(f"Invalid benchmark run id: {run_id!r}")
+        self.run_id = run_id
+        self.path = os.path.join(RUNS_DIR, run_id)
+
+    @classmethod
+    def create(cls, config: dict) -> "BenchmarkRun":
+        run = cls(f"{datetime.datetime.utcnow():%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:6]}")
+        os.makedirs(run.path)
+        run._write_status({
+            "run_id": run.run_id, "state": "queued", "config": config,
+            "created_at": _now(), "total": None, "done": 0
+        })
+        return run
+
+    @classmethod
+    def list_runs(cls) -> list:
+        """Status of every stored run, most recent first."""
+        if not os.path.isdir(RUNS_DIR):
+            return []
+        runs = [cls(name) for name in sorted(os.listdir(RUNS_DIR), reverse=True) if RUN_ID_PATTERN.fullmatch(name)]
+        return [run.read_status() for run in runs if run.exists()]
+
+    def exists(self) -> bool:
+        return os.path.exists(os.path.join(self.path, "status.json"))
+
+    def read_status(self) -> dict:
+        with open(os.path.join(self.path, "status.json")) as f:
+            return json.load(f)
+
+    def update_status(self, **fields):
+        self._write_status({**self.read_status(), **fields, "updated_at": _now()})
+
+    def _write_status(self, status: dict):
+        # Written atomically: readers (API) never see a partial file
+        tmp_path = os.path.join(self.path, f".status.{uuid.uuid4().hex}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(status, f, indent=2)
+        os.replace(tmp_path, os.path.join(self.path, "status.json"))
+
+    def append_results(self, rows: list):
+        if not rows:
+            return
+        with open(os.path.join(self.path, "results.jsonl"), "a") as f:
+            f.write("".join(json.dumps(row) + "\n" for row in rows))
+
+    def read_results(self) -> list:
+        """Per-document results written so far."""
+        path = os.path.join(self.path, "results.jsonl")
+        if not os.path.exists(path):
+            return []
+        with open(path) as f:
+            # The last line may still be in the middle of being appended
+            rows = []
+            for line in f:
+                if not line.endswith("\n"):
+                    break
+                rows.append(json.loads(line))
+            return rows
+
+    def request_cancel(self):
+        open(os.path.join(self.path, "cancel"), "w").close()
+
+    @property
+    def cancel_requested(self) -> bool:
+        return os.path.exists(os.path.join(self.path, "cancel"))
+
+def stream_evaluate(count: int, seed: int = 0, settings: ScanSettings = None, ocr_workers: int = BENCHMARK_WORKERS,
+                    generator_workers: int = 1, queue_size: int = STREAM_QUEUE_SIZE, csv_path: str = None) -> dict:
+    """
+    Generates `count` documents in memory and streams them through OCR,
+    extraction and scoring, without touching disk:
+    generator threads -> bounded queue -> OCR threads -> bounded queue -> scoring.
+    The bounded queues keep at most a few images in memory whatever `count`.
+    """
+    generator = PrescriptionGenerator()
+    catalog = generator._load_catalog(csv_path)
+    # One Tesseract handle per OCR thread (the engines release the GIL)
+    ocr = OCRService(workers=ocr_workers)
+    extraction = ExtractionService(normalizer=load_default_normalizer())
+    metrics = MetricsService()
+    documents, outputs = queue.Queue(queue_size), queue.Queue(queue_size)
+
+    def generate(part: int):
+        try:
+            for index in range(part, count, generator_workers):
+                start = time.perf_counter()
+                name, img, boxes = generator._render_one(catalog, seed, index, settings)
+                image = np.asarray(img)
+                documents.put((name, image, boxes, (time.perf_counter() - start) * 1000))
+        except Exception as e:
+            print(f"Generation error: {e}")
+
+    def recognize():
+        while True:
+            item = documents.get()
+            if item is _STREAM_DONE:
+                outputs.put(_STREAM_DONE)
+                return
+            name, image, boxes, generate_ms = item
+            result, extracted, error = {"text": ""}, {"medicines": []}, None
+            marks = [time.perf_counter()]
+            try:
+                # RGB (PIL) -> BGR, as read from a file
+                page = ocr.normalize(np.ascontiguousarray(image[..., ::-1]))
+                marks.append(time.perf_counter())
+                result = ocr.read(page)
+                marks.append(time.perf_counter())
+                extracted = extraction.extract_from_text(result["text"])
+                marks.append(time.perf_counter())
+            except Exception as e:
+                error = str(e)
+            timings = {"generate": generate_ms, **_stage_timings(marks, STREAM_STAGES[1:])}
+            outputs.put((name, boxes, result, extracted, timings, error))
+
+    def close():
+        # All documents queued: one end marker per OCR thread
+        for thread in producers:
+            thread.join()
+        for _ in range(ocr_workers):
+            documents.put(_STREAM_DONE)
+
+    start = time.perf_counter()
+    producers = [threading.Thread(target=generate, args=(part,), daemon=True) for part in range(generator_workers)]
+    consumers = [threading.Thread(target=recognize, daemon=True) for _ in range(ocr_workers)]
+    for thread in producers + consumers + [threading.Thread(target=close, daemon=True)]:
+        thread.start()
+
+    # Scoring stage (this thread)
+    results, finished = [], 0
+    while finished < ocr_workers:
+        item = outputs.get()
+        if item is _STREAM_DONE:
+            finished += 1
+            continue
+        results.append(_result_row(metrics, *item))
+    wall_time = time.perf_counter() - start
+    ocr.backend.close()
+
+    errors = [r["error"] for r in results if r["error"]]
+    if errors:
+        print(f"{len(errors)} OCR error(s), e.g.: {errors[0]}")
+    return summarize_results(results, wall_time, STREAM_STAGES)
+
+def run_sweep(settings_list: list, count: int, seed: int = 0, **kwargs) -> list:
+    """stream_evaluate for each scan setting, on the same documents (same seed)."""
+    report = []
+    for settings in settings_list:
+        summary = stream_evaluate(count, seed=seed, settings=settings, **kwargs)
+        report.append({"settings": dataclasses.asdict(settings), **summary})
+        print(f"{settings}: similarity {summary['average_similarity_score']}, "
+              f"F1 {summary['average_f1']}, {summary['docs_per_second']} docs/s")
+    return report
+
+def code_version() -> str:
+    """
+    Git commit of the backend code (with -dirty for local changes), or a hash
+    of the sources when git is not available (e.g. inside the container).
+    """
+    src_dir = os.path.dirname(os.path.abspath(__file__))
+    try:
+        git = lambda *args: subprocess.run(
+            ["git", *args], cwd=src_dir, capture_output=True, text=True, timeout=10, check=True
+        ).stdout.strip()
+        commit = git("rev-parse", "--short", "HEAD")
+        return f"{commit}-dirty" if git("status", "--porcelain", "--", ".") else commit
+    except (OSError, subprocess.SubprocessError):
+        h = hashlib.sha1()
+        for path in sorted(glob.glob(os.path.join(src_dir, "**", "*.py"), recursive=True)):
+            h.update(os.path.relpath(path, src_dir).encode())
+            with open(path, "rb") as f:
+                h.update(f.read())
+        return f"src-{h.hexdigest()[:12]}"
+
+def dataset_fingerprint(documents: list) -> str:
+    """Identifies the benchmarked documents (names and sizes)."""
+    h = hashlib.sha1()
+    for kind, source, key in documents:
+        if kind == "shard":
+            dataset = _open_dataset(source)
+            entry = (dataset.names[key], *dataset.sizes(key))
+        else:
+            entry = (os.path.basename(source), os.path.getsize(source), os.path.getsize(key))
+        h.update("|".join(map(str, entry)).encode())
+    return h.hexdigest()[:12]
+
+def set_baseline(run_id: str):
+    """Marks a completed run as the reference of the regression gate."""
+    run = BenchmarkRun(run_id)
+    if not run.exists() or run.read_status()["state"] != "completed":
+        raise ValueError(f"Run {run_id} is not a completed benchmark run")
+    with open(BASELINE_PATH, "w") as f:
+        json.dump({"run_id": run_id, "set_at": _now()}, f)
+
+def get_baseline() -> "BenchmarkRun":
+    if not os.path.exists(BASELINE_PATH):
+        return None
+    with open(BASELINE_PATH) as f:
+        return BenchmarkRun(json.load(f)["run_id"])
+
+def _lookup(summary: dict, path: tuple):
+    for key in path:
+        summary = (summary or {}).get(key)
+    return summary
+
+def compare_runs(base: BenchmarkRun, candidate: BenchmarkRun, thresholds: dict = None) -> dict:
+    """
+    Diffs two runs in aggregate (throughput, latency percentiles, similarity,
+    F1 and field-level F1) and per document. `passed` is False when an
+    aggregate metric regressed beyond its threshold.
+    """
+    thresholds = {**REGRESSION_THRESHOLDS, **(thresholds or {})}
+    base_status, candidate_status = base.read_status(), candidate.read_status()
+    failures, warnings = [], []
+
+    for status in (base_status, candidate_status):
+        if status["state"] != "completed":
+            failures.append(f"Run {status['run_id']} is {status['state']}, not completed")
+    base_config, candidate_config = base_status.get("config", {}), candidate_status.get("config", {})
+    for key in ("dataset", "workers", "limit"):
+        if base_config.get(key) != candidate_config.get(key):
+            warnings.append(f"{key} differs: {base_config.get(key)} -> {candidate_config.get(key)}")
+
+    # 1. Aggregates
+    aggregate = []
+    base_summary, candidate_summary = base_status.get("summary") or {}, candidate_status.get("summary") or {}
+    for metric, path, higher_is_better, group in REGRESSION_CHECKS:
+        before, after = _lookup(base_summary, path), _lookup(candidate_summary, path)
+        entry = {"metric": metric, "base": before, "candidate": after, "limit": thresholds[group], "regressed": False}
+        if before is not None and after is not None:
+            delta = after - before
+            entry["delta"] = round(delta, 4)
+            loss = -delta if higher_is_better else delta
+            if group in ("throughput", "latency"):
+                # Relative change
+                loss = loss / before if before else 0.0
+                entry["relative"] = round(delta / before, 4) if before else None
+            entry["regressed"] = loss > thresholds[group]
+            if entry["regressed"]:
+                failures.append(f"{metric}: {before} -> {after} (limit {thresholds[group]})")
+        aggregate.append(entry)
+
+    # 2. Documents (matched by file name)
+    base_rows = {r["filename"]: r for r in base.read_results()}
+    candidate_rows = {r["filename"]: r for r in candidate.read_results()}
+    common = sorted(base_rows.keys() & candidate_rows.keys())
+    documents = []
+    for name in common:
+        before, after = base_rows[name], candidate_rows[name]
+        documents.append({
+            "filename": name,
+            "score": [before["score"], after["score"]],
+            "delta_score": round(after["score"] - before["score"], 2),
+            "f1": [before.get("f1"), after.get("f1")],
+            "total_ms": [before["total_ms"], after["total_ms"]]
+        })
+    regressed = sorted(
+        (d for d in documents if d["delta_score"] <= -DOCUMENT_SCORE_DROP), key=lambda d: d["delta_score"]
+    )
+
+    return {
+        "base": base.run_id,
+        "candidate": candidate.run_id,
+        "code_versions": [base_config.get("code_version"), candidate_config.get("code_version")],
+        "passed": not failures,
+        "failures": failures,
+        "warnings": warnings,
+        "aggregate": aggregate,
+        "documents": {
+            "compared": len(common),
+            "only_in_base": len(base_rows.keys() - candidate_rows.keys()),
+            "only_in_candidate": len(candidate_rows.keys() - base_rows.keys()),
+            "regressed": regressed
+        }
+    }
+
+def run_extraction_benchmark(count: int = 100_000, workers: int = None, use_lexicon: bool = True):
+    """
+    Extraction throughput (lines/s) over an in-memory synthetic corpus, for
+    the per-text loop and for extract_many. Does not need OCR or the database.
+    """
+    # 1. Corpus: rendered text of synthetic prescriptions (same catalog as the generator)
+    texts = PrescriptionGenerator().generate_texts(count, csv_path=MIMIC_CSV_PATH)
+    total_lines = sum(t.count("\n") + 1 for t in texts)
+    service = ExtractionService(normalizer=load_default_normalizer() if use_lexicon else None)
+
+    # 2. Sequential baseline
+    start = time.perf_counter()
+    sequential = [service.extract_from_text(t) for t in texts]
+    sequential_time = time.perf_counter() - start
+
+    # 3. Batched (process pool); the first call includes the pool start-up
+    start = time.perf_counter()
+    batched = service.extract_many(texts, workers=workers)
+    batched_time = time.perf_counter() - start
+    service.close()
+
+    report = {
+        "documents": count,
+        "lines": total_lines,
+        "lexicon": service.version,
+        "workers": workers or os.cpu_count(),
+        "sequential_lines_per_second": round(total_lines / sequential_time),
+        "batched_lines_per_second": round(total_lines / batched_time),
+        "identical_output": sequential == batched
+    }
+    print(f"Extraction benchmark: {report}")
+    return report
 
 class BenchmarkRunner:
+    """
+    Runs benchmarks; meant to be kept and reused (one per worker process),
+    as it holds the Tesseract engine of single-process runs.
+    """
     def __init__(self):
-        self.ocr_service = OCRService()
-        os.makedirs(RESULTS_DIR, exist_ok=True)
+        # Created on the first single-process run (pool runs use their own)
+        self._ocr_service = None
+        os.makedirs(RUNS_DIR, exist_ok=True)
+
+    @property
+    def ocr_service(self) -> OCRService:
+        # Documents are OCR'd one at a time per benchmark process
+        if self._ocr_service is None:
+            self._ocr_service = OCRService(workers=1)
+        return self._ocr_service
+
+    def close(self):
+        if self._ocr_service is not None:
+            self._ocr_service.close()
+            self._ocr_service = None
 
-    def load_ground_truth(self, json_path: str) -> str:
+    @staticmethod
+    def load_ground_truth(json_path: str) -> str:
         """
         Reads the Synthetic JSON and reconstructs the 'perfect' text string.
         """
         with open(json_path, 'r') as f:
-            data = json.load(f)
-        
-        # Concatenate all text parts in the order they appear
-        # We join them with newlines or spaces to mimic natural reading
-        full_text = []
-        for item in data:
-            if "text" in item:
-                full_text.append(item["text"])
-        
-        return "\n".join(full_text)
+            return ground_truth_text(json.load(f))
 
-    def run_full_benchmark(self):
-        print(f"Starting benchmark on {SYNTHETIC_DIR}...")
-        
-        # 1. Find all synthetic images
-        image_files = glob.glob(os.path.join(SYNTHETIC_DIR, "*.png"))
-        if not image_files:
-            return {"error": "No synthetic data found. Run /admin/generate-synthetic-data first."}
+    @staticmethod
+    def load_ground_truth_structured(json_path: str) -> dict:
+        with open(json_path, 'r') as f:
+            return ground_truth_structured(json.load(f))
 
-        results = []
-        total_score = 0
-        
-        for img_path in image_files:
-            base_name = os.path.basename(img_path)
+    def list_documents(self, limit: int = None, dataset: str = None) -> list:
+        """
+        Document references of the synthetic dataset, in a stable order:
+        ("file", image path, json path) or ("shard", dataset dir, number).
+        `dataset`: "files", "shards" or None (shards when a packed dataset exists).
+        """
+        if dataset is None:
+            dataset = "shards" if is_sharded_dataset(SYNTHETIC_SHARDS_DIR) else "files"
+
+        if dataset == "shards":
+            if not is_sharded_dataset(SYNTHETIC_SHARDS_DIR):
+                return []
+            count = len(ShardedDataset(SYNTHETIC_SHARDS_DIR))
+            return [("shard", SYNTHETIC_SHARDS_DIR, i) for i in range(count)][:limit]
+
+        refs = []
+        for img_path in sorted(glob.glob(os.path.join(SYNTHETIC_DIR, "*.png"))):
             json_path = img_path.replace(".png", ".json")
-            
             if not os.path.exists(json_path):
-                print(f"Skipping {base_name}: No JSON Ground Truth found.")
+                print(f"Skipping {os.path.basename(img_path)}: No JSON Ground Truth found.")
                 continue
+            refs.append(("file", img_path, json_path))
+        return refs[:limit]
 
-            # A. Get Ground Truth
-            truth_text = self.load_ground_truth(json_path)
-            
-            # B. Run OCR (Hypothesis)
-            try:
-                ocr_text = self.ocr_service.process_file(img_path)
-            except Exception as e:
-                print(f"OCR Error on {base_name}: {e}")
-                ocr_text = ""
-
-            # C. Compare (Levenshtein Ratio)
-            # fuzz.ratio returns 0-100 similarity
-            score = fuzz.ratio(truth_text.lower(), ocr_text.lower())
-            total_score += score
-            
-            results.append({
-                "filename": base_name,
-                "score": round(score, 2),
-                "truth_length": len(truth_text),
-                "ocr_length": len(ocr_text),
-                "truth_snippet": truth_text[:50].replace("\n", " "),
-                "ocr_snippet": ocr_text[:50].replace("\n", " ")
-            })
+    def run_full_benchmark(self, workers: int = BENCHMARK_WORKERS, limit: int = None, run: "BenchmarkRun" = None,
+                           dataset: str = None):
+        """
+        OCRs + extracts every synthetic document on a pool of `workers`
+        processes (one single-threaded Tesseract each), timing every stage.
+        Per-document results are appended to the run's results.jsonl as they
+        come in; the run stops early when a cancel is requested. Reports
+        accuracy, throughput and latency percentiles in the run directory.
+        `dataset`: "files", "shards" or None (auto, see list_documents).
+        """
+        config = {"workers": workers, "limit": limit, "dataset_format": dataset}
+        run = run or BenchmarkRun.create(config)
+        print(f"Starting benchmark {run.run_id} on {SYNTHETIC_DIR} with {workers} worker(s)...")
+        if run.cancel_requested:
+            run.update_status(state="cancelled", finished_at=_now())
+            return run.read_status()
+
+        # 1. Find all synthetic images
+        try:
+            documents = self.list_documents(limit, dataset)
+            if not documents:
+                error = "No synthetic data found. Run /admin/generate-synthetic-data first."
+                run.update_status(state="failed", error=error, finished_at=_now())
+                return {"error": error, "run_id": run.run_id}
+
+            run.update_status(
+                state="running", total=len(documents), done=0, started_at=_now(),
+                config={**config, "ocr_config": ocr_config_fingerprint(),
+                        "extractor_version": current_extractor_version(), "code_version": code_version(),
+                        "dataset_format": documents[0][0] + "s", "dataset": dataset_fingerprint(documents)}
+            )
+        except Exception as e:
+            # Otherwise the run would stay "queued" for good
+            run.update_status(state="failed", error=str(e), finished_at=_now())
+            raise
+
+        # 2. Fan out (results come back in document order) and stream them to disk
+        results, pending, cancelled = [], [], False
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_benchmark_worker) if workers > 1 else None
+        start = time.perf_counter()
+        try:
+            if pool is None:
+                _init_benchmark_worker(self.ocr_service)
+            # Contiguous documents per task: shards are read mostly sequentially
+            outcomes = (
+                pool.map(_benchmark_document, documents, chunksize=BENCHMARK_CHUNK_SIZE)
+                if pool else map(_benchmark_document, documents)
+            )
+            for result in outcomes:
+                results.append(result)
+                pending.append(result)
+                if len(pending) >= PROGRESS_EVERY or len(results) == len(documents):
+                    run.append_results(pending)
+                    pending = []
+                    run.update_status(done=len(results))
+                    if run.cancel_requested:
+                        cancelled = True
+                        break
+        except Exception as e:
+            run.append_results(pending)
+            run.update_status(state="failed", done=len(results), error=str(e), finished_at=_now())
+            raise
+        finally:
+            if pool is not None:
+                pool.shutdown(wait=True, cancel_futures=True)
+        wall_time = time.perf_counter() - start
 
         # 3. Calculate Aggregates
-        avg_score = total_score / len(results) if results else 0
-        
-        # 4. Save Report to CSV
-        df = pd.DataFrame(results)
-        report_path = os.path.join(RESULTS_DIR, "latest_benchmark.csv")
-        df.to_csv(report_path, index=False)
+        summary = {**run.read_status()["config"], **summarize_results(results, wall_time)}
         
-        summary = {
-            "total_documents": len(results),
-            "average_similarity_score": round(avg_score, 2),
-            "report_path": report_path,
-            "details": results
-        }
-        
-        print(f"Benchmark Complete. Average Score: {avg_score:.2f}%")
+        # 4. Save Reports (CSV per document, JSON summary)
+        report_path = os.path.join(run.path, "results.csv")
+        pd.DataFrame(results).to_csv(report_path, index=False)
+
+        json_report_path = os.path.join(run.path, "report.json")
+        with open(json_report_path, "w") as f:
+            json.dump(summary, f, indent=2)
+
+        run.update_status(state="cancelled" if cancelled else "completed", summary=summary, finished_at=_now())
+        summary.update({
+            "run_id": run.run_id, "cancelled": cancelled,
+            "report_path": report_path, "json_report_path": json_report_path
+        })
+        print(f"Benchmark {run.run_id} {'cancelled' if cancelled else 'complete'}. "
+              f"Average Score: {summary['average_similarity_score']:.2f}%, "
+              f"{summary['docs_per_second']} docs/s, p95 latency {summary['latency_ms']['p95']} ms")
         return summary
 
+    def compare_backends(self, backends=("pytesseract", "tesserocr"), limit: int = None):
+        """
+        OCRs the same synthetic images with each OCR backend and reports
+        per-document latency and accuracy. Runs on a single worker so the
+        numbers reflect the per-call engine cost.
+        """
+        image_files = sorted(glob.glob(os.path.join(SYNTHETIC_DIR, "*.png")))[:limit]
+        if not image_files:
+            return {"error": "No synthetic data found. Run /admin/generate-synthetic-data first."}
+
+        report = {}
+        for name in backends:
+            # A. Build the engine (not counted in the per-document latency)
+            start = time.perf_counter()
+            backend = create_backend(name, lang="fra", pool_size=1)
+            init_time = time.perf_counter() - start
+            if backend.name != name:
+                report[name] = {"error": f"Backend '{name}' is not available"}
+                continue
+
+            service = OCRService(workers=1, backend=backend)
+            latencies, scores = [], []
+
+            # B. Same documents, same order, for every backend
+            for img_path in image_files:
+                json_path = img_path.replace(".png", ".json")
+                if not os.path.exists(json_path):
+                    continue
+                truth_text = self.load_ground_truth(json_path)
+
+                start = time.perf_counter()
+                try:
+                    ocr_text = service.process_file(img_path)
+                except Exception as e:
+                    print(f"[{name}] OCR Error on {os.path.basename(img_path)}: {e}")
+                    ocr_text = ""
+                latencies.append(time.perf_counter() - start)
+                scores.append(fuzz.ratio(truth_text.lower(), ocr_text.lower()))
+
+            backend.close()
+
+            latencies_ms = np.array(latencies) * 1000
+            report[name] = {
+                "total_documents": len(latencies),
+                "init_ms": round(init_time * 1000, 1),
+                "avg_latency_ms": round(float(latencies_ms.mean()), 1) if len(latencies) else None,
+                "p50_latency_ms": round(float(np.percentile(latencies_ms, 50)), 1) if len(latencies) else None,
+                "docs_per_second": round(len(latencies) / sum(latencies), 2) if latencies else None,
+                "average_similarity_score": round(float(np.mean(scores)), 2) if scores else None
+            }
+            print(f"[{name}] {report[name]}")
+
+        return report
+
 # Allow running from command line
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OCR benchmark on the synthetic dataset.")
+    parser.add_argument("--compare-backends", action="store_true",
+                        help="Compare the pytesseract and tesserocr backends instead of running the full benchmark.")
+    parser.add_argument("--benchmark-workers", type=int, default=BENCHMARK_WORKERS,
+                        help="Processes used by the full benchmark.")
+    parser.add_argument("--limit", type=int, default=None, help="Only use the first N synthetic documents.")
+    parser.add_argument("--extraction", action="store_true",
+                        help="Measure extraction throughput (lines/s) on generated text instead of OCR.")
+    parser.add_argument("--count", type=int, default=100_000, help="Synthetic documents for --extraction.")
+    parser.add_argument("--workers", type=int, default=None, help="Process pool size for --extraction.")
+    # In-memory scan effects sweep
+    parser.add_argument("--sweep", action="store_true",
+                        help="Generate documents in memory and score OCR for each scan effects setting.")
+    parser.add_argument("--sweep-count", type=int, default=200, help="Documents per setting for --sweep.")
+    parser.add_argument("--rotations", default="0,1.5,5", help="Max rotations (degrees) for --sweep.")
+    parser.add_argument("--blur-radii", default="0,0.5,1.5", help="Blur radii for --sweep (0: no blur).")
+    parser.add_argument("--noise-levels", default="0,0.05,0.15", help="Noise opacities (0-1) for --sweep.")
+    parser.add_argument("--output", default=None, help="Also write the --sweep report (JSON) to this file.")
+    # Regression gate
+    parser.add_argument("--generate", type=int, default=None, metavar="N",
+                        help="Generate N synthetic documents first if the dataset is empty (works offline).")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the dataset generated by --generate.")
+    parser.add_argument("--dataset", choices=["files", "shards"], default=None,
+                        help="Benchmark png/json files or the packed shards (default: shards when present).")
+    parser.add_argument("--gate", action="store_true",
+                        help="Run the benchmark, then compare it with the baseline run (exit 1 on regression).")
+    parser.add_argument("--compare", metavar="RUN_ID", help="Compare a stored run with the baseline (or --against).")
+    parser.add_argument("--against", metavar="RUN_ID", help="Reference run for --compare / --gate.")
+    parser.add_argument("--set-baseline", metavar="RUN_ID", help="Use a completed run as the baseline.")
+    parser.add_argument("--max-throughput-drop", type=float, default=REGRESSION_THRESHOLDS["throughput"],
+                        help="Max relative docs/s drop (0.10 = 10%%).")
+    parser.add_argument("--max-latency-increase", type=float, default=REGRESSION_THRESHOLDS["latency"],
+                        help="Max relative latency percentile increase.")
+    parser.add_argument("--max-similarity-drop", type=float, default=REGRESSION_THRESHOLDS["similarity"],
+                        help="Max average similarity drop (points, 0-100).")
+    parser.add_argument("--max-f1-drop", type=float, default=REGRESSION_THRESHOLDS["f1"],
+                        help="Max F1 / field-level F1 drop (0-1).")
+    args = parser.parse_args()
+
+    if args.extraction:
+        print(json.dumps(run_extraction_benchmark(args.count, args.workers), indent=2))
+        raise SystemExit(0)
+
+    if args.sweep:
+        parse = lambda values: [float(v) for v in values.split(",")]
+        settings_list = [
+            ScanSettings(max_rotation=rotation, blur_probability=1.0 if blur else 0.0, blur_radius=blur,
+                         noise_level=noise)
+            for rotation, blur, noise in itertools.product(
+                parse(args.rotations), parse(args.blur_radii), parse(args.noise_levels)
+            )
+        ]
+        report = run_sweep(
+            settings_list, args.sweep_count, seed=args.seed, ocr_workers=args.benchmark_workers,
+            csv_path=MIMIC_CSV_PATH if os.path.exists(MIMIC_CSV_PATH) else None
+        )
+        print(json.dumps(report, indent=2))
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(report, f, indent=2)
+        raise SystemExit(0)
+
+    if args.set_baseline:
+        set_baseline(args.set_baseline)
+        print(f"Baseline set to {args.set_baseline}")
+        raise SystemExit(0)
+
+    thresholds = {
+        "throughput": args.max_throughput_drop, "latency": args.max_latency_increase,
+        "similarity": args.max_similarity_drop, "f1": args.max_f1_drop
+    }
+
+    def gate(candidate_id: str, init_baseline: bool) -> int:
+        base = BenchmarkRun(args.against) if args.against else get_baseline()
+        if base is None:
+            if not init_baseline:
+                sys.exit("No baseline run: use --set-baseline or --against.")
+            set_baseline(candidate_id)
+            print(f"No baseline yet: {candidate_id} is now the baseline.")
+            return 0
+        candidate = BenchmarkRun(candidate_id)
+        for run in (base, candidate):
+            if not run.exists():
+                sys.exit(f"Unknown benchmark run: {run.run_id}")
+        comparison = compare_runs(base, candidate, thresholds)
+        print(json.dumps(comparison, indent=2))
+        print("PASSED" if comparison["passed"] else "REGRESSION: " + "; ".join(comparison["failures"]))
+        return 0 if comparison["passed"] else 1
+
+    if args.compare:
+        sys.exit(gate(args.compare, init_baseline=False))
+
+    sharded = args.dataset == "shards"
+    if args.generate and not (is_sharded_dataset(SYNTHETIC_SHARDS_DIR) if sharded
+                              else glob.glob(os.path.join(SYNTHETIC_DIR, "*.png"))):
+        csv_path = MIMIC_CSV_PATH if os.path.exists(MIMIC_CSV_PATH) else None
+        PrescriptionGenerator(output_dir=SYNTHETIC_SHARDS_DIR if sharded else SYNTHETIC_DIR).generate_batch(
+            args.generate, csv_path=csv_path, seed=args.seed, workers=args.benchmark_workers, sharded=sharded
+        )
+
     runner = BenchmarkRunner()
-    runner.run_full_benchmark()
-    
\ No newline at end of file
+    if args.compare_backends:
+        print(json.dumps(runner.compare_backends(limit=args.limit), indent=2))
+    else:
+        summary = runner.run_full_benchmark(workers=args.benchmark_workers, limit=args.limit, dataset=args.dataset)
+        if args.gate:
+            if "error" in summary:
+                sys.exit(summary["error"])
+            sys.exit(gate(summary["run_id"], init_baseline=True))
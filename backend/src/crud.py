@@ -1,51 +1,211 @@
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, joinedload
 from src import models, schemas
+from src.notifications import notify_document_status
+from src.modules.evaluation.service import MetricsService
+from src.modules.vision.service import split_pages
 import uuid
+import base64
 import datetime
-from sqlalchemy import desc
+import json
+from sqlalchemy import desc, or_, and_, func, update, delete, select, insert, exists, tuple_, text
+from sqlalchemy import any_, bindparam, case
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects.postgresql import insert as pg_insert, ARRAY, UUID
 
 # --- CREATE ---
-def create_document(db: Session, filename: str, file_path: str):
+def create_document(db: Session, filename: str, file_path: str, content_hash: str = None, site: str = None):
     db_document = models.Document(
         filename=filename,
         file_path=file_path,
+        content_hash=content_hash,
+        site=site,
         status=models.ProcessingStatus.PENDING
     )
     db.add(db_document)
+    db.flush()
+
+    # The job is committed together with the document, so an upload can never
+    # exist without its processing job.
+    enqueue_job(db, document_id=db_document.id, commit=False)
+
     db.commit()
     db.refresh(db_document)
     return db_document
 
+def create_document_from_cache(db: Session, filename: str, file_path: str, content_hash: str,
+                               cached: models.ResultCache, site: str = None):
+    """Creates an already COMPLETED document from a cached OCR/extraction result. No job is queued."""
+    db_document = models.Document(
+        filename=filename,
+        file_path=file_path,
+        content_hash=content_hash,
+        site=site,
+        status=models.ProcessingStatus.COMPLETED
+    )
+    db.add(db_document)
+    db.flush()
+    db.add_all(models.DocumentPage(**row) for row in cached_page_rows(db_document.id, file_path, cached))
+    db.add(models.Prescription(
+        document_id=db_document.id,
+        raw_text=cached.raw_text,
+        page_sources=cached.page_sources,
+        structured_json=cached.structured_json,
+        ai_structured_json=cached.structured_json,
+        extractor_version=cached.extractor_version
+    ))
+    db.commit()
+    db.refresh(db_document)
+    return db_document
+
+def create_documents_bulk(db: Session, uploads: list, cached_results: dict = None, site: str = None):
+    """
+    Inserts many documents (and their jobs) in a single transaction.
+    `uploads` is a list of dicts with filename, file_path and content_hash.
+    Uploads whose hash is in `cached_results` are created COMPLETED from the cache.
+    Returns the documents in the same order as `uploads`.
+    """
+    cached_results = cached_results or {}
+    document_rows, prescription_rows, page_rows, job_rows = [], [], [], []
+
+    for upload in uploads:
+        doc_id = uuid.uuid4()
+        cached = cached_results.get(upload["content_hash"])
+        document_rows.append({
+            "id": doc_id,
+            "filename": upload["filename"],
+            "file_path": upload["file_path"],
+            "content_hash": upload["content_hash"],
+            "site": site,
+            "status": models.ProcessingStatus.COMPLETED if cached else models.ProcessingStatus.PENDING
+        })
+        if cached:
+            page_rows.extend(cached_page_rows(doc_id, upload["file_path"], cached))
+            prescription_rows.append({
+                "id": uuid.uuid4(),
+                "document_id": doc_id,
+                "raw_text": cached.raw_text,
+                "page_sources": cached.page_sources,
+                "structured_json": cached.structured_json,
+                "ai_structured_json": cached.structured_json,
+                "extractor_version": cached.extractor_version,
+                "is_validated": False
+            })
+        else:
+            job_rows.append({
+                "id": uuid.uuid4(),
+                "kind": "process_document",
+                "document_id": doc_id,
+                "status": models.JobStatus.QUEUED,
+                "attempts": 0,
+                "max_attempts": 5
+            })
+
+    # Multi-row INSERTs, one commit for the whole batch
+    db.execute(insert(models.Document), document_rows)
+    if prescription_rows:
+        db.execute(insert(models.Prescription), prescription_rows)
+    if page_rows:
+        db.execute(insert(models.DocumentPage), page_rows)
+    if job_rows:
+        db.execute(insert(models.Job), job_rows)
+    db.commit()
+
+    ids = [row["id"] for row in document_rows]
+    docs = {d.id: d for d in db.query(models.Document).filter(models.Document.id.in_(ids)).all()}
+    return [docs[doc_id] for doc_id in ids]
+
 # --- READ ---
-def get_documents(db: Session, validated: bool = None, limit: int = 100):
-    query = db.query(models.Document).outerjoin(models.Prescription)
-    
+def encode_cursor(document: models.Document) -> str:
+    """Opaque keyset cursor pointing after `document` in the listing order."""
+    raw = f"{document.upload_timestamp.isoformat()}|{document.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor: str):
+    """Returns (upload_timestamp, id). Raises ValueError on malformed cursors."""
+    try:
+        timestamp, doc_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.datetime.fromisoformat(timestamp), uuid.UUID(doc_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+def _documents_query(db: Session, validated: bool = None):
+    query = db.query(models.Document)
+
+    # EXISTS instead of an outer join: served by ix_prescriptions_document_validated
+    is_validated = exists().where(
+        models.Prescription.document_id == models.Document.id,
+        models.Prescription.is_validated == True
+    )
     if validated is True:
-        query = query.filter(models.Prescription.is_validated == True)
+        query = query.filter(is_validated)
     elif validated is False:
+        query = query.filter(~is_validated)
+    return query
+
+def get_documents(db: Session, validated: bool = None, limit: int = 100, cursor: str = None):
+    """
+    Newest first, keyset-paginated on (upload_timestamp, id): each page is an
+    index range scan, however deep it is. Pass the cursor of the last row
+    (encode_cursor) to get the next page.
+    """
+    query = _documents_query(db, validated)
+
+    if cursor:
+        timestamp, doc_id = decode_cursor(cursor)
         query = query.filter(
-            (models.Prescription.is_validated == False) | 
-            (models.Prescription.is_validated == None)
+            tuple_(models.Document.upload_timestamp, models.Document.id) < tuple_(timestamp, doc_id)
         )
-        
-    return query.order_by(desc(models.Document.upload_timestamp)).limit(limit).all()
+
+    return (
+        query.order_by(desc(models.Document.upload_timestamp), desc(models.Document.id))
+        .limit(limit)
+        .all()
+    )
+
+def estimate_documents_count(db: Session, validated: bool = None) -> int:
+    """Planner row estimate for the listing (no table scan, unlike COUNT(*))."""
+    statement = _documents_query(db, validated).statement.compile(
+        dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}
+    )
+    plan = db.execute(text(f"EXPLAIN (FORMAT JSON) {statement}")).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
 
 def get_document(db: Session, document_id: uuid.UUID):
     return db.query(models.Document).filter(models.Document.id == document_id).first()
 
+def lock_document(db: Session, document_id: uuid.UUID):
+    """The document, row-locked (SELECT ... FOR UPDATE) until the transaction ends."""
+    return db.query(models.Document).filter(models.Document.id == document_id).with_for_update().first()
+
+def get_documents_by_ids(db: Session, document_ids: list, with_prescription: bool = False):
+    """
+    Fetches many documents in one query (WHERE id = ANY(:ids), a single array
+    parameter whatever the number of ids), optionally with their Prescription.
+    """
+    ids = bindparam("document_ids", list(document_ids), type_=ARRAY(UUID(as_uuid=True)))
+    query = db.query(models.Document).filter(models.Document.id == any_(ids))
+    if with_prescription:
+        query = query.options(joinedload(models.Document.prescription))
+    return query.all()
+
 # --- UPDATE (Machine) ---
-def update_prescription_structure(db: Session, document_id: uuid.UUID, data: dict):
+def update_prescription_structure(db: Session, document_id: uuid.UUID, data: dict, extractor_version: str = None):
     db_doc = get_document(db, document_id)
     if db_doc and db_doc.prescription:
-        # Save to BOTH columns initially
-        db_doc.prescription.structured_json = data 
+        # Save to BOTH columns initially (a re-processed page must not overwrite a human validation)
+        if not db_doc.prescription.is_validated:
+            db_doc.prescription.structured_json = data 
         db_doc.prescription.ai_structured_json = data # <--- NEW: Save backup
+        db_doc.prescription.extractor_version = extractor_version
         db.commit()
         return db_doc.prescription
     return None
 
-def update_document_text(db: Session, document_id: uuid.UUID, text: str):
-    """Updates the document with OCR results and marks it as COMPLETED."""
+def update_document_text(db: Session, document_id: uuid.UUID, text: str, mark_completed: bool = True,
+                         page_sources: list = None):
+    """Updates the document with OCR results (and how each page was read) and (by default) marks it as COMPLETED."""
     db_doc = db.query(models.Document).filter(models.Document.id == document_id).first()
     if db_doc:
         # Create or update the associated Prescription record
@@ -53,13 +213,17 @@ def update_document_text(db: Session, document_id: uuid.UUID, text: str):
             db_presc = models.Prescription(
                 document_id=db_doc.id, 
                 raw_text=text, 
+                page_sources=page_sources,
                 structured_json={}
             )
             db.add(db_presc)
         else:
             db_doc.prescription.raw_text = text
+            db_doc.prescription.page_sources = page_sources
         
-        db_doc.status = models.ProcessingStatus.COMPLETED
+        if mark_completed:
+            db_doc.status = models.ProcessingStatus.COMPLETED
+            notify_document_status(db, document_id, db_doc.status)
         db.commit()
         db.refresh(db_doc)
     return db_doc
@@ -77,6 +241,10 @@ def validate_prescription(db: Session, document_id: uuid.UUID, validated_json: d
         
         # Optionally, we could have a specific status for this
         # db_doc.status = models.ProcessingStatus.VALIDATED 
+
+        # Metrics are computed once here and folded into the running aggregates
+        # (same transaction), so statistics never recompute them.
+        record_prescription_metrics(db, db_doc.prescription, db_doc.site)
         
         db.commit()
         db.refresh(db_doc.prescription)
@@ -89,6 +257,502 @@ def update_document_status(db: Session, document_id: uuid.UUID, status: str, err
         db_doc.status = status
         if error_message:
             print(f"Document {document_id} failed: {error_message}")
+        notify_document_status(db, document_id, status)
         db.commit()
         db.refresh(db_doc)
-    return db_doc
\ No newline at end of file
+    return db_doc
+
+# --- PAGES ---
+def init_document_pages(db: Session, document_id: uuid.UUID, page_count: int):
+    """Creates the missing page rows (PENDING) of a document."""
+    rows = [
+        {"id": uuid.uuid4(), "document_id": document_id, "page_number": n, "status": models.ProcessingStatus.PENDING}
+        for n in range(1, page_count + 1)
+    ]
+    if rows:
+        stmt = pg_insert(models.DocumentPage).values(rows)
+        db.execute(stmt.on_conflict_do_nothing(index_elements=["document_id", "page_number"]))
+    db.commit()
+
+def cached_page_rows(document_id: uuid.UUID, file_path: str, cached: models.ResultCache) -> list:
+    """
+    COMPLETED page rows of a document served from the result cache: text and
+    how each page was read. The cache has neither word boxes nor per-page
+    extractions; the latter are redone if the document is rebuilt from its
+    pages (page retry).
+    """
+    sources = {s["page"]: s for s in cached.page_sources or []}
+    return [
+        {"id": uuid.uuid4(), "document_id": document_id, "page_number": n,
+         "status": models.ProcessingStatus.COMPLETED, "text": text,
+         "source": sources.get(n, {}).get("source"), "confidence": sources.get(n, {}).get("confidence"),
+         "tier": sources.get(n, {}).get("tier")}
+        for n, text in enumerate(split_pages(file_path, cached.raw_text), 1)
+    ]
+
+def save_cached_pages(db: Session, document_id: uuid.UUID, file_path: str, cached: models.ResultCache):
+    """Replaces the page rows of a document (e.g. left by a failed attempt) with the cached pages. Does not commit."""
+    db.execute(delete(models.DocumentPage).where(models.DocumentPage.document_id == document_id))
+    rows = cached_page_rows(document_id, file_path, cached)
+    if rows:
+        db.execute(insert(models.DocumentPage), rows)
+
+def get_document_pages(db: Session, document_id: uuid.UUID, page_numbers: list = None):
+    query = db.query(models.DocumentPage).filter(models.DocumentPage.document_id == document_id)
+    if page_numbers:
+        query = query.filter(models.DocumentPage.page_number.in_(page_numbers))
+    return query.order_by(models.DocumentPage.page_number).all()
+
+def save_document_page(db: Session, document_id: uuid.UUID, page_number: int, **fields):
+    """Updates one page and commits at once, so that it is readable before the rest of the document."""
+    db.query(models.DocumentPage).filter(
+        models.DocumentPage.document_id == document_id,
+        models.DocumentPage.page_number == page_number
+    ).update(fields, synchronize_session=False)
+    db.commit()
+
+def requeue_document_page(db: Session, db_doc: models.Document, page_number: int) -> models.Job:
+    """
+    Resets a page, marks its document PENDING and queues the job that
+    re-processes the page, in one commit (the status notification is sent
+    with it). Lock the document first (lock_document): a worker cannot claim
+    the job before the document is PENDING.
+    """
+    db.query(models.DocumentPage).filter(
+        models.DocumentPage.document_id == db_doc.id,
+        models.DocumentPage.page_number == page_number
+    ).update({"status": models.ProcessingStatus.PENDING, "error": None}, synchronize_session=False)
+    db_doc.status = models.ProcessingStatus.PENDING
+    notify_document_status(db, db_doc.id, db_doc.status)
+    job = enqueue_job(db, document_id=db_doc.id, payload={"pages": [page_number]}, commit=False)
+    db.commit()
+    db.refresh(job)
+    return job
+
+# --- RE-EXTRACTION ---
+def stream_stale_prescriptions(db: Session, extractor_version: str, batch_size: int = 1000):
+    """
+    Yields batches of (id, raw_text, is_validated) rows whose extraction is not
+    at `extractor_version`, through a server-side cursor (yield_per): memory
+    stays flat whatever the number of rows. Use a session that is not
+    committed meanwhile, as a commit closes the cursor.
+    """
+    stmt = (
+        select(models.Prescription.id, models.Prescription.raw_text, models.Prescription.is_validated)
+        .where(
+            models.Prescription.raw_text != None,
+            models.Prescription.extractor_version.is_distinct_from(extractor_version)
+        )
+        .execution_options(yield_per=batch_size)
+    )
+    yield from db.execute(stmt).partitions(batch_size)
+
+def save_reextracted(db: Session, rows: list, results: list, extractor_version: str) -> int:
+    """
+    Writes a batch of re-extraction results (one executemany UPDATE) and
+    commits it. Unvalidated prescriptions get them as structured_json too;
+    validated ones keep the human version and get their metrics refreshed.
+    Rows updated meanwhile by the pipeline (already at the version) are left alone.
+    Returns the number of rows updated.
+    """
+    table = models.Prescription.__table__
+    new_json = bindparam("new_json", type_=table.c.ai_structured_json.type)
+    stmt = (
+        update(table)
+        .where(table.c.id == bindparam("prescription_id"),
+               table.c.extractor_version.is_distinct_from(extractor_version))
+        .values(
+            ai_structured_json=new_json,
+            structured_json=case((table.c.is_validated == True, table.c.structured_json), else_=new_json),
+            extractor_version=extractor_version
+        )
+    )
+    params = [{"prescription_id": row.id, "new_json": result} for row, result in zip(rows, results)]
+    updated = db.execute(stmt, params).rowcount if params else 0
+
+    refresh_prescription_metrics(db, [row.id for row in rows if row.is_validated])
+    db.commit()
+    return updated
+
+# --- JOB QUEUE ---
+def enqueue_job(db: Session, document_id: uuid.UUID = None, kind: str = "process_document",
+                payload: dict = None, max_attempts: int = 5, commit: bool = True):
+    job = models.Job(
+        kind=kind,
+        document_id=document_id,
+        payload=payload,
+        max_attempts=max_attempts,
+        status=models.JobStatus.QUEUED
+    )
+    db.add(job)
+    if commit:
+        db.commit()
+        db.refresh(job)
+    return job
+
+def claim_job(db: Session, worker_id: str, lease_seconds: int, base_delay: float = 5.0, max_delay: float = 600.0):
+    """
+    Atomically claims the next due job.
+    SKIP LOCKED lets concurrent workers claim different rows without blocking.
+    A job whose lease expired lost its worker (crash, OOM kill...): that
+    counts as a failed attempt, so it is rescheduled with backoff or FAILED
+    once max_attempts is reached, like in fail_job, instead of being run
+    again at once.
+    """
+    while True:
+        job = (
+            db.query(models.Job)
+            .filter(or_(
+                and_(models.Job.status == models.JobStatus.QUEUED, models.Job.run_after <= func.now()),
+                and_(models.Job.status == models.JobStatus.RUNNING, models.Job.lease_expires_at < func.now()),
+            ))
+            .order_by(models.Job.run_after)
+            .with_for_update(skip_locked=True)
+            .limit(1)
+            .first()
+        )
+        if not job:
+            db.rollback()
+            return None
+
+        if job.status == models.JobStatus.RUNNING:
+            print(f"Job {job.id} lost its worker {job.locked_by} (lease expired)")
+            _retry_or_fail(db, job, f"Lease expired (worker {job.locked_by} lost)", base_delay, max_delay)
+            db.commit()
+            continue
+
+        job.status = models.JobStatus.RUNNING
+        job.locked_by = worker_id
+        job.attempts += 1
+        job.heartbeat_at = func.now()
+        job.lease_expires_at = func.now() + datetime.timedelta(seconds=lease_seconds)
+        db.commit()
+        db.refresh(job)
+        return job
+
+def heartbeat_job(db: Session, job_id: uuid.UUID, worker_id: str, lease_seconds: int) -> bool:
+    """Extends the lease. Returns False if the job is no longer ours."""
+    result = db.execute(
+        update(models.Job)
+        .where(models.Job.id == job_id, models.Job.locked_by == worker_id,
+               models.Job.status == models.JobStatus.RUNNING)
+        .values(
+            heartbeat_at=func.now(),
+            lease_expires_at=func.now() + datetime.timedelta(seconds=lease_seconds)
+        )
+    )
+    db.commit()
+    return result.rowcount == 1
+
+def complete_job(db: Session, job_id: uuid.UUID, worker_id: str):
+    db.execute(
+        update(models.Job)
+        .where(models.Job.id == job_id, models.Job.locked_by == worker_id)
+        .values(status=models.JobStatus.DONE, locked_by=None, lease_expires_at=None,
+                finished_at=func.now(), last_error=None)
+    )
+    db.commit()
+
+def fail_job(db: Session, job_id: uuid.UUID, worker_id: str, error_message: str,
+             base_delay: float = 5.0, max_delay: float = 600.0):
+    """
+    Reschedules the job with exponential backoff, or marks it FAILED
+    (together with its document) once max_attempts is reached.
+    Returns True if the job will be retried.
+    """
+    job = db.query(models.Job).filter(models.Job.id == job_id).with_for_update().first()
+    if not job or job.locked_by != worker_id:
+        db.rollback()
+        return False
+
+    retried = _retry_or_fail(db, job, error_message, base_delay, max_delay)
+    db.commit()
+    return retried
+
+def _retry_or_fail(db: Session, job: models.Job, error_message: str, base_delay: float, max_delay: float) -> bool:
+    """Ends a failed attempt of a locked job (see fail_job). Does not commit."""
+    job.last_error = error_message
+    job.locked_by = None
+    job.lease_expires_at = None
+
+    if job.attempts < job.max_attempts:
+        delay = min(max_delay, base_delay * (2 ** (job.attempts - 1)))
+        job.status = models.JobStatus.QUEUED
+        job.run_after = func.now() + datetime.timedelta(seconds=delay)
+        if job.document_id:
+            _set_document_status(db, job.document_id, models.ProcessingStatus.PENDING)
+        return True
+
+    job.status = models.JobStatus.FAILED
+    job.finished_at = func.now()
+    if job.document_id:
+        _set_document_status(db, job.document_id, models.ProcessingStatus.FAILED)
+    print(f"Job {job.id} failed permanently after {job.attempts} attempts: {error_message}")
+    return False
+
+def _set_document_status(db: Session, document_id: uuid.UUID, status):
+    db.execute(
+        update(models.Document)
+        .where(models.Document.id == document_id)
+        .values(status=status)
+    )
+    notify_document_status(db, document_id, status)
+
+# --- RESULT CACHE ---
+def _cache_key(content_hash: str, ocr_config: str, extractor_version: str) -> str:
+    return f"{content_hash}|{ocr_config}|{extractor_version}"
+
+def get_cached_result(db: Session, content_hash: str, ocr_config: str, extractor_version: str):
+    """Returns the cached result (and marks it as recently used), or None."""
+    if not content_hash:
+        return None
+    key = _cache_key(content_hash, ocr_config, extractor_version)
+    cached = db.query(models.ResultCache).filter(models.ResultCache.cache_key == key).first()
+    if cached:
+        cached.last_accessed_at = func.now()
+        cached.hits += 1
+        db.commit()
+        db.refresh(cached)
+    return cached
+
+def get_cached_results(db: Session, content_hashes: list, ocr_config: str, extractor_version: str) -> dict:
+    """Batch version of get_cached_result. Returns {content_hash: ResultCache}."""
+    keys = {_cache_key(h, ocr_config, extractor_version): h for h in set(content_hashes) if h}
+    if not keys:
+        return {}
+    cached = db.query(models.ResultCache).filter(models.ResultCache.cache_key.in_(list(keys))).all()
+    if cached:
+        db.execute(
+            update(models.ResultCache)
+            .where(models.ResultCache.cache_key.in_([c.cache_key for c in cached]))
+            .values(last_accessed_at=func.now(), hits=models.ResultCache.hits + 1)
+        )
+        db.commit()
+    return {c.content_hash: c for c in cached}
+
+def store_cached_result(db: Session, content_hash: str, ocr_config: str, extractor_version: str,
+                        raw_text: str, structured_json: dict, max_bytes: int, page_sources: list = None):
+    """Upserts a result, then evicts least recently used entries beyond max_bytes."""
+    size_bytes = len((raw_text or "").encode("utf-8")) + len(json.dumps(structured_json or {}))
+    values = dict(
+        cache_key=_cache_key(content_hash, ocr_config, extractor_version),
+        content_hash=content_hash,
+        ocr_config=ocr_config,
+        extractor_version=extractor_version,
+        raw_text=raw_text,
+        structured_json=structured_json,
+        page_sources=page_sources,
+        size_bytes=size_bytes,
+        hits=0
+    )
+    stmt = pg_insert(models.ResultCache).values(**values)
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=[models.ResultCache.cache_key],
+        set_=dict(raw_text=stmt.excluded.raw_text, structured_json=stmt.excluded.structured_json,
+                  page_sources=stmt.excluded.page_sources, size_bytes=stmt.excluded.size_bytes, last_accessed_at=func.now())
+    ))
+
+    # LRU eviction: drop everything past the first max_bytes of most recently used entries
+    total = db.query(func.coalesce(func.sum(models.ResultCache.size_bytes), 0)).scalar()
+    if total > max_bytes:
+        running = (
+            select(
+                models.ResultCache.cache_key,
+                func.sum(models.ResultCache.size_bytes).over(
+                    order_by=(desc(models.ResultCache.last_accessed_at), models.ResultCache.cache_key)
+                ).label("running_bytes")
+            ).subquery()
+        )
+        db.execute(
+            delete(models.ResultCache)
+            .where(models.ResultCache.cache_key.in_(
+                select(running.c.cache_key).where(running.c.running_bytes > max_bytes)
+            ))
+        )
+    db.commit()
+
+# --- METRICS ---
+metrics_service = MetricsService()
+
+# PrescriptionMetrics column -> MetricsAggregate running sum
+_AGGREGATED_METRICS = {
+    "precision": "sum_precision",
+    "recall": "sum_recall",
+    "f1_score": "sum_f1",
+    "similarity_score": "sum_similarity",
+    "true_positives": "sum_true_positives",
+    "false_positives": "sum_false_positives",
+    "false_negatives": "sum_false_negatives",
+}
+
+def _metrics_values(stats: dict) -> dict:
+    """MetricsService output -> PrescriptionMetrics columns."""
+    return {
+        "precision": stats["precision"],
+        "recall": stats["recall"],
+        "f1_score": stats["f1_score"],
+        "similarity_score": stats["similarity_score"],
+        "true_positives": stats["details"]["true_positives"],
+        "false_positives": stats["details"]["false_positives"],
+        "false_negatives": stats["details"]["false_negatives"],
+    }
+
+def _apply_to_aggregates(db: Session, metrics: models.PrescriptionMetrics, sign: int):
+    """Adds (sign=1) or removes (sign=-1) one document from its (site, day) running sums."""
+    values = {"site": metrics.site, "day": metrics.validated_day, "count": sign}
+    for column, sum_column in _AGGREGATED_METRICS.items():
+        values[sum_column] = sign * getattr(metrics, column)
+
+    stmt = pg_insert(models.MetricsAggregate).values(**values)
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=[models.MetricsAggregate.site, models.MetricsAggregate.day],
+        set_={
+            column: getattr(models.MetricsAggregate, column) + getattr(stmt.excluded, column)
+            for column in ["count", *_AGGREGATED_METRICS.values()]
+        }
+    ))
+
+def record_prescription_metrics(db: Session, prescription: models.Prescription, site: str = None):
+    """
+    Stores the metrics of a validated prescription and updates the aggregates.
+    Re-validation replaces the previous contribution. Does not commit.
+    """
+    if not prescription.ai_structured_json:
+        return None
+
+    metrics = db.get(models.PrescriptionMetrics, prescription.id)
+    if metrics:
+        _apply_to_aggregates(db, metrics, -1)
+    else:
+        metrics = models.PrescriptionMetrics(prescription_id=prescription.id, document_id=prescription.document_id)
+        db.add(metrics)
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    metrics.site = site or ""
+    metrics.validated_at = now
+    metrics.validated_day = now.date()
+    stats = metrics_service.calculate_metrics(prescription.ai_structured_json, prescription.structured_json)
+    for column, value in _metrics_values(stats).items():
+        setattr(metrics, column, value)
+
+    _apply_to_aggregates(db, metrics, 1)
+    return metrics
+
+def refresh_prescription_metrics(db: Session, prescription_ids: list):
+    """
+    Rescores validated prescriptions whose AI extraction changed (e.g. after a
+    re-extraction) and moves their contribution in the aggregates. Keeps the
+    validation date. Prescriptions without stored metrics are left to
+    rebuild_metrics. Does not commit.
+    """
+    if not prescription_ids:
+        return
+    rows = (
+        db.query(models.PrescriptionMetrics, models.Prescription)
+        .join(models.Prescription, models.PrescriptionMetrics.prescription_id == models.Prescription.id)
+        .filter(models.PrescriptionMetrics.prescription_id.in_(prescription_ids))
+        .all()
+    )
+    all_stats = metrics_service.calculate_metrics_batch(
+        [(p.ai_structured_json, p.structured_json) for _, p in rows]
+    )
+    for (metrics, _), stats in zip(rows, all_stats):
+        _apply_to_aggregates(db, metrics, -1)
+        for column, value in _metrics_values(stats).items():
+            setattr(metrics, column, value)
+        _apply_to_aggregates(db, metrics, 1)
+
+def get_metrics_summary(db: Session, since: datetime.date = None, until: datetime.date = None,
+                        site: str = None, group_by: str = None):
+    """
+    Sums the running aggregates over a time window (optionally one site).
+    group_by: None, "site" or "day". Returns rows with count + sums.
+    """
+    agg = models.MetricsAggregate
+    group_column = {"site": agg.site, "day": agg.day}.get(group_by)
+
+    columns = [func.sum(agg.count).label("count")]
+    columns += [func.sum(getattr(agg, c)).label(c) for c in _AGGREGATED_METRICS.values()]
+    if group_column is not None:
+        columns.insert(0, group_column.label("key"))
+
+    query = db.query(*columns)
+    if since:
+        query = query.filter(agg.day >= since)
+    if until:
+        query = query.filter(agg.day <= until)
+    if site is not None:
+        query = query.filter(agg.site == site)
+    if group_column is not None:
+        query = query.group_by(group_column).order_by(group_column)
+    return query.all()
+
+def rebuild_metrics(db: Session, batch_size: int = 1000):
+    """
+    Recomputes every PrescriptionMetrics row and the aggregates from scratch
+    (also a backfill for documents validated before metrics were stored).
+    Stored validation times are kept; the upload time is only used for the
+    prescriptions without stored metrics, whose validation time is unknown.
+    """
+    m = models.PrescriptionMetrics
+    db.execute(delete(models.MetricsAggregate))
+    # Metrics of prescriptions that are no longer validated
+    db.execute(delete(m).where(~exists().where(
+        models.Prescription.id == m.prescription_id,
+        models.Prescription.is_validated == True,
+        models.Prescription.ai_structured_json != None
+    )))
+
+    rows = (
+        db.query(models.Prescription, models.Document.site, models.Document.upload_timestamp)
+        .join(models.Document, models.Prescription.document_id == models.Document.id)
+        .filter(models.Prescription.is_validated == True, models.Prescription.ai_structured_json != None)
+        .execution_options(yield_per=batch_size)
+    )
+
+    def flush(batch):
+        # Whole batch scored in one vectorized pass
+        all_stats = metrics_service.calculate_metrics_batch(
+            [(p.ai_structured_json, p.structured_json) for p, _, _ in batch]
+        )
+        stmt = pg_insert(m)
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=[m.prescription_id],
+            # validated_at / validated_day of existing rows are left as they are
+            set_={column: getattr(stmt.excluded, column)
+                  for column in ["document_id", "site", *_AGGREGATED_METRICS]}
+        ), [
+            {
+                "prescription_id": p.id,
+                "document_id": p.document_id,
+                "site": site or "",
+                "validated_at": uploaded_at,
+                "validated_day": uploaded_at.date(),
+                **_metrics_values(stats)
+            }
+            for (p, site, uploaded_at), stats in zip(batch, all_stats)
+        ])
+
+    batch, total = [], 0
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            flush(batch)
+            total += len(batch)
+            batch = []
+    if batch:
+        flush(batch)
+        total += len(batch)
+
+    # Aggregates in one INSERT ... SELECT ... GROUP BY
+    db.execute(
+        insert(models.MetricsAggregate).from_select(
+            ["site", "day", "count", *_AGGREGATED_METRICS.values()],
+            select(m.site, m.validated_day, func.count(),
+                   *[func.sum(getattr(m, c)) for c in _AGGREGATED_METRICS])
+            .group_by(m.site, m.validated_day)
+        )
+    )
+    db.commit()
+    print(f"Rebuilt metrics for {total} validated documents")
+    return total
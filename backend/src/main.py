@@ -2,10 +2,12 @@ import os
 from fastapi import FastAPI
 from src.database import engine
 from src import models
+from src.migrations import run_migrations
 from src.routers import documents, admin, statistics
 
-# 1. Create Database Tables
+# 1. Create Database Tables (and upgrade the existing ones)
 models.Base.metadata.create_all(bind=engine)
+run_migrations(engine)
 
 # 2. Initialize App
 app = FastAPI(
@@ -0,0 +1,248 @@
+"""
+Microbenchmarks of the pure-Python hot paths, on fixed synthetic inputs.
+No Docker, Tesseract or Postgres needed:
+
+    cd backend && python -m src.microbenchmarks                 # compare with the baseline
+    cd backend && python -m src.microbenchmarks --save-baseline # record a new baseline
+
+Covers ExtractionService.extract_from_text, MetricsService.calculate_metrics /
+aggregate_stats, PrescriptionGenerator._render_image / apply_scan_effects and
+the frontend's convert_to_fhir, at 1, 10 and 100 medicines per prescription
+(1k to 1M prescriptions for the aggregation).
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+from types import SimpleNamespace
+import numpy as np
+from src.modules.extraction.service import ExtractionService
+from src.modules.evaluation.service import MetricsService
+from src.modules.generator.service import PrescriptionGenerator, OrdoDoc, LineItem
+
+# Configuration
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "microbenchmarks_baseline.json")
+FRONTEND_SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "frontend", "src")
+SEED = 1234
+MEDICINE_COUNTS = (1, 10, 100)
+AGGREGATE_SIZES = (1_000, 10_000, 100_000, 1_000_000)
+# Distinct prescriptions behind the aggregation inputs (larger sizes reuse them)
+AGGREGATE_POOL = 1_000
+# Minimum measured time per repeat; calls are looped until reached
+MIN_REPEAT_SECONDS = 0.2
+REPEATS = 5
+# Slowdown (current / baseline) reported as a regression
+DEFAULT_TOLERANCE = 1.25
+
+DRUGS = ["DOLIPRANE", "AMOXICILLINE", "VOLTARENE", "IBUPROFENE", "METFORMINE", "LEVOTHYROX",
+         "KARDEGIC", "SPASFON", "SMECTA", "XANAX", "AUGMENTIN", "INEXIUM", "TAHOR", "LASILIX"]
+UNITS = ["mg", "g", "ml"]
+FORMS = ["comprimé", "gélule", "sachet"]
+
+# --- FIXED INPUTS ---
+
+def make_medicines(count: int, rng: random.Random) -> list:
+    return [
+        {
+            "drug_name": f"{rng.choice(DRUGS)} {i}",
+            "dosage": f"{rng.choice([5, 20, 100, 500, 1000])}{rng.choice(UNITS)}",
+            "raw_instruction": f"1 {rng.choice(FORMS)}, {rng.randint(1, 4)} fois par jour",
+            "standardized_code": None,
+            "code_confidence": None
+        }
+        for i in range(count)
+    ]
+
+def make_text(medicines: list) -> str:
+    lines = ["ORDONNANCE", "Dr. Martin", "Patient : Jean Dupont", "Le 12/12/2024"]
+    lines += [f"{i}. {m['drug_name']} {m['dosage']} {m['raw_instruction']}" for i, m in enumerate(medicines, 1)]
+    return "\n".join(lines)
+
+def make_validated(medicines: list, rng: random.Random) -> list:
+    """A human correction of `medicines`: some typos, one removed, one added."""
+    human = []
+    for m in medicines:
+        m = dict(m)
+        if rng.random() < 0.2:
+            name = list(m["drug_name"])
+            name[rng.randrange(len(name))] = "X"
+            m["drug_name"] = "".join(name)
+        if rng.random() < 0.1:
+            m["dosage"] = ""
+        human.append(m)
+    if len(human) > 1:
+        human.pop(rng.randrange(len(human)))
+    human.extend(make_medicines(1, rng))
+    return human
+
+def make_structured(medicines: list) -> dict:
+    return {"patient": "Jean Dupont", "doctor": "Martin", "date": "12/12/2024", "medicines": medicines}
+
+def make_prescriptions(count: int, rng: random.Random) -> list:
+    """Validated prescription rows (as aggregate_stats reads them), from a pool of distinct ones."""
+    pool = []
+    for _ in range(min(count, AGGREGATE_POOL)):
+        ai = make_medicines(rng.randint(1, 5), rng)
+        pool.append(SimpleNamespace(
+            is_validated=True,
+            ai_structured_json=make_structured(ai),
+            structured_json=make_structured(make_validated(ai, rng))
+        ))
+    return [pool[i % len(pool)] for i in range(count)]
+
+def make_doc(medicines: list) -> OrdoDoc:
+    return OrdoDoc(
+        patient_name="Patient 123",
+        prescriber_name="Dr. House",
+        date_str="12/12/2024",
+        lines=[LineItem(m["drug_name"], m["dosage"], m["raw_instruction"], "comprimé") for m in medicines]
+    )
+
+def load_convert_to_fhir():
+    """The frontend helper, if the frontend sources are next to the backend."""
+    sys.path.insert(0, os.path.abspath(FRONTEND_SRC))
+    try:
+        from utils import convert_to_fhir
+        return convert_to_fhir
+    except ImportError:
+        return None
+    finally:
+        sys.path.pop(0)
+
+# --- CASES ---
+
+def build_cases(max_prescriptions: int = None) -> list:
+    """(name, callable) pairs. Inputs are built once, outside the timings."""
+    rng = random.Random(SEED)
+    extraction = ExtractionService()
+    metrics = MetricsService()
+    generator = PrescriptionGenerator()
+    convert_to_fhir = load_convert_to_fhir()
+    cases = []
+
+    for n in MEDICINE_COUNTS:
+        medicines = make_medicines(n, rng)
+        text = make_text(medicines)
+        ai, human = make_structured(medicines), make_structured(make_validated(medicines, rng))
+        doc = make_doc(medicines)
+        image, _ = generator._render_image(doc)
+
+        def scan_effects(image=image):
+            return generator.apply_scan_effects(image, random.Random(SEED), np.random.default_rng(SEED))
+
+        cases += [
+            (f"extraction.extract_from_text[meds={n}]", lambda text=text: extraction.extract_from_text(text)),
+            (f"metrics.calculate_metrics[meds={n}]", lambda ai=ai, human=human: metrics.calculate_metrics(ai, human)),
+            (f"generator.render_image[meds={n}]", lambda doc=doc: generator._render_image(doc)),
+            (f"generator.apply_scan_effects[meds={n}]", scan_effects),
+        ]
+        if convert_to_fhir is not None:
+            cases.append((f"fhir.convert_to_fhir[meds={n}]", lambda data=human: convert_to_fhir(data)))
+
+    for size in AGGREGATE_SIZES:
+        if max_prescriptions and size > max_prescriptions:
+            continue
+        prescriptions = make_prescriptions(size, rng)
+        cases.append((f"metrics.aggregate_stats[n={size}]", lambda p=prescriptions: metrics.aggregate_stats(p)))
+
+    if convert_to_fhir is None:
+        print(f"Skipping convert_to_fhir: frontend sources not found in {FRONTEND_SRC}")
+    return cases
+
+def measure(fn) -> dict:
+    """Best and median seconds per call over REPEATS timed loops."""
+    # Calibrate the loop count on a first (warm-up) call
+    start = time.perf_counter()
+    fn()
+    single = time.perf_counter() - start
+    loops = max(1, int(MIN_REPEAT_SECONDS / single)) if single > 0 else 1000
+
+    per_call = []
+    for _ in range(REPEATS if single < MIN_REPEAT_SECONDS * 5 else 1):
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        per_call.append((time.perf_counter() - start) / loops)
+    return {"best_s": min(per_call), "median_s": float(np.median(per_call)), "loops": loops}
+
+def run(max_prescriptions: int = None, only: str = None) -> dict:
+    results = {}
+    for name, fn in build_cases(max_prescriptions):
+        if only and only not in name:
+            continue
+        results[name] = measure(fn)
+        print(f"{name:<45} {_format(results[name]['best_s']):>10}")
+    return results
+
+def compare(results: dict, baseline: dict, tolerance: float = DEFAULT_TOLERANCE) -> list:
+    """Cases slower than `tolerance` x their baseline time (best of repeats)."""
+    regressions = []
+    print(f"\n{'case':<45} {'baseline':>10} {'current':>10} {'ratio':>7}")
+    for name, current in results.items():
+        reference = baseline.get("results", {}).get(name)
+        if reference is None:
+            print(f"{name:<45} {'-':>10} {_format(current['best_s']):>10}")
+            continue
+        ratio = current["best_s"] / reference["best_s"]
+        flag = "  REGRESSION" if ratio > tolerance else ""
+        print(f"{name:<45} {_format(reference['best_s']):>10} {_format(current['best_s']):>10} {ratio:>6.2f}x{flag}")
+        if ratio > tolerance:
+            regressions.append(name)
+    return regressions
+
+def _format(seconds: float) -> str:
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.2f}{unit}"
+    return f"{seconds / 1e-9:.0f}ns"
+
+def _machine() -> dict:
+    return {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()}
+
+def _same_environment(recorded: dict, current: dict) -> bool:
+    """Same Python minor version and CPU count (the platform string may differ)."""
+    minor = lambda version: ".".join(str(version).split(".")[:2])
+    return minor(recorded.get("python")) == minor(current["python"]) and recorded.get("cpus") == current["cpus"]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Microbenchmarks of the extraction, metrics, generator and FHIR code.")
+    parser.add_argument("--save-baseline", action="store_true", help=f"Record the results in {BASELINE_PATH}.")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="Baseline file to compare with / write.")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="Slowdown ratio reported as a regression (exit code 1).")
+    parser.add_argument("--max-prescriptions", type=int, default=None,
+                        help="Skip aggregation sizes above this (e.g. 100000 for a quick run).")
+    parser.add_argument("--only", default=None, help="Only run the cases whose name contains this string.")
+    parser.add_argument("--any-machine", action="store_true",
+                        help="Compare even with a baseline from another Python version or CPU count.")
+    args = parser.parse_args()
+
+    results = run(args.max_prescriptions, args.only)
+
+    if args.save_baseline:
+        previous = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                previous = json.load(f).get("results", {})
+        with open(args.baseline, "w") as f:
+            # Partial runs (--only / --max-prescriptions) keep the other cases
+            json.dump({"machine": _machine(), "results": {**previous, **results}}, f, indent=2, sort_keys=True)
+        print(f"\nBaseline written to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        recorded, current = baseline.get("machine") or {}, _machine()
+        if not args.any_machine and not _same_environment(recorded, current):
+            # Another interpreter or core count: timings cannot be gated on
+            sys.exit(f"\nBaseline recorded on {recorded}, not comparable with {current}. Record one here "
+                     f"with --save-baseline (reference: the backend image), or pass --any-machine.")
+        if recorded != current:
+            print(f"\nNote: baseline recorded on {recorded}, timings may not be comparable.")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            sys.exit(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+    else:
+        print(f"\nNo baseline at {args.baseline}: run with --save-baseline to record one.")
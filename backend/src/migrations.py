@@ -0,0 +1,62 @@
+"""
+Schema upgrades of existing databases.
+
+`Base.metadata.create_all` creates the missing tables but never alters the
+existing ones, so the columns and indexes added to them since are applied
+here at startup (API and workers). Every step is idempotent: a fresh
+database (already complete after create_all) or an up-to-date one is left
+as is.
+"""
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+# (table, column, SQL type) added to tables that existed before them
+COLUMNS = [
+    # Upload deduplication
+    ("documents", "content_hash", "VARCHAR(64)"),
+    # Per-site validation statistics
+    ("documents", "site", "VARCHAR"),
+    # How each page was read (PDF text layer or OCR)
+    ("prescriptions", "page_sources", "JSONB"),
+    ("result_cache", "page_sources", "JSONB"),
+    # Version of the AI extraction (bulk re-extraction)
+    ("prescriptions", "extractor_version", "VARCHAR"),
+    # Version of the per-page extractions (stale ones are redone before merging)
+    ("document_pages", "extractor_version", "VARCHAR"),
+]
+
+# (index name, table, columns), built without blocking writes
+INDEXES = [
+    ("ix_documents_content_hash", "documents", "content_hash"),
+    # Keyset pagination and validated filters of the library
+    ("ix_documents_upload_timestamp_id", "documents", "upload_timestamp, id"),
+    ("ix_prescriptions_document_validated", "prescriptions", "document_id, is_validated"),
+]
+
+# pg_advisory_lock key: the API and the workers may start at the same time
+MIGRATION_LOCK_ID = 720_431_001
+
+def _drop_invalid_index(conn, name: str):
+    # An interrupted CREATE INDEX CONCURRENTLY leaves an invalid index that
+    # IF NOT EXISTS would then skip for good
+    invalid = conn.execute(text(
+        "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+        "WHERE c.relname = :name AND NOT i.indisvalid"
+    ), {"name": name}).first()
+    if invalid:
+        print(f"Dropping invalid index {name}")
+        conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"'))
+
+def run_migrations(engine: Engine):
+    """Adds the missing columns, then builds the missing indexes (CONCURRENTLY, outside a transaction)."""
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("SELECT pg_advisory_lock(:id)"), {"id": MIGRATION_LOCK_ID})
+        try:
+            for table, column, sql_type in COLUMNS:
+                conn.execute(text(f'ALTER TABLE "{table}" ADD COLUMN IF NOT EXISTS "{column}" {sql_type}'))
+
+            for name, table, columns in INDEXES:
+                _drop_invalid_index(conn, name)
+                conn.execute(text(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS "{name}" ON "{table}" ({columns})'))
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": MIGRATION_LOCK_ID})
@@ -1,6 +1,7 @@
 import uuid
 import enum
-from sqlalchemy import Column, String, Boolean, DateTime, ForeignKey, Enum, Text
+from sqlalchemy import (Column, String, Boolean, DateTime, ForeignKey, Enum, Text, Integer, Index, Float, Date,
+                        UniqueConstraint)
 from sqlalchemy.dialects.postgresql import UUID, JSONB
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
@@ -20,6 +21,8 @@ class Document(Base):
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, index=True)
     filename = Column(String, nullable=False)
     file_path = Column(String, nullable=False) # Internal path in Docker volume
+    content_hash = Column(String(64), nullable=True, index=True) # SHA-256 of the uploaded bytes
+    site = Column(String, nullable=True) # Uploading site/clinic, for per-site statistics
     
     # Enum column
     status = Column(Enum(ProcessingStatus), default=ProcessingStatus.PENDING)
@@ -29,6 +32,13 @@ class Document(Base):
 
     # Relationship to the extraction result
     prescription = relationship("Prescription", back_populates="document", uselist=False)
+    # Per-page results, filled in as pages complete
+    pages = relationship("DocumentPage", back_populates="document", order_by="DocumentPage.page_number")
+
+    __table_args__ = (
+        # Keyset pagination of the library (ORDER BY upload_timestamp DESC, id DESC)
+        Index("ix_documents_upload_timestamp_id", "upload_timestamp", "id"),
+    )
 
 # ... imports ...
 
@@ -39,9 +49,14 @@ class Prescription(Base):
     document_id = Column(UUID(as_uuid=True), ForeignKey("documents.id"))
     
     raw_text = Column(Text, nullable=True)
+    # How each page was read: [{"page": 1, "source": "text" | "ocr", "chars", "confidence", "tier"}]
+    # (words and per-page details: DocumentPage)
+    page_sources = Column(JSONB, nullable=True)
     
     # NEW: Stores the original AI output (Read-Only for reference)
     ai_structured_json = Column(JSONB, nullable=True)
+    # ExtractionService.version that produced ai_structured_json (bulk re-extraction skips current rows)
+    extractor_version = Column(String, nullable=True)
     
     # Stores the Current/Final version (Editable)
     structured_json = Column(JSONB, nullable=True)
@@ -49,4 +64,146 @@ class Prescription(Base):
     is_validated = Column(Boolean, default=False)
 
     document = relationship("Document", back_populates="prescription")
-    
\ No newline at end of file
+
+    __table_args__ = (
+        # Validated / to-validate filters of the library (EXISTS lookups per document)
+        Index("ix_prescriptions_document_validated", "document_id", "is_validated"),
+    )
+
+class DocumentPage(Base):
+    """
+    OCR + extraction result of one page. Committed as soon as the page is
+    done: results can be read while the rest of the document is processed,
+    and a failed page is retried alone.
+    """
+    __tablename__ = "document_pages"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    document_id = Column(UUID(as_uuid=True), ForeignKey("documents.id"), nullable=False)
+    page_number = Column(Integer, nullable=False)  # From 1
+    status = Column(Enum(ProcessingStatus), nullable=False, default=ProcessingStatus.PENDING)
+
+    source = Column(String, nullable=True)  # "text" (embedded PDF text) or "ocr"
+    text = Column(Text, nullable=True)
+    structured_json = Column(JSONB, nullable=True)  # Extraction of this page alone
+    extractor_version = Column(String, nullable=True)  # Of structured_json (None: not extracted yet)
+    confidence = Column(Float, nullable=True)  # Mean OCR word confidence (0-100)
+    tier = Column(Integer, nullable=True)  # Highest OCR tier used (0: no OCR)
+    words = Column(JSONB, nullable=True)  # [{"text", "conf", "box", "line", "tier"}]
+    timings = Column(JSONB, nullable=True)  # ms per stage
+    error = Column(Text, nullable=True)
+
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    document = relationship("Document", back_populates="pages")
+
+    __table_args__ = (
+        UniqueConstraint("document_id", "page_number", name="uq_document_pages_document_page"),
+    )
+
+# Enum for the lifecycle of a queued job
+class JobStatus(str, enum.Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+class Job(Base):
+    """
+    Durable work queue consumed by `src.worker`.
+    Workers claim rows with SELECT ... FOR UPDATE SKIP LOCKED and keep them
+    leased through heartbeats, so a crashed worker's job is picked up again.
+    """
+    __tablename__ = "jobs"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    kind = Column(String, nullable=False, default="process_document")
+    document_id = Column(UUID(as_uuid=True), ForeignKey("documents.id"), nullable=True, index=True)
+    payload = Column(JSONB, nullable=True)
+
+    status = Column(Enum(JobStatus), nullable=False, default=JobStatus.QUEUED)
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=5)
+    last_error = Column(Text, nullable=True)
+
+    # Scheduling / leasing (all times come from the database clock)
+    run_after = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    locked_by = Column(String, nullable=True)
+    lease_expires_at = Column(DateTime(timezone=True), nullable=True)
+    heartbeat_at = Column(DateTime(timezone=True), nullable=True)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+    document = relationship("Document")
+
+    __table_args__ = (
+        # Supports the claim query (status + due date)
+        Index("ix_jobs_status_run_after", "status", "run_after"),
+    )
+
+class ResultCache(Base):
+    """
+    OCR + extraction results keyed by (content hash, OCR config, extractor version).
+    Size-bounded; least recently used entries are evicted first.
+    """
+    __tablename__ = "result_cache"
+
+    cache_key = Column(String, primary_key=True)
+    content_hash = Column(String(64), nullable=False, index=True)
+    ocr_config = Column(String, nullable=False)
+    extractor_version = Column(String, nullable=False)
+
+    raw_text = Column(Text, nullable=True)
+    structured_json = Column(JSONB, nullable=True)
+    page_sources = Column(JSONB, nullable=True)
+    size_bytes = Column(Integer, nullable=False, default=0)
+    hits = Column(Integer, nullable=False, default=0)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    last_accessed_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+
+class PrescriptionMetrics(Base):
+    """
+    AI vs Human comparison of one validated prescription.
+    Computed once, when the prescription is validated.
+    """
+    __tablename__ = "prescription_metrics"
+
+    prescription_id = Column(UUID(as_uuid=True), ForeignKey("prescriptions.id"), primary_key=True)
+    document_id = Column(UUID(as_uuid=True), ForeignKey("documents.id"), nullable=False)
+    site = Column(String, nullable=False, default="")
+    validated_at = Column(DateTime(timezone=True), nullable=False)
+    validated_day = Column(Date, nullable=False)
+
+    precision = Column(Float, nullable=False)
+    recall = Column(Float, nullable=False)
+    f1_score = Column(Float, nullable=False)
+    similarity_score = Column(Float, nullable=False)
+    true_positives = Column(Integer, nullable=False)
+    false_positives = Column(Integer, nullable=False)
+    false_negatives = Column(Integer, nullable=False)
+
+class MetricsAggregate(Base):
+    """
+    Running sums of PrescriptionMetrics per (site, day), updated in the same
+    transaction as each validation. /statistics/global only reads this table.
+    """
+    __tablename__ = "metrics_aggregates"
+
+    site = Column(String, primary_key=True, default="")  # "" = unknown site
+    day = Column(Date, primary_key=True)
+
+    count = Column(Integer, nullable=False, default=0)
+    sum_precision = Column(Float, nullable=False, default=0)
+    sum_recall = Column(Float, nullable=False, default=0)
+    sum_f1 = Column(Float, nullable=False, default=0)
+    sum_similarity = Column(Float, nullable=False, default=0)
+    sum_true_positives = Column(Integer, nullable=False, default=0)
+    sum_false_positives = Column(Integer, nullable=False, default=0)
+    sum_false_negatives = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        # Time-window queries across all sites
+        Index("ix_metrics_aggregates_day", "day"),
+    )
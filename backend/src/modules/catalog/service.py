@@ -0,0 +1,128 @@
+import os
+import json
+import uuid
+import shutil
+import hashlib
+from collections.abc import Sequence
+from typing import Dict, List, Optional
+import numpy as np
+import pandas as pd
+
+# --- CONFIGURATION ---
+CATALOG_ROOT = "/app/uploads/catalog"
+# MIMIC PRESCRIPTIONS columns kept (headers are lowercased: MIMIC-III uses uppercase)
+CATALOG_COLUMNS = ("drug", "prod_strength", "route", "form_rx", "ndc", "formulary_drug_cd")
+# Bump when the cache layout changes
+CATALOG_FORMAT_VERSION = "1"
+# Rows parsed at once while ingesting: bounds memory whatever the file size
+INGEST_CHUNK_ROWS = 200_000
+
+def catalog_signature(csv_path: str) -> str:
+    """Identifies a CSV version (path, size, mtime) + cache format. Cheap: only stats the file."""
+    stat = os.stat(csv_path)
+    key = f"{CATALOG_FORMAT_VERSION}|{os.path.abspath(csv_path)}|{stat.st_size}|{stat.st_mtime_ns}"
+    return hashlib.sha1(key.encode()).hexdigest()[:12]
+
+def ingest_csv(csv_path: str, catalog_dir: str, chunk_rows: int = INGEST_CHUNK_ROWS) -> "MimicCatalog":
+    """
+    Streams the CSV in chunks into a columnar cache (written atomically):
+    per column, an int32 code per row (<column>.codes.npy) and the distinct
+    values (<column>.values.json). Missing values are stored as "".
+    """
+    header = [c.lower() for c in pd.read_csv(csv_path, nrows=0).columns]
+    columns = [c for c in CATALOG_COLUMNS if c in header]
+    if "drug" not in columns:
+        raise ValueError(f"{csv_path} has no 'drug' column")
+
+    # Column -> {value: code}, codes in order of first appearance
+    dictionaries: Dict[str, Dict[str, int]] = {c: {} for c in columns}
+    codes: Dict[str, List[np.ndarray]] = {c: [] for c in columns}
+    rows = 0
+    reader = pd.read_csv(
+        csv_path, dtype=str, chunksize=chunk_rows,
+        usecols=lambda c: c.lower() in columns
+    )
+    for chunk in reader:
+        chunk.columns = [c.lower() for c in chunk.columns]
+        for column in columns:
+            values = chunk[column].fillna("")
+            mapping = dictionaries[column]
+            for value in values.unique():
+                if value not in mapping:
+                    mapping[value] = len(mapping)
+            codes[column].append(values.map(mapping).to_numpy(dtype=np.int32))
+        rows += len(chunk)
+        print(f"Catalog ingestion: {rows} rows")
+
+    tmp_dir = f"{catalog_dir.rstrip('/')}.tmp-{uuid.uuid4().hex}"
+    os.makedirs(tmp_dir)
+    for column in columns:
+        np.save(os.path.join(tmp_dir, f"{column}.codes.npy"),
+                np.concatenate(codes[column]) if codes[column] else np.zeros(0, dtype=np.int32))
+        with open(os.path.join(tmp_dir, f"{column}.values.json"), "w") as f:
+            json.dump(list(dictionaries[column]), f)
+    with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+        json.dump({"rows": rows, "columns": columns, "source": csv_path, "format": CATALOG_FORMAT_VERSION}, f)
+
+    try:
+        os.rename(tmp_dir, catalog_dir)
+    except OSError:
+        # Ingested concurrently by another process: keep theirs
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return MimicCatalog(catalog_dir)
+
+class MimicCatalog(Sequence):
+    """
+    Columnar, memory-mapped MIMIC prescriptions. Behaves as a read-only
+    sequence of row dicts, so rows can be sampled by index (random.sample)
+    without materializing the table.
+    """
+    def __init__(self, catalog_dir: str):
+        with open(os.path.join(catalog_dir, "meta.json")) as f:
+            meta = json.load(f)
+        self.catalog_dir = catalog_dir
+        self.columns = meta["columns"]
+        self.size = meta["rows"]
+        self.codes, self.values = {}, {}
+        for column in self.columns:
+            self.codes[column] = np.load(os.path.join(catalog_dir, f"{column}.codes.npy"), mmap_mode="r")
+            with open(os.path.join(catalog_dir, f"{column}.values.json")) as f:
+                self.values[column] = json.load(f)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __getitem__(self, i: int) -> Dict[str, str]:
+        if i < 0:
+            i += self.size
+        if not 0 <= i < self.size:
+            raise IndexError(i)
+        return {column: self.values[column][self.codes[column][i]] for column in self.columns}
+
+    def first_rows(self, column: str, required: tuple = ()) -> np.ndarray:
+        """
+        Row numbers of the first occurrence of each distinct `column` value,
+        in file order, among rows where `column` and `required` are not empty.
+        """
+        valid = np.ones(self.size, dtype=bool)
+        for name in (column, *required):
+            if "" in self.values[name]:
+                valid &= self.codes[name] != self.values[name].index("")
+        rows = np.flatnonzero(valid)
+        _, first = np.unique(self.codes[column][rows], return_index=True)
+        return rows[np.sort(first)]
+
+def load_catalog(csv_path: str) -> Optional[MimicCatalog]:
+    """
+    The columnar cache of a MIMIC CSV, ingesting it first if the cache does
+    not match the current file. None when the CSV does not exist.
+    """
+    if not csv_path or not os.path.exists(csv_path):
+        return None
+    catalog_dir = os.path.join(CATALOG_ROOT, catalog_signature(csv_path))
+    if os.path.exists(os.path.join(catalog_dir, "meta.json")):
+        return MimicCatalog(catalog_dir)
+
+    print(f"Ingesting MIMIC catalog {csv_path}...")
+    os.makedirs(CATALOG_ROOT, exist_ok=True)
+    return ingest_csv(csv_path, catalog_dir)
@@ -0,0 +1,133 @@
+import os
+import json
+import glob
+import uuid
+import numpy as np
+from typing import List, Tuple, Iterator
+
+# --- CONFIGURATION ---
+# Bump when the shard layout changes
+SHARD_FORMAT_VERSION = 1
+# Documents per shard
+SHARD_SIZE = 1024
+MANIFEST_NAME = "manifest.json"
+# Index columns: image offset, image length, truth offset, truth length
+INDEX_COLUMNS = 4
+
+class ShardWriter:
+    """
+    Writes one shard of a packed dataset:
+    <name>.bin       image and ground truth bytes, back to back,
+    <name>.idx.npy   int64 (n, 4) offsets/lengths into the .bin,
+    <name>.names.json document names.
+    Files get their final name on close(), so readers never see a partial shard.
+    """
+    def __init__(self, dataset_dir: str, shard_name: str):
+        os.makedirs(dataset_dir, exist_ok=True)
+        self.dataset_dir = dataset_dir
+        self.shard_name = shard_name
+        self._tmp_suffix = f".tmp-{uuid.uuid4().hex}"
+        self._bin = open(self._path(".bin") + self._tmp_suffix, "wb")
+        self._position = 0
+        self.index, self.names = [], []
+
+    def _path(self, ext: str) -> str:
+        return os.path.join(self.dataset_dir, f"{self.shard_name}{ext}")
+
+    def add(self, name: str, image_bytes: bytes, truth_bytes: bytes):
+        self._bin.write(image_bytes)
+        self._bin.write(truth_bytes)
+        self.index.append((self._position, len(image_bytes), self._position + len(image_bytes), len(truth_bytes)))
+        self._position += len(image_bytes) + len(truth_bytes)
+        self.names.append(name)
+
+    def close(self):
+        self._bin.close()
+        index = np.array(self.index, dtype=np.int64).reshape(-1, INDEX_COLUMNS)
+        # np.save appends .npy to names that lack it
+        np.save(self._path(".idx.npy") + self._tmp_suffix + ".npy", index)
+        with open(self._path(".names.json") + self._tmp_suffix, "w") as f:
+            json.dump(self.names, f)
+        # The index is renamed last: a shard is listed only once complete
+        os.replace(self._path(".bin") + self._tmp_suffix, self._path(".bin"))
+        os.replace(self._path(".names.json") + self._tmp_suffix, self._path(".names.json"))
+        os.replace(self._path(".idx.npy") + self._tmp_suffix + ".npy", self._path(".idx.npy"))
+
+def write_manifest(dataset_dir: str) -> dict:
+    """Lists every complete shard of the directory (in name order) in manifest.json."""
+    shards = []
+    for idx_path in sorted(glob.glob(os.path.join(dataset_dir, "*.idx.npy"))):
+        index = np.load(idx_path, mmap_mode="r")
+        shards.append({"name": os.path.basename(idx_path)[:-len(".idx.npy")], "count": int(index.shape[0])})
+    manifest = {"format": SHARD_FORMAT_VERSION, "count": sum(s["count"] for s in shards), "shards": shards}
+
+    tmp_path = os.path.join(dataset_dir, f".{MANIFEST_NAME}.{uuid.uuid4().hex}")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, os.path.join(dataset_dir, MANIFEST_NAME))
+    return manifest
+
+def is_sharded_dataset(dataset_dir: str) -> bool:
+    return os.path.exists(os.path.join(dataset_dir, MANIFEST_NAME))
+
+class ShardedDataset:
+    """
+    Read access to a packed dataset. Shards are memory-mapped: reading a
+    document is a slice of the mapping (no file open per document), in
+    sequence (iter_documents) or by random access (dataset[i]).
+    """
+    def __init__(self, dataset_dir: str):
+        with open(os.path.join(dataset_dir, MANIFEST_NAME)) as f:
+            manifest = json.load(f)
+        if manifest.get("format") != SHARD_FORMAT_VERSION:
+            raise ValueError(f"Unsupported shard format {manifest.get('format')} in {dataset_dir}")
+
+        self.dataset_dir = dataset_dir
+        self.shards, self.indexes, self.names = [], [], []
+        for shard in manifest["shards"]:
+            path = os.path.join(dataset_dir, shard["name"])
+            index = np.load(f"{path}.idx.npy")
+            # np.memmap refuses empty files
+            data = np.memmap(f"{path}.bin", dtype=np.uint8, mode="r") if index.size else np.zeros(0, np.uint8)
+            with open(f"{path}.names.json") as f:
+                self.names.extend(json.load(f))
+            self.shards.append(data)
+            self.indexes.append(index)
+
+        # Global document number -> (shard, row)
+        counts = [len(index) for index in self.indexes]
+        self.starts = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        self.size = int(self.starts[-1])
+
+    def __len__(self) -> int:
+        return self.size
+
+    def _locate(self, i: int) -> Tuple[int, int]:
+        if not 0 <= i < self.size:
+            raise IndexError(i)
+        shard = int(np.searchsorted(self.starts, i, side="right")) - 1
+        return shard, i - int(self.starts[shard])
+
+    def __getitem__(self, i: int) -> Tuple[str, np.ndarray, np.ndarray]:
+        """(name, image bytes, ground truth json bytes); bytes are uint8 views on the mapping."""
+        shard, row = self._locate(i)
+        image_offset, image_length, truth_offset, truth_length = self.indexes[shard][row]
+        data = self.shards[shard]
+        return (
+            self.names[i],
+            data[image_offset:image_offset + image_length],
+            data[truth_offset:truth_offset + truth_length]
+        )
+
+    def sizes(self, i: int) -> Tuple[int, int]:
+        """(image length, truth length) of a document, without touching its bytes."""
+        shard, row = self._locate(i)
+        index = self.indexes[shard][row]
+        return int(index[1]), int(index[3])
+
+    def iter_documents(self, start: int = 0, end: int = None) -> Iterator[Tuple[str, np.ndarray, np.ndarray]]:
+        for i in range(start, self.size if end is None else min(end, self.size)):
+            yield self[i]
+
+    def load_truth(self, i: int) -> List[dict]:
+        return json.loads(self[i][2].tobytes())
@@ -1,52 +1,161 @@
-from typing import List, Dict
-from rapidfuzz import fuzz
+from typing import List, Dict, Tuple
+import numpy as np
+from rapidfuzz import fuzz, process
+from scipy.optimize import linear_sum_assignment
+
+# Name similarity (0-100) from which an AI medicine is considered the same as a human one
+MATCH_THRESHOLD = 85
+# Medicine fields compared once AI and human entries are aligned
+FIELDS = ("drug_name", "dosage", "raw_instruction")
+
+def _normalize(value) -> str:
+    return str(value or "").lower().strip()
+
+def _f1(tp: int, ai_count: int, human_count: int) -> float:
+    precision = tp / ai_count if ai_count > 0 else 0
+    recall = tp / human_count if human_count > 0 else 0
+    return 2 * (precision * recall) / (precision + recall) if (precision + recall) > 0 else 0
 
 class MetricsService:
+    def __init__(self, match_threshold: float = MATCH_THRESHOLD, block_size: int = 1000):
+        self.match_threshold = match_threshold
+        # Prescription pairs scored per similarity matrix in calculate_metrics_batch
+        self.block_size = block_size
+
     def calculate_metrics(self, ai_data: Dict, human_data: Dict):
         """
         Compares AI prediction vs Human validation.
         """
-        ai_meds = ai_data.get("medicines", [])
-        human_meds = human_data.get("medicines", [])
-
-        # 1. Entity Matching (Simple Name Match)
-        tp = 0 # True Positives (AI found it, Human kept it)
-        fp = 0 # False Positives (AI found it, Human deleted it)
-        fn = 0 # False Negatives (AI missed it, Human added it)
-
-        # Normalize names for comparison
-        ai_names = [m.get("drug_name", "").lower().strip() for m in ai_meds]
-        human_names = [m.get("drug_name", "").lower().strip() for m in human_meds]
-
-        # Calculate TP and FP
-        for name in ai_names:
-            if name in human_names:
-                tp += 1
+        # One document (validation request): no thread pool for a few names
+        return self.calculate_metrics_batch([(ai_data, human_data)], workers=1)[0]
+
+    def calculate_metrics_batch(self, pairs: List[Tuple[Dict, Dict]], workers: int = -1) -> List[Dict]:
+        """
+        Scores many (ai_data, human_data) pairs.
+        For each block of pairs, all drug names are deduplicated and compared in
+        a single similarity matrix (rapidfuzz cdist); each pair then reads its
+        sub-matrix and solves an optimal one-to-one assignment. Field scores of
+        all aligned medicines are computed in one vectorized call per field.
+        `workers`: rapidfuzz threads (-1: all cores).
+        """
+        results = []
+        for start in range(0, len(pairs), self.block_size):
+            results.extend(self._score_block(pairs[start:start + self.block_size], workers))
+        return results
+
+    def align(self, scores: np.ndarray):
+        """
+        Optimal one-to-one assignment on a (n_ai, n_human) name similarity matrix.
+        Returns (ai_indices, human_indices) of the pairs above the match threshold.
+        """
+        if scores.size == 0:
+            empty = np.array([], dtype=int)
+            return empty, empty
+        rows, cols = linear_sum_assignment(scores, maximize=True)
+        keep = scores[rows, cols] >= self.match_threshold
+        return rows[keep], cols[keep]
+
+    def _score_block(self, pairs: List[Tuple[Dict, Dict]], workers: int) -> List[Dict]:
+        ai_lists = [(ai or {}).get("medicines", []) or [] for ai, _ in pairs]
+        human_lists = [(human or {}).get("medicines", []) or [] for _, human in pairs]
+
+        # 1. One similarity matrix over the distinct names of the block
+        ai_vocab, ai_index = self._index_names(ai_lists)
+        human_vocab, human_index = self._index_names(human_lists)
+        if ai_vocab and human_vocab:
+            name_matrix = process.cdist(ai_vocab, human_vocab, scorer=fuzz.ratio, dtype=np.uint8, workers=workers)
+        else:
+            name_matrix = np.zeros((len(ai_vocab), len(human_vocab)), dtype=np.uint8)
+
+        # 2. Optimal alignment per pair (small sub-matrices)
+        matched_ai, matched_human, matched_pair = [], [], []
+        for i, (ai_meds, human_meds) in enumerate(zip(ai_lists, human_lists)):
+            scores = name_matrix[np.ix_(ai_index[i], human_index[i])]
+            rows, cols = self.align(scores)
+            for r, c in zip(rows, cols):
+                matched_ai.append(ai_meds[r])
+                matched_human.append(human_meds[c])
+                matched_pair.append(i)
+
+        # 3. Field scores of every aligned medicine, one call per field
+        matched_pair = np.array(matched_pair, dtype=int)
+        field_sums, field_means, field_hits = {}, {}, {}
+        tp = np.bincount(matched_pair, minlength=len(pairs))
+        for field in FIELDS:
+            if len(matched_pair):
+                field_scores = process.cpdist(
+                    [_normalize(m.get(field)) for m in matched_ai],
+                    [_normalize(m.get(field)) for m in matched_human],
+                    scorer=fuzz.ratio, workers=workers
+                )
             else:
-                fp += 1
-        
-        # Calculate FN (Items in human list not in AI list)
-        for name in human_names:
-            if name not in ai_names:
-                fn += 1
-
-        # 2. Precision / Recall / F1
+                field_scores = np.array([])
+            field_sums[field] = np.bincount(matched_pair, weights=field_scores, minlength=len(pairs))
+            # Aligned medicines whose field also agrees (for field-level F1)
+            field_hits[field] = np.bincount(
+                matched_pair, weights=field_scores >= self.match_threshold, minlength=len(pairs)
+            )
+            with np.errstate(invalid="ignore", divide="ignore"):
+                field_means[field] = field_sums[field] / tp
+
+        # 4. Per-pair metrics
+        results = []
+        for i, (ai_meds, human_meds) in enumerate(zip(ai_lists, human_lists)):
+            results.append(self._build_metrics(
+                int(tp[i]), len(ai_meds), len(human_meds),
+                {field: field_sums[field][i] for field in FIELDS},
+                {field: field_means[field][i] for field in FIELDS},
+                {field: int(field_hits[field][i]) for field in FIELDS}
+            ))
+        return results
+
+    def _index_names(self, med_lists: List[List[Dict]]):
+        """Distinct normalized drug names + per-list indices into them."""
+        vocab, positions, index = [], {}, []
+        for meds in med_lists:
+            idx = []
+            for m in meds:
+                name = _normalize(m.get("drug_name"))
+                if name not in positions:
+                    positions[name] = len(vocab)
+                    vocab.append(name)
+                idx.append(positions[name])
+            index.append(np.array(idx, dtype=int))
+        return vocab, index
+
+    def _build_metrics(self, tp: int, ai_count: int, human_count: int, field_sums: Dict, field_means: Dict,
+                       field_hits: Dict):
+        fp = ai_count - tp # AI found it, Human deleted it
+        fn = human_count - tp # AI missed it, Human added it
+
+        # Precision / Recall / F1
         precision = tp / (tp + fp) if (tp + fp) > 0 else 0
         recall = tp / (tp + fn) if (tp + fn) > 0 else 0
         f1 = 2 * (precision * recall) / (precision + recall) if (precision + recall) > 0 else 0
 
-        # 3. Text Similarity (Levenshtein on the full JSON string representation)
-        # This serves as a proxy for "Word Error Rate" on the structured data
-        similarity = fuzz.ratio(str(ai_meds), str(human_meds))
+        # Similarity: average field agreement over the union of medicines
+        # (unmatched medicines count as 0, two empty lists are identical)
+        union = max(ai_count, human_count)
+        if union == 0:
+            similarity = 100.0
+        else:
+            similarity = sum(field_sums.values()) / len(FIELDS) / union
 
         return {
             "precision": round(precision, 2),
             "recall": round(recall, 2),
             "f1_score": round(f1, 2),
-            "similarity_score": round(similarity, 2),
+            "similarity_score": round(float(similarity), 2),
+            "field_scores": {
+                field: (round(float(value), 2) if tp else None) for field, value in field_means.items()
+            },
+            # A field counts as found when its medicine is aligned and the values agree
+            "field_f1": {
+                field: round(_f1(hits, ai_count, human_count), 2) for field, hits in field_hits.items()
+            },
             "details": {
-                "ai_count": len(ai_meds),
-                "human_count": len(human_meds),
+                "ai_count": ai_count,
+                "human_count": human_count,
                 "true_positives": tp,
                 "false_positives": fp,
                 "false_negatives": fn
@@ -55,28 +164,19 @@ class MetricsService:
 
     def aggregate_stats(self, prescriptions: List):
         """Averages metrics across multiple documents."""
-        total_prec = 0
-        total_rec = 0
-        total_f1 = 0
-        count = 0
-
-        for p in prescriptions:
-            if not p.is_validated or not p.ai_structured_json:
-                continue
-            
-            stats = self.calculate_metrics(p.ai_structured_json, p.structured_json)
-            total_prec += stats["precision"]
-            total_rec += stats["recall"]
-            total_f1 += stats["f1_score"]
-            count += 1
-
+        pairs = [
+            (p.ai_structured_json, p.structured_json)
+            for p in prescriptions
+            if p.is_validated and p.ai_structured_json
+        ]
+        count = len(pairs)
         if count == 0:
             return {"count": 0, "message": "No validated documents found."}
 
+        all_stats = self.calculate_metrics_batch(pairs)
         return {
             "count": count,
-            "avg_precision": round(total_prec / count, 2),
-            "avg_recall": round(total_rec / count, 2),
-            "avg_f1": round(total_f1 / count, 2)
+            "avg_precision": round(sum(s["precision"] for s in all_stats) / count, 2),
+            "avg_recall": round(sum(s["recall"] for s in all_stats) / count, 2),
+            "avg_f1": round(sum(s["f1_score"] for s in all_stats) / count, 2)
         }
-    
\ No newline at end of file
@@ -1,14 +1,57 @@
+import os
 import re
+from concurrent.futures import ProcessPoolExecutor
 from typing import List, Dict, Any
+from src.modules.normalization.service import DrugNormalizer, lexicon_signature, load_default_normalizer
+
+# Bump whenever the extraction rules change (invalidates cached results)
+EXTRACTOR_VERSION = "2"
+
+# Texts per task sent to the process pool in extract_many
+EXTRACT_CHUNK_SIZE = 256
+
+# Regex patterns for French medical prescriptions (compiled once per process)
+# Captures lines starting with a number (e.g., "1. Doliprane...")
+LINE_PATTERN = re.compile(r'^\s*(\d+)[.)]\s*(.+)', re.MULTILINE)
+# Basic patterns to split Drug from Dosage (Simplistic for MVP)
+DOSAGE_PATTERN = re.compile(r'(\d+\s*(?:mg|g|ml|cp|comprimé|gélule|sachet))', re.IGNORECASE)
+PATIENT_PATTERN = re.compile(r'Patient\s*:\s*(.+)', re.IGNORECASE)
+DOCTOR_PATTERN = re.compile(r'Dr\.?\s*(.+)', re.IGNORECASE)
+# Matches dd/mm/yyyy
+DATE_PATTERN = re.compile(r'(\d{2}/\d{2}/\d{4})')
+ARTIFACTS_PATTERN = re.compile(r'[^\w\s]')
+
+# Per-process service used by the extract_many pool
+_pool_service = None
+
+def _init_pool_worker(index_dir: str, signature: str):
+    global _pool_service
+    normalizer = DrugNormalizer(index_dir, signature) if index_dir else None
+    _pool_service = ExtractionService(normalizer=normalizer)
+
+def _extract_chunk(texts: List[str]) -> List[Dict[str, Any]]:
+    return [_pool_service.extract_from_text(t) for t in texts]
+
+def current_extractor_version() -> str:
+    """Version of the extraction output: rules + drug lexicon (if any)."""
+    signature = lexicon_signature()
+    return EXTRACTOR_VERSION if signature is None else f"{EXTRACTOR_VERSION}+lex-{signature}"
 
 class ExtractionService:
-    def __init__(self):
-        # Regex patterns for French medical prescriptions
-        # Captures lines starting with a number (e.g., "1. Doliprane...")
-        self.line_pattern = re.compile(r'^\s*(\d+)[.)]\s*(.+)', re.MULTILINE)
-        
-        # Basic patterns to split Drug from Dosage (Simplistic for MVP)
-        self.dosage_pattern = re.compile(r'(\d+\s*(?:mg|g|ml|cp|comprimé|gélule|sachet))', re.IGNORECASE)
+    def __init__(self, normalizer: DrugNormalizer = None):
+        # Optional drug lexicon used to fill `standardized_code`
+        self.normalizer = normalizer
+        self.line_pattern = LINE_PATTERN
+        self.dosage_pattern = DOSAGE_PATTERN
+        # Process pool of extract_many, created on first use
+        self._pool = None
+        self._pool_workers = 0
+
+    @property
+    def version(self) -> str:
+        if self.normalizer is None:
+            return EXTRACTOR_VERSION
+        return f"{EXTRACTOR_VERSION}+lex-{self.normalizer.signature}"
 
     def extract_from_text(self, raw_text: str) -> Dict[str, Any]:
         """
@@ -29,6 +72,67 @@ class ExtractionService:
 
         return structured_data
 
+    @staticmethod
+    def merge_pages(pages: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        One document from per-page extractions (same result as extracting the
+        joined text): header fields from the first page that has them,
+        medicines in page order.
+        """
+        merged = {"patient": None, "doctor": None, "date": None, "medicines": []}
+        for page in pages:
+            for field in ("patient", "doctor", "date"):
+                merged[field] = merged[field] or page.get(field)
+            merged["medicines"].extend(page.get("medicines", []))
+        return merged
+
+    def extract_many(self, texts: List[str], workers: int = None) -> List[Dict[str, Any]]:
+        """
+        Extracts a batch of texts, results in input order.
+        Large batches are split in chunks run on a process pool (kept between
+        calls); each pool process memory-maps the same lexicon index.
+        """
+        workers = workers or os.cpu_count() or 1
+        if workers <= 1 or len(texts) <= EXTRACT_CHUNK_SIZE:
+            return [self.extract_from_text(t) for t in texts]
+
+        if self._pool is None or self._pool_workers != workers:
+            self.close()
+            index_dir = self.normalizer.index_dir if self.normalizer is not None else None
+            signature = self.normalizer.signature if self.normalizer is not None else None
+            self._pool = ProcessPoolExecutor(
+                max_workers=workers, initializer=_init_pool_worker, initargs=(index_dir, signature)
+            )
+            self._pool_workers = workers
+
+        chunks = [texts[i:i + EXTRACT_CHUNK_SIZE] for i in range(0, len(texts), EXTRACT_CHUNK_SIZE)]
+        results = []
+        for chunk_results in self._pool.map(_extract_chunk, chunks):
+            results.extend(chunk_results)
+        return results
+
+    def reload_normalizer(self) -> bool:
+        """
+        Switches to the default drug lexicon when its sources changed since the
+        normalizer was loaded (e.g. a new MIMIC upload), so that `version`
+        matches current_extractor_version() as computed by the API.
+        Returns True if the normalizer was reloaded.
+        """
+        loaded = self.normalizer.signature if self.normalizer is not None else None
+        if lexicon_signature() == loaded:
+            return False
+        self.close()  # The pool processes hold the previous index
+        self.normalizer = load_default_normalizer()
+        print(f"Drug lexicon changed, extractor version is now {self.version}")
+        return True
+
+    def close(self):
+        """Shuts down the extract_many process pool, if any."""
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+            self._pool_workers = 0
+
     def _parse_drug_line(self, text: str) -> Dict[str, str]:
         """
         Splits a line like 'Doliprane 1000mg 1 comprimé...' into components.
@@ -38,34 +142,40 @@ class ExtractionService:
         dosage = dosage_match.group(1) if dosage_match else ""
         
         # 2. Assume Drug Name is everything before the dosage
+        # (the match is the first occurrence of the dosage; instructions
+        # follow its last occurrence)
         if dosage:
-            drug_name = text.split(dosage)[0].strip()
-            instructions = text.split(dosage)[-1].strip()
+            drug_name = text[:dosage_match.start()].strip()
+            instructions = text.rpartition(dosage)[2].strip()
         else:
             drug_name = text.strip()
             instructions = ""
 
         # Cleanup artifacts
-        drug_name = re.sub(r'[^\w\s]', '', drug_name).strip()
+        drug_name = ARTIFACTS_PATTERN.sub('', drug_name).strip()
+
+        # Map to a lexicon code (ATC/CIP or MIMIC NDC)
+        code, confidence = None, None
+        if self.normalizer is not None and drug_name:
+            code, confidence = self.normalizer.lookup(drug_name)
 
         return {
             "drug_name": drug_name,
             "dosage": dosage,
             "raw_instruction": instructions,
-            # We can expand this later with mapping to ATC codes
-            "standardized_code": None 
+            "standardized_code": code,
+            "code_confidence": confidence
         }
 
     def _extract_patient(self, text: str) -> str:
-        match = re.search(r'Patient\s*:\s*(.+)', text, re.IGNORECASE)
+        match = PATIENT_PATTERN.search(text)
         return match.group(1).strip() if match else None
 
     def _extract_doctor(self, text: str) -> str:
-        match = re.search(r'Dr\.?\s*(.+)', text, re.IGNORECASE)
+        match = DOCTOR_PATTERN.search(text)
         return match.group(1).strip() if match else None
 
     def _extract_date(self, text: str) -> str:
-        # Matches dd/mm/yyyy
-        match = re.search(r'(\d{2}/\d{2}/\d{4})', text)
+        match = DATE_PATTERN.search(text)
         return match.group(1) if match else None
     
\ No newline at end of file
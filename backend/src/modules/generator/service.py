@@ -1,16 +1,27 @@
+import io
 import os
 import json
 import random
+import functools
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 from typing import List
 from dataclasses import dataclass
-import pandas as pd
 from PIL import Image, ImageDraw, ImageFont, ImageFilter
+from src.modules.dataset.service import ShardWriter, write_manifest, SHARD_SIZE
+from src.modules.catalog.service import load_catalog
 
 # --- CONFIGURATION ---
 FONT_PATH_NORMAL = "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
 FONT_PATH_BOLD = "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf"
 
+# Documents per task sent to the generation pool
+GENERATION_CHUNK_SIZE = 64
+# Noise opacity of the scan effect, in 1/256 (13/256 ~ 5%)
+NOISE_WEIGHT = 13
+# PNG is lossless: a fast zlib level gives the same pixels, ~2x faster to write
+PNG_COMPRESS_LEVEL = 1
+
 ROUTE_MAP_FR = {
     "PO": "orale", "ORAL": "orale", "IV": "intraveineuse", "IM": "intramusculaire",
     "TOPICAL": "cutanée", "INHALATION": "inhalée", "SC": "sous-cutanée"
@@ -23,6 +34,14 @@ class LineItem:
     posology: str # Flattened for simplicity
     form: str
 
+@dataclass
+class ScanSettings:
+    """Strength of the simulated scan effects (defaults: the standard dataset)."""
+    max_rotation: float = 1.5 # degrees, uniform in [-max, +max]
+    blur_probability: float = 0.5
+    blur_radius: float = 0.5
+    noise_level: float = NOISE_WEIGHT / 256 # noise opacity, 0-1
+
 @dataclass
 class OrdoDoc:
     patient_name: str
@@ -30,68 +49,176 @@ class OrdoDoc:
     date_str: str
     lines: List[LineItem]
 
+@functools.lru_cache(maxsize=None)
+def _cached_font(path: str, size: int):
+    # Fonts are parsed once per process instead of once per document
+    try:
+        return ImageFont.truetype(path, size=size)
+    except IOError:
+        return ImageFont.load_default()
+
+# Per-process state of the generate_batch pool
+_pool_generator = None
+_pool_catalog = None
+
+def _init_pool_worker(output_dir: str, csv_path: str):
+    global _pool_generator, _pool_catalog
+    _pool_generator = PrescriptionGenerator(output_dir)
+    _pool_catalog = _pool_generator._load_catalog(csv_path)
+
+def _generate_range(seed: int, start: int, end: int) -> List[str]:
+    return [_pool_generator._generate_one(_pool_catalog, seed, i) for i in range(start, end)]
+
+def _generate_shard_range(seed: int, start: int, end: int) -> List[str]:
+    return _pool_generator._generate_shard(_pool_catalog, seed, start, end)
+
 class PrescriptionGenerator:
-    def __init__(self, output_dir: str):
+    def __init__(self, output_dir: str = None):
+        # No output_dir: documents are only generated in memory (see generate_texts)
         self.output_dir = output_dir
-        os.makedirs(self.output_dir, exist_ok=True)
+        if self.output_dir:
+            os.makedirs(self.output_dir, exist_ok=True)
 
     def load_font(self, font_type="normal", size=20):
         path = FONT_PATH_BOLD if font_type == "bold" else FONT_PATH_NORMAL
-        try:
-            return ImageFont.truetype(path, size=size)
-        except IOError:
-            return ImageFont.load_default()
+        return _cached_font(path, size)
 
-    def apply_scan_effects(self, img: Image.Image) -> Image.Image:
-        """Simulates a scanned document: Blur, Noise, Rotation, Grayscale."""
-        # 1. Slight Rotation (-2 to +2 degrees)
-        angle = random.uniform(-1.5, 1.5)
-        img = img.rotate(angle, resample=Image.BICUBIC, expand=True, fillcolor="white")
+    def apply_scan_effects(self, img: Image.Image, rng: random.Random = None,
+                           np_rng: np.random.Generator = None, settings: ScanSettings = None) -> Image.Image:
+        """
+        Simulates a scanned document: Blur, Noise, Rotation, Grayscale.
+        rng / np_rng make the effects reproducible (default: global generators).
+        """
+        rng = rng or random
+        settings = settings or ScanSettings()
+        # 1. Slight Rotation (-1.5 to +1.5 degrees by default)
+        angle = rng.uniform(-settings.max_rotation, settings.max_rotation)
+        if angle:
+            img = img.rotate(angle, resample=Image.BICUBIC, expand=True, fillcolor="white")
 
         # 2. Gaussian Blur (Simulate bad focus)
-        if random.random() > 0.5:
-            img = img.filter(ImageFilter.GaussianBlur(radius=0.5))
+        if rng.random() > 1 - settings.blur_probability and settings.blur_radius > 0:
+            img = img.filter(ImageFilter.GaussianBlur(radius=settings.blur_radius))
 
         # 3. Add Salt & Pepper Noise
         # Convert to numpy array
-        np_img = np.array(img)
-        noise = np.random.randint(0, 255, np_img.shape, dtype='uint8')
-        # Blend original image with noise (very subtle)
-        noise_level = 0.05  # 5% noise opacity
-        np_img = (np_img * (1 - noise_level) + noise * noise_level).astype('uint8')
+        np_img = np.asarray(img)
+        if np_rng is None:
+            noise = np.random.randint(0, 255, np_img.shape, dtype='uint8')
+        else:
+            noise = np_rng.integers(0, 255, np_img.shape, dtype=np.uint8)
+        # Blend original image with noise (very subtle, ~5% noise opacity by
+        # default), in fixed point on 16 bits instead of float64
+        weight = min(256, max(0, round(settings.noise_level * 256)))
+        blended = np_img.astype(np.uint16) * (256 - weight)
+        blended += noise.astype(np.uint16) * weight
+        blended >>= 8
         
-        return Image.fromarray(np_img)
+        return Image.fromarray(blended.astype(np.uint8))
 
-    def generate_batch(self, count: int, csv_path: str = None):
-        catalog = self._load_catalog(csv_path)
-        generated_files = []
+    def generate_batch(self, count: int, csv_path: str = None, seed: int = None, workers: int = 1,
+                       sharded: bool = False):
+        """
+        Renders `count` documents (png + ground truth json) into output_dir.
+        Document i only depends on (seed, i): the same seed gives the same
+        dataset whatever the number of workers, and names
+        (synth_<seed>_<i>) never collide within a batch.
+        With `sharded`, documents are packed SHARD_SIZE at a time into shard
+        files (see ShardedDataset) instead of one png + json each.
+        """
+        if seed is None:
+            seed = random.SystemRandom().randint(0, 2**31 - 1)
+        workers = workers or os.cpu_count() or 1
+        chunk_size = SHARD_SIZE if sharded else GENERATION_CHUNK_SIZE
+        ranges = [(i, min(i + chunk_size, count)) for i in range(0, count, chunk_size)]
 
-        for i in range(count):
-            doc = self._generate_doc_data(catalog)
-            img, boxes = self._render_image(doc)
-            
-            # --- APPLY NOISE HERE ---
-            img = self.apply_scan_effects(img)
-            # ------------------------
+        generated_files = []
+        # Ingests the CSV once, before the workers open the cache
+        catalog = self._load_catalog(csv_path)
+        if workers <= 1 or len(ranges) <= 1:
+            for start, end in ranges:
+                if sharded:
+                    generated_files.extend(self._generate_shard(catalog, seed, start, end))
+                else:
+                    generated_files.extend(self._generate_one(catalog, seed, i) for i in range(start, end))
+        else:
+            task = _generate_shard_range if sharded else _generate_range
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_pool_worker,
+                                     initargs=(self.output_dir, csv_path)) as pool:
+                for names in pool.map(task, [seed] * len(ranges), *zip(*ranges)):
+                    generated_files.extend(names)
 
-            base_name = f"synth_{random.randint(10000, 99999)}"
-            img_filename = f"{base_name}.png"
-            json_filename = f"{base_name}.json"
-            
-            img.save(os.path.join(self.output_dir, img_filename))
-            with open(os.path.join(self.output_dir, json_filename), "w") as f:
-                json.dump(boxes, f, indent=2)
-            
-            generated_files.append(img_filename)
-            
+        if sharded:
+            write_manifest(self.output_dir)
         return generated_files
 
+    def iter_documents(self, count: int, seed: int, csv_path: str = None, settings: ScanSettings = None,
+                       indices=None):
+        """
+        Yields (name, RGB array, ground truth boxes) in memory, nothing is
+        written. Same documents as generate_batch for the same seed and
+        default settings. `indices` restricts to a subset of range(count).
+        """
+        catalog = self._load_catalog(csv_path)
+        for index in (range(count) if indices is None else indices):
+            name, img, boxes = self._render_one(catalog, seed, index, settings)
+            yield name, np.asarray(img), boxes
+
+    def _render_one(self, catalog, seed: int, index: int, settings: ScanSettings = None):
+        rng = random.Random(f"{seed}:{index}")
+        np_rng = np.random.default_rng([seed, index])
+
+        doc = self._generate_doc_data(catalog, rng)
+        img, boxes = self._render_image(doc)
+        
+        # --- APPLY NOISE HERE ---
+        img = self.apply_scan_effects(img, rng, np_rng, settings)
+        # ------------------------
+
+        return f"synth_{seed}_{index:06d}", img, boxes
+
+    def _generate_one(self, catalog, seed: int, index: int) -> str:
+        base_name, img, boxes = self._render_one(catalog, seed, index)
+        img_filename = f"{base_name}.png"
+        json_filename = f"{base_name}.json"
+        
+        img.save(os.path.join(self.output_dir, img_filename), compress_level=PNG_COMPRESS_LEVEL)
+        with open(os.path.join(self.output_dir, json_filename), "w") as f:
+            json.dump(boxes, f, indent=2)
+        return img_filename
+
+    def _generate_shard(self, catalog, seed: int, start: int, end: int) -> List[str]:
+        """Documents start..end-1 packed into one shard (named after the seed and first index)."""
+        writer = ShardWriter(self.output_dir, f"synth_{seed}_{start:06d}")
+        for index in range(start, end):
+            base_name, img, boxes = self._render_one(catalog, seed, index)
+            buffer = io.BytesIO()
+            img.save(buffer, format="PNG", compress_level=PNG_COMPRESS_LEVEL)
+            writer.add(f"{base_name}.png", buffer.getvalue(), json.dumps(boxes, indent=2).encode("utf-8"))
+        writer.close()
+        return writer.names
+
+    def generate_texts(self, count: int, csv_path: str = None) -> List[str]:
+        """Synthetic prescriptions as noise-free text (the lines drawn by _render_image)."""
+        catalog = self._load_catalog(csv_path)
+        return [self.render_text(self._generate_doc_data(catalog)) for _ in range(count)]
+
+    def render_text(self, doc: OrdoDoc) -> str:
+        lines = ["ORDONNANCE", f"Dr. {doc.prescriber_name}", f"Patient: {doc.patient_name}"]
+        for i, line in enumerate(doc.lines, 1):
+            lines.append(f"{i}. {line.drug_name} {line.strength}")
+            lines.append(line.posology)
+        return "\n".join(lines)
+
     def _load_catalog(self, csv_path):
-        """Loads MIMIC CSV or falls back to basic list."""
+        """
+        MIMIC rows, from the columnar cache of the CSV (see MimicCatalog:
+        rows are sampled by index, never all turned into dicts), or falls
+        back to basic list.
+        """
         if csv_path and os.path.exists(csv_path):
             try:
-                df = pd.read_csv(csv_path).fillna("")
-                return df.to_dict(orient="records")
+                return load_catalog(csv_path)
             except Exception as e:
                 print(f"Error reading CSV: {e}")
         
@@ -102,8 +229,9 @@ class PrescriptionGenerator:
             {"drug": "VOLTARENE", "prod_strength": "1%", "route": "TOPICAL", "form_rx": "gel"},
         ]
 
-    def _generate_doc_data(self, catalog):
-        selection = random.sample(catalog, k=min(random.randint(1, 3), len(catalog)))
+    def _generate_doc_data(self, catalog, rng: random.Random = None):
+        rng = rng or random
+        selection = rng.sample(catalog, k=min(rng.randint(1, 3), len(catalog)))
         lines = []
         for item in selection:
             # Map MIMIC columns to French
@@ -120,7 +248,7 @@ class PrescriptionGenerator:
             ))
             
         return OrdoDoc(
-            patient_name=f"Patient {random.randint(100, 999)}", 
+            patient_name=f"Patient {rng.randint(100, 999)}", 
             prescriber_name="Dr. House", 
             date_str="12/12/2024", 
             lines=lines
@@ -147,7 +275,7 @@ class PrescriptionGenerator:
             txt_drug = f"{i}. {line.drug_name} {line.strength}"
             draw.text((50, y), txt_drug, fill="black", font=font_bold)
             bbox = draw.textbbox((50, y), txt_drug, font=font_bold)
-            boxes.append({"label": "DRUG", "text": line.drug_name, "box": bbox})
+            boxes.append({"label": "DRUG", "text": line.drug_name, "strength": line.strength, "box": bbox})
             y += 30
             
             # Posology Line
@@ -0,0 +1,196 @@
+import os
+import json
+import uuid
+import shutil
+import hashlib
+import unicodedata
+from typing import List, Tuple, Optional
+import numpy as np
+import pandas as pd
+from rapidfuzz import fuzz, process
+from src.modules.catalog.service import load_catalog
+
+# --- CONFIGURATION ---
+LEXICON_DIR = "/app/uploads/lexicon"
+# Local French lexicon, columns: name, code (ATC or CIP)
+ATC_CIP_CSV_PATH = os.path.join(LEXICON_DIR, "atc_cip.csv")
+# Same MIMIC catalog the synthetic generator reads
+MIMIC_CSV_PATH = "/app/uploads/mimic_prescriptions.csv"
+INDEX_ROOT = os.path.join(LEXICON_DIR, "index")
+
+# Bump when the index layout or the normalization changes
+INDEX_FORMAT_VERSION = "1"
+# Below this rapidfuzz score (0-100) no code is assigned
+MIN_MATCH_SCORE = 80
+# Candidates (by shared trigrams) rescored with rapidfuzz
+CANDIDATES = 16
+
+# Names are reduced to this alphabet, so a trigram maps to a dense integer id
+ALPHABET = " ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
+_CHAR_ID = {c: i for i, c in enumerate(ALPHABET)}
+_BASE = len(ALPHABET)
+N_TRIGRAMS = _BASE ** 3
+
+def normalize_drug_name(name: str) -> str:
+    """Uppercase ASCII, accents stripped, punctuation collapsed to single spaces."""
+    text = unicodedata.normalize("NFKD", str(name or "")).encode("ascii", "ignore").decode().upper()
+    text = "".join(c if c in _CHAR_ID else " " for c in text)
+    return " ".join(text.split())
+
+def _trigram_ids(normalized: str) -> np.ndarray:
+    padded = f" {normalized} "
+    ids = [
+        (_CHAR_ID[padded[i]] * _BASE + _CHAR_ID[padded[i + 1]]) * _BASE + _CHAR_ID[padded[i + 2]]
+        for i in range(len(padded) - 2)
+    ]
+    return np.unique(np.array(ids, dtype=np.int32))
+
+def _pack_strings(values: List[str]):
+    encoded = [v.encode("utf-8") for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(e) for e in encoded], out=offsets[1:])
+    blob = np.frombuffer(b"".join(encoded), dtype=np.uint8) if encoded else np.zeros(0, dtype=np.uint8)
+    return blob, offsets
+
+def lexicon_sources() -> List[str]:
+    return [p for p in (ATC_CIP_CSV_PATH, MIMIC_CSV_PATH) if os.path.exists(p)]
+
+def lexicon_signature(sources: List[str] = None) -> Optional[str]:
+    """
+    Identifies the lexicon content (source files + index format), or None
+    without sources. Cheap: only stats the files.
+    """
+    sources = lexicon_sources() if sources is None else sources
+    if not sources:
+        return None
+    h = hashlib.sha1(INDEX_FORMAT_VERSION.encode())
+    for path in sources:
+        stat = os.stat(path)
+        h.update(f"{path}|{stat.st_size}|{stat.st_mtime_ns}".encode())
+    return h.hexdigest()[:12]
+
+def read_lexicon_entries(sources: List[str]) -> List[Tuple[str, str]]:
+    """(name, code) pairs. Local ATC/CIP entries win over MIMIC ones for the same name."""
+    entries = []
+    for path in sources:
+        if path == ATC_CIP_CSV_PATH:
+            df = pd.read_csv(path, usecols=["name", "code"], dtype=str).dropna()
+            entries.extend(zip(df["name"], df["code"]))
+        else:
+            # MIMIC PRESCRIPTIONS (columnar cache shared with the generator):
+            # the NDC is the most specific code available
+            catalog = load_catalog(path)
+            code_col = next((c for c in ("ndc", "formulary_drug_cd") if c in catalog.columns), None)
+            rows = catalog.first_rows("drug", required=(code_col,) if code_col else ())
+            for i in rows:
+                row = catalog[i]
+                entries.append((row["drug"], f"{code_col.upper()}:{row[code_col]}" if code_col else ""))
+    return entries
+
+class DrugNormalizer:
+    """
+    Maps OCR'd drug names to lexicon codes.
+    The lexicon is compiled into a trigram inverted index (CSR arrays) stored as
+    .npy files and memory-mapped at load time: a lookup gathers the posting
+    lists of the query's trigrams, keeps the names sharing most trigrams and
+    rescores only those with rapidfuzz. No per-line scan of the lexicon.
+    """
+    def __init__(self, index_dir: str, signature: str = None):
+        load = lambda name: np.load(os.path.join(index_dir, f"{name}.npy"), mmap_mode="r")
+        self.names_blob = load("names_blob")
+        self.names_offsets = load("names_offsets")
+        self.codes_blob = load("codes_blob")
+        self.codes_offsets = load("codes_offsets")
+        self.postings_indptr = load("postings_indptr")
+        self.postings = load("postings")
+        self.size = len(self.names_offsets) - 1
+        self.index_dir = index_dir
+        self.signature = signature or os.path.basename(index_dir.rstrip("/"))
+
+    @classmethod
+    def build(cls, entries: List[Tuple[str, str]], index_dir: str, signature: str = None) -> "DrugNormalizer":
+        """Compiles (name, code) pairs into an index directory (written atomically)."""
+        names, codes, seen = [], [], set()
+        for name, code in entries:
+            normalized = normalize_drug_name(name)
+            if normalized and normalized not in seen:
+                seen.add(normalized)
+                names.append(normalized)
+                codes.append(str(code or ""))
+
+        # Trigram -> entry ids, as CSR (indptr over all possible trigram ids)
+        gram_lists = [_trigram_ids(n) for n in names]
+        lengths = np.array([len(g) for g in gram_lists], dtype=np.int64)
+        all_grams = np.concatenate(gram_lists) if gram_lists else np.zeros(0, dtype=np.int32)
+        all_entries = np.repeat(np.arange(len(names), dtype=np.int32), lengths)
+        order = np.argsort(all_grams, kind="stable")
+        postings = all_entries[order]
+        indptr = np.zeros(N_TRIGRAMS + 1, dtype=np.int64)
+        np.cumsum(np.bincount(all_grams, minlength=N_TRIGRAMS), out=indptr[1:])
+
+        names_blob, names_offsets = _pack_strings(names)
+        codes_blob, codes_offsets = _pack_strings(codes)
+
+        tmp_dir = f"{index_dir.rstrip('/')}.tmp-{uuid.uuid4().hex}"
+        os.makedirs(tmp_dir)
+        for name, array in (("names_blob", names_blob), ("names_offsets", names_offsets),
+                            ("codes_blob", codes_blob), ("codes_offsets", codes_offsets),
+                            ("postings_indptr", indptr), ("postings", postings)):
+            np.save(os.path.join(tmp_dir, f"{name}.npy"), array)
+        with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+            json.dump({"entries": len(names), "format": INDEX_FORMAT_VERSION}, f)
+
+        try:
+            os.rename(tmp_dir, index_dir)
+        except OSError:
+            # Built concurrently by another worker: keep theirs
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        return cls(index_dir, signature)
+
+    def name(self, i: int) -> str:
+        return bytes(self.names_blob[self.names_offsets[i]:self.names_offsets[i + 1]]).decode("utf-8")
+
+    def code(self, i: int) -> str:
+        return bytes(self.codes_blob[self.codes_offsets[i]:self.codes_offsets[i + 1]]).decode("utf-8")
+
+    def lookup(self, drug_name: str) -> Tuple[Optional[str], float]:
+        """Returns (code, confidence 0-1). code is None below MIN_MATCH_SCORE."""
+        query = normalize_drug_name(drug_name)
+        if not query or self.size == 0:
+            return None, 0.0
+
+        # 1. Candidates sharing the most trigrams with the query
+        grams = _trigram_ids(query)
+        starts, ends = self.postings_indptr[grams], self.postings_indptr[grams + 1]
+        hits = [self.postings[s:e] for s, e in zip(starts, ends) if e > s]
+        if not hits:
+            return None, 0.0
+        counts = np.bincount(np.concatenate(hits))
+        k = min(CANDIDATES, np.count_nonzero(counts))
+        candidates = np.argpartition(-counts, k - 1)[:k]
+
+        # 2. Rescore the few candidates
+        best = process.extractOne(query, [self.name(i) for i in candidates], scorer=fuzz.ratio)
+        _, score, position = best
+        code = self.code(int(candidates[position])) if score >= MIN_MATCH_SCORE else None
+        return code or None, round(score / 100, 2)
+
+def load_default_normalizer() -> Optional[DrugNormalizer]:
+    """
+    Loads the index matching the current lexicon sources, building it first if
+    needed. Returns None when no lexicon source is available.
+    """
+    sources = lexicon_sources()
+    signature = lexicon_signature(sources)
+    if signature is None:
+        return None
+
+    index_dir = os.path.join(INDEX_ROOT, signature)
+    if os.path.exists(os.path.join(index_dir, "meta.json")):
+        return DrugNormalizer(index_dir, signature)
+
+    print(f"Building drug lexicon index {signature} from {sources}...")
+    os.makedirs(INDEX_ROOT, exist_ok=True)
+    normalizer = DrugNormalizer.build(read_lexicon_entries(sources), index_dir, signature)
+    print(f"Drug lexicon index ready ({normalizer.size} entries)")
+    return normalizer
@@ -0,0 +1,160 @@
+import os
+import queue
+from contextlib import contextmanager
+from typing import List
+import numpy as np
+
+# Parallelism comes from running pages side by side, so each Tesseract runs
+# single-threaded to avoid oversubscribing the cores. libgomp reads this once,
+# when tesserocr loads it: it must be set before the import (the Dockerfile
+# also sets it).
+os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
+import pytesseract
+
+try:
+    import tesserocr
+except ImportError:  # Optional: needs libtesseract-dev at build time
+    tesserocr = None
+
+# "auto" uses the in-process engine pool when tesserocr is installed
+OCR_BACKEND = os.getenv("OCR_BACKEND", "auto")
+
+class OCRBackend:
+    """
+    Interface for the Tesseract engine used by OCRService.
+    Implementations must be safe to call from several threads at once.
+    """
+    name = "base"
+
+    def __init__(self, lang: str = "fra"):
+        self.lang = lang
+
+    def image_to_string(self, img: np.ndarray, psm: int = 6) -> str:
+        raise NotImplementedError
+
+    def image_to_data(self, img: np.ndarray, psm: int = 6) -> List[dict]:
+        """
+        Recognized words in reading order:
+        {"text", "conf" (0-100), "box": [x, y, w, h], "line": [block, paragraph, line]}.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+class PytesseractBackend(OCRBackend):
+    """
+    Fallback backend: every call spawns a `tesseract` process, writes the image
+    to a temp file and reloads the traineddata.
+    """
+    name = "pytesseract"
+
+    def image_to_string(self, img: np.ndarray, psm: int = 6) -> str:
+        return pytesseract.image_to_string(img, lang=self.lang, config=f"--psm {psm}")
+
+    def image_to_data(self, img: np.ndarray, psm: int = 6) -> List[dict]:
+        data = pytesseract.image_to_data(img, lang=self.lang, config=f"--psm {psm}",
+                                         output_type=pytesseract.Output.DICT)
+        rows = zip(data["text"], data["conf"], data["left"], data["top"], data["width"], data["height"],
+                   data["block_num"], data["par_num"], data["line_num"])
+        # conf is -1 on the block/paragraph/line rows
+        return [
+            {"text": text.strip(), "conf": float(conf), "box": [left, top, width, height], "line": [block, par, line]}
+            for text, conf, left, top, width, height, block, par, line in rows
+            if float(conf) >= 0 and text.strip()
+        ]
+
+class TesserocrBackend(OCRBackend):
+    """
+    Long-lived pool of initialized Tesseract API handles (one per worker thread).
+    The traineddata is loaded once per handle and images are handed over as raw
+    buffers, without subprocesses or temp files.
+    """
+    name = "tesserocr"
+
+    def __init__(self, lang: str = "fra", pool_size: int = 1):
+        super().__init__(lang)
+        if tesserocr is None:
+            raise RuntimeError("tesserocr is not installed")
+
+        self._handles = []
+        self._pool = queue.Queue()
+        for _ in range(max(1, pool_size)):
+            api = tesserocr.PyTessBaseAPI(lang=lang)
+            self._handles.append(api)
+            self._pool.put(api)
+
+    @contextmanager
+    def _acquire(self):
+        api = self._pool.get()
+        try:
+            yield api
+        finally:
+            api.Clear()
+            self._pool.put(api)
+
+    def image_to_string(self, img: np.ndarray, psm: int = 6) -> str:
+        img = np.ascontiguousarray(img)
+        height, width = img.shape[:2]
+        bytes_per_pixel = 1 if img.ndim == 2 else img.shape[2]
+
+        with self._acquire() as api:
+            api.SetPageSegMode(psm)
+            api.SetImageBytes(img.tobytes(), width, height, bytes_per_pixel, img.strides[0])
+            return api.GetUTF8Text()
+
+    def image_to_data(self, img: np.ndarray, psm: int = 6) -> List[dict]:
+        img = np.ascontiguousarray(img)
+        height, width = img.shape[:2]
+        bytes_per_pixel = 1 if img.ndim == 2 else img.shape[2]
+        level = tesserocr.RIL.WORD
+
+        words = []
+        block = par = line = 0
+        with self._acquire() as api:
+            api.SetPageSegMode(psm)
+            api.SetImageBytes(img.tobytes(), width, height, bytes_per_pixel, img.strides[0])
+            api.Recognize()
+            iterator = api.GetIterator()
+            if iterator is None:
+                return words
+            for word in tesserocr.iterate_level(iterator, level):
+                # Same numbering as Tesseract's TSV output (from 1, reset by the enclosing level)
+                if word.IsAtBeginningOf(tesserocr.RIL.BLOCK):
+                    block, par = block + 1, 0
+                if word.IsAtBeginningOf(tesserocr.RIL.PARA):
+                    par, line = par + 1, 0
+                if word.IsAtBeginningOf(tesserocr.RIL.TEXTLINE):
+                    line += 1
+                text = (word.GetUTF8Text(level) or "").strip()
+                box = word.BoundingBox(level)
+                if text and box:
+                    x1, y1, x2, y2 = box
+                    words.append({"text": text, "conf": float(word.Confidence(level)),
+                                  "box": [x1, y1, x2 - x1, y2 - y1], "line": [block, par, line]})
+        return words
+
+    def close(self):
+        for api in self._handles:
+            api.End()
+        self._handles = []
+
+def create_backend(name: str = None, lang: str = "fra", pool_size: int = 1) -> OCRBackend:
+    """
+    Builds the configured backend. Falls back to pytesseract when the engine
+    pool cannot be created (library missing, traineddata not found, ...).
+    """
+    name = (name or OCR_BACKEND).lower()
+
+    if name in ("auto", "tesserocr"):
+        try:
+            return TesserocrBackend(lang=lang, pool_size=pool_size)
+        except Exception as e:
+            if name == "tesserocr":
+                print(f"Tesserocr backend unavailable ({e}), falling back to pytesseract")
+
+    if name not in ("auto", "tesserocr", "pytesseract"):
+        raise ValueError(f"Unknown OCR backend: {name}")
+
+    return PytesseractBackend(lang=lang)
@@ -1,66 +1,529 @@
 import cv2
-import pytesseract
 import numpy as np
-from pdf2image import convert_from_path
+from concurrent.futures import ThreadPoolExecutor
+from pdf2image import convert_from_path, pdfinfo_from_path
 from PIL import Image
+import io
 import os
+import re
+import time
+import subprocess
+from itertools import groupby
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+from src.modules.vision.backends import OCRBackend, create_backend
+
+# Configuration
+PDF_DPI = int(os.getenv("OCR_PDF_DPI", "200"))
+# Number of pages rasterized at once; bounds memory regardless of page count
+PDF_CHUNK_SIZE = int(os.getenv("OCR_PDF_CHUNK_SIZE", "4"))
+# Pages OCR'd in parallel (both OCR backends release the GIL while recognizing)
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", str(os.cpu_count() or 1)))
+# PDF pages whose embedded text layer has at least this many letters/digits skip OCR
+PDF_TEXT_MIN_CHARS = int(os.getenv("OCR_PDF_TEXT_MIN_CHARS", "40"))
+# Share of legible characters below which a text layer is treated as garbage (broken font encodings)
+PDF_TEXT_MIN_LEGIBLE = 0.9
+PDF_TEXT_TIMEOUT = 60
+# Text height (px, median character box) images are rescaled to: ~10pt text at 300 DPI
+OCR_TARGET_TEXT_HEIGHT = int(os.getenv("OCR_TARGET_TEXT_HEIGHT", "24"))
+# Below this, Tesseract accuracy drops quickly: smaller text is upscaled
+OCR_MIN_TEXT_HEIGHT = int(os.getenv("OCR_MIN_TEXT_HEIGHT", "12"))
+# Text up to this factor above the target is left at its resolution
+TEXT_HEIGHT_TOLERANCE = 1.25
+# Character-like connected components needed for a page not to be blank
+MIN_TEXT_COMPONENTS = 5
+# Gray levels (1st to 99th percentile) under which a page is blank
+MIN_PAGE_CONTRAST = 40
+# Large images are decoded at 1/2, 1/4 or 1/8 scale while they keep at least this many pixels
+OCR_DECODE_MIN_PIXELS = int(os.getenv("OCR_DECODE_MIN_PIXELS", "2000000"))
+REDUCED_GRAYSCALE = {2: cv2.IMREAD_REDUCED_GRAYSCALE_2, 4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+                     8: cv2.IMREAD_REDUCED_GRAYSCALE_8}
+# Two-tier OCR: a fast pass on downscaled text, full resolution only where confidence is low
+OCR_TIERED = os.getenv("OCR_TIERED", "true").lower() == "true"
+# Text height (px) of the fast pass
+OCR_FAST_TEXT_HEIGHT = int(os.getenv("OCR_FAST_TEXT_HEIGHT", "16"))
+# Lines under this mean word confidence (0-100) are read again at full resolution
+OCR_LINE_CONFIDENCE = float(os.getenv("OCR_LINE_CONFIDENCE", "75"))
+# Pages under this mean confidence, or with too many weak lines, are read again whole
+OCR_PAGE_CONFIDENCE = float(os.getenv("OCR_PAGE_CONFIDENCE", "50"))
+MAX_LINE_RETRIES = 8
+# Bump whenever preprocessing changes the OCR output (invalidates cached results)
+PREPROCESSING_VERSION = "3"
+
+def ocr_config_fingerprint(lang: str = "fra", dpi: int = PDF_DPI) -> str:
+    """Identifies the settings that affect OCR output. Used as part of the result cache key."""
+    return (f"{lang}|psm6|dpi{dpi}|pre{PREPROCESSING_VERSION}|th{OCR_TARGET_TEXT_HEIGHT}-{OCR_MIN_TEXT_HEIGHT}"
+            f"|txt{PDF_TEXT_MIN_CHARS}|{ocr_mode_fingerprint()}")
+
+def ocr_mode_fingerprint() -> str:
+    if not OCR_TIERED:
+        return "single"
+    return f"tiered{OCR_FAST_TEXT_HEIGHT}-{OCR_LINE_CONFIDENCE:g}-{OCR_PAGE_CONFIDENCE:g}"
+
+def extract_pdf_text(file_path: str, page_count: int) -> Optional[List[str]]:
+    """
+    Embedded text of each page (pdftotext, layout preserved), or None when
+    it cannot be read (no text layer tool, encrypted or broken file).
+    """
+    try:
+        result = subprocess.run(
+            ["pdftotext", "-layout", "-enc", "UTF-8", file_path, "-"],
+            capture_output=True, timeout=PDF_TEXT_TIMEOUT, check=True
+        )
+    except (OSError, subprocess.SubprocessError) as e:
+        print(f"No embedded text for {file_path}: {e}")
+        return None
+    # Pages are separated (and terminated) by form feeds
+    pages = result.stdout.decode("utf-8", errors="replace").split("\f")
+    if len(pages) < page_count:
+        return None
+    return [page.strip() for page in pages[:page_count]]
+
+def has_text_coverage(text: str) -> bool:
+    """Whether an embedded text layer can replace OCR: enough text, and legible."""
+    visible = [c for c in text if not c.isspace()]
+    if sum(c.isalnum() for c in visible) < PDF_TEXT_MIN_CHARS:
+        return False
+    legible = sum(c.isprintable() and c != "\ufffd" for c in visible)
+    return legible / len(visible) >= PDF_TEXT_MIN_LEGIBLE
+
+def analyze_layout(gray: np.ndarray) -> Optional[Tuple[float, Tuple[int, int, int, int]]]:
+    """
+    Median text height and bounding box (x0, y0, x1, y1) of the text of a
+    (denoised) grayscale page, or None when the page is blank.
+    Text is found as character-sized connected components of the Otsu
+    binarization; blobs touching the border (table, shadows, page edges)
+    and specks are ignored.
+    """
+    # 1. Contrast (on a subsample): a uniform page holds no text
+    sample = gray[::4, ::4]
+    low, high = np.percentile(sample, (1, 99))
+    if high - low < MIN_PAGE_CONTRAST:
+        return None
+
+    # 2. Character candidates
+    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    _, _, stats, _ = cv2.connectedComponentsWithStats(binary, connectivity=8)
+    x, y, w, h, area = stats[1:].T
+    height, width = gray.shape
+    is_char = (
+        (h >= 4) & (area >= 8) & (h <= height // 2) & (w <= width // 2)
+        & (x > 0) & (y > 0) & (x + w < width) & (y + h < height)
+    )
+    if np.count_nonzero(is_char) < MIN_TEXT_COMPONENTS:
+        return None
+
+    # 3. Height and extent, with a margin of one text line
+    text_height = float(np.median(h[is_char]))
+    margin = int(text_height)
+    box = (
+        max(int(x[is_char].min()) - margin, 0),
+        max(int(y[is_char].min()) - margin, 0),
+        min(int((x + w)[is_char].max()) + margin, width),
+        min(int((y + h)[is_char].max()) + margin, height),
+    )
+    return text_height, box
+
+def text_scale(text_height: float) -> float:
+    """Resize factor bringing text to OCR_TARGET_TEXT_HEIGHT (1.0 when already readable and not oversized)."""
+    if text_height > OCR_TARGET_TEXT_HEIGHT * TEXT_HEIGHT_TOLERANCE:
+        return OCR_TARGET_TEXT_HEIGHT / text_height
+    if text_height < OCR_MIN_TEXT_HEIGHT:
+        return OCR_MIN_TEXT_HEIGHT / text_height
+    return 1.0
+
+def reduction_factor(width: int, height: int) -> int:
+    """Largest decoding reduction (1, 2, 4, 8) keeping OCR_DECODE_MIN_PIXELS pixels."""
+    for factor in (8, 4, 2):
+        if width * height / factor ** 2 >= OCR_DECODE_MIN_PIXELS:
+            return factor
+    return 1
+
+def is_pdf(file_path: str) -> bool:
+    return file_path.split('.')[-1].lower() == 'pdf'
+
+def join_pages(file_path: str, texts: List[str]) -> str:
+    """Text of a whole document: PDF pages under `--- Page N ---` markers, an image's text as is."""
+    if not is_pdf(file_path):
+        return texts[0] if texts else ""
+    return "".join(f"\n--- Page {i} ---\n{text}" for i, text in enumerate(texts, 1))
+
+# Page markers written by join_pages
+PAGE_MARKER = re.compile(r"\n--- Page \d+ ---\n")
+
+def split_pages(file_path: str, raw_text: str) -> List[str]:
+    """Texts of the pages of a document (inverse of join_pages)."""
+    if not is_pdf(file_path):
+        return [raw_text or ""]
+    return PAGE_MARKER.split(raw_text or "")[1:]
+
+def page_summary(page: dict) -> dict:
+    """How a page (an iter_pages result) was read, without its text and words."""
+    return {"page": page["page"], "source": page["source"], "chars": len(page["text"]),
+            "confidence": page.get("confidence"), "tier": page.get("tier")}
+
+def mean_confidence(words: List[dict]) -> Optional[float]:
+    """Word confidences averaged by character count (None without words)."""
+    chars = sum(len(w["text"]) for w in words)
+    return sum(w["conf"] * len(w["text"]) for w in words) / chars if chars else None
+
+def words_to_text(words: List[dict]) -> str:
+    """Words back to text: one line per Tesseract line, paragraphs separated by a blank line."""
+    lines, previous = [], None
+    for line_id, line_words in groupby(words, key=lambda w: tuple(w["line"])):
+        if previous is not None and line_id[:2] != previous[:2]:
+            lines.append("")
+        lines.append(" ".join(w["text"] for w in line_words))
+        previous = line_id
+    return "\n".join(lines)
+
+@dataclass
+class NormalizedPage:
+    """Text region of a page, ready for OCR, and its position in the source image."""
+    image: np.ndarray
+    # Median character height in `image` (px)
+    text_height: float
+    # Top-left corner of the crop in the source image
+    offset: Tuple[int, int]
+    # `image` pixels per source image pixel
+    scale: float
+
+    def to_source(self, box: List[float]) -> List[int]:
+        """[x, y, w, h] in `image` -> in the source image."""
+        x, y, w, h = box
+        return [round(self.offset[0] + x / self.scale), round(self.offset[1] + y / self.scale),
+                round(w / self.scale), round(h / self.scale)]
+
+def _runs(page_numbers: List[int]) -> List[Tuple[int, int]]:
+    """(first, last) of each run of consecutive page numbers."""
+    runs = []
+    for n in page_numbers:
+        if runs and runs[-1][1] == n - 1:
+            runs[-1] = (runs[-1][0], n)
+        else:
+            runs.append((n, n))
+    return runs
 
 class OCRService:
-    def __init__(self):
+    def __init__(self, dpi: int = PDF_DPI, chunk_size: int = PDF_CHUNK_SIZE, workers: int = OCR_WORKERS,
+                 backend: OCRBackend = None):
         # Ensure Tesseract knows where the data files are (standard linux path)
         # In the Dockerfile we installed tesseract-ocr-fra
         self.lang = 'fra'
+        self.dpi = dpi
+        self.workers = max(1, workers)
+        self.chunk_size = max(1, chunk_size)
+
+        self._executor = None
+        if self.workers > 1:
+            # Tesseract itself is kept single-threaded (OMP_THREAD_LIMIT, see backends)
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="ocr")
+
+        # Tesseract engine (in-process pool with one handle per worker, or pytesseract)
+        self.backend = backend or create_backend(lang=self.lang, pool_size=self.workers)
+
+    @property
+    def config_fingerprint(self) -> str:
+        return ocr_config_fingerprint(self.lang, self.dpi)
+
+    def close(self):
+        """Stops the page thread pool and releases the Tesseract engine handles."""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        self.backend.close()
 
     def process_file(self, file_path: str) -> str:
         """
         Main entry point: Handles both PDF and Images.
         Returns the combined extracted text.
         """
-        ext = file_path.split('.')[-1].lower()
-        extracted_text = ""
-
-        if ext == 'pdf':
-            # Convert PDF to list of PIL Images
-            images = convert_from_path(file_path)
-            for i, img in enumerate(images):
-                # Convert PIL to OpenCV format (numpy)
-                open_cv_image = np.array(img) 
-                # RGB to BGR for OpenCV
-                open_cv_image = open_cv_image[:, :, ::-1].copy() 
-                
-                text = self._process_single_image(open_cv_image)
-                extracted_text += f"\n--- Page {i+1} ---\n{text}"
-        else:
+        return self.process_file_pages(file_path)[0]
+
+    def process_file_pages(self, file_path: str) -> Tuple[str, List[dict]]:
+        """
+        Combined text, and the path each page took:
+        [{"page": 1, "source": "text" | "ocr", "chars": ..., "confidence": ..., "tier": ...}, ...].
+        Raises on the first page that failed.
+        """
+        pages = list(self.iter_pages(file_path))
+        for page in pages:
+            if "error" in page:
+                raise RuntimeError(f"Page {page['page']}: {page['error']}")
+        return join_pages(file_path, [page["text"] for page in pages]), [page_summary(page) for page in pages]
+
+    def page_count(self, file_path: str) -> int:
+        return pdfinfo_from_path(file_path)["Pages"] if is_pdf(file_path) else 1
+
+    def iter_pages(self, file_path: str, page_numbers: List[int] = None):
+        """
+        Yields the result of each page (all, or `page_numbers`), in page order:
+        {"page", "source", "text", "confidence", "tier", "words", "timings"}
+        (see read), or {"page", "error"} for a page that failed, so that the
+        others can still be kept.
+        """
+        if is_pdf(file_path):
+            yield from self.iter_pdf_pages(file_path, page_numbers)
+        elif page_numbers is None or 1 in page_numbers:
             # It is an image (png, jpg)
-            img = cv2.imread(file_path)
-            if img is None:
-                raise ValueError(f"Could not load image at {file_path}")
-            extracted_text = self._process_single_image(img)
+            try:
+                start = time.perf_counter()
+                img = self.load_image(file_path)
+                decode_ms = (time.perf_counter() - start) * 1000
+                result = self._process_single_image(img)
+                result["timings"] = {"decode_ms": round(decode_ms, 2), **result["timings"]}
+                yield {"page": 1, "source": "ocr", **result}
+            except Exception as e:
+                yield {"page": 1, "error": str(e)}
+
+    def iter_pdf_pages(self, file_path: str, page_numbers: List[int] = None):
+        """
+        Yields {"page", "source", "text", ...} for each PDF page (all, or
+        `page_numbers`), in page order. Born-digital pages use their embedded
+        text layer ("text"); only pages without enough of it are rasterized
+        and OCR'd ("ocr").
+        """
+        page_count = pdfinfo_from_path(file_path)["Pages"]
+        wanted = [n for n in range(1, page_count + 1) if page_numbers is None or n in page_numbers]
+        start = time.perf_counter()
+        embedded = extract_pdf_text(file_path, page_count) or [""] * page_count
+        text_ms = (time.perf_counter() - start) * 1000 / max(page_count, 1)
+        use_text = [has_text_coverage(text) for text in embedded]
+        ocr_results = self._ocr_pdf_pages(file_path, [n for n in wanted if not use_text[n - 1]])
+
+        for n in wanted:
+            if use_text[n - 1]:
+                yield {"page": n, "source": "text", "text": embedded[n - 1], "confidence": None, "tier": 0,
+                       "words": [], "timings": {"text_ms": round(text_ms, 2)}}
+            else:
+                yield {"page": n, "source": "ocr", **next(ocr_results)}
+
+    def _ocr_pdf_pages(self, file_path: str, page_numbers: List[int]):
+        """
+        Yields the OCR result (see read) of the given pages, in order.
+        Pages are rendered in chunks of `chunk_size`, directly in grayscale,
+        so memory stays flat as the page count grows. Pages of a chunk are
+        OCR'd in parallel.
+        """
+        for i in range(0, len(page_numbers), self.chunk_size):
+            chunk = page_numbers[i:i + self.chunk_size]
+            start = time.perf_counter()
+            try:
+                images = []
+                # One rendering call per run of consecutive pages
+                for first_page, last_page in _runs(chunk):
+                    images += convert_from_path(
+                        file_path,
+                        dpi=self.dpi,
+                        first_page=first_page,
+                        last_page=last_page,
+                        grayscale=True,
+                        thread_count=min(self.workers, last_page - first_page + 1)
+                    )
+            except Exception as e:
+                for _ in chunk:
+                    yield {"error": f"Rendering failed: {e}"}
+                continue
+            render_ms = (time.perf_counter() - start) * 1000 / len(chunk)
+            # Grayscale PIL -> 2D uint8 array (single copy, no BGR conversion)
+            pages = [np.asarray(img) for img in images]
+            del images
+
+            for result in self._map(self._try_process_single_image, pages):
+                if "timings" in result:
+                    result["timings"] = {"render_ms": round(render_ms, 2), **result["timings"]}
+                yield result
+
+    def _map(self, fn, items):
+        """Ordered map, parallel when workers > 1."""
+        if self._executor is None or len(items) < 2:
+            return map(fn, items)
+        return self._executor.map(fn, items)
+
+    def load_image(self, file_path: str) -> np.ndarray:
+        """Decodes an image file (png, jpg) to a grayscale array (see _decode)."""
+        try:
+            # Reads the header only
+            with Image.open(file_path) as probe:
+                size = probe.size
+        except Exception:
+            size = None
+        img = self._decode(lambda flags: cv2.imread(file_path, flags), size)
+        if img is None:
+            raise ValueError(f"Could not load image at {file_path}")
+        return img
+
+    def decode_image(self, data) -> np.ndarray:
+        """Decodes encoded image bytes (png, jpg), e.g. read from a dataset shard, to a grayscale array."""
+        buffer = np.frombuffer(data, dtype=np.uint8)
+        try:
+            with Image.open(io.BytesIO(buffer)) as probe:
+                size = probe.size
+        except Exception:
+            size = None
+        img = self._decode(lambda flags: cv2.imdecode(buffer, flags), size)
+        if img is None:
+            raise ValueError("Could not decode image bytes")
+        return img
+
+    def _decode(self, read, size) -> Optional[np.ndarray]:
+        """
+        Decodes directly in grayscale. Large images (phone photos) are first
+        decoded reduced (for JPEG, by the DCT itself: much less work), and
+        kept unless their text became too small to read.
+        """
+        factor = reduction_factor(*size) if size else 1
+        if factor > 1:
+            img = read(REDUCED_GRAYSCALE[factor])
+            if img is not None:
+                layout = analyze_layout(cv2.medianBlur(img, 3))
+                if layout is None or layout[0] >= OCR_MIN_TEXT_HEIGHT:
+                    return img
+        return read(cv2.IMREAD_GRAYSCALE)
+
+    def _process_single_image(self, img_cv2) -> dict:
+        """
+        Applies Computer Vision preprocessing and runs Tesseract (see read),
+        with the time spent in each (ms).
+        Accepts BGR images or already grayscale (2D) arrays.
+        """
+        start = time.perf_counter()
+        page = self.normalize(img_cv2)
+        normalized = time.perf_counter()
+        result = self.read(page)
+        result["timings"] = {
+            "normalize_ms": round((normalized - start) * 1000, 2),
+            "ocr_ms": round((time.perf_counter() - normalized) * 1000, 2)
+        }
+        return result
 
-        return extracted_text
+    def _try_process_single_image(self, img_cv2) -> dict:
+        try:
+            return self._process_single_image(img_cv2)
+        except Exception as e:
+            return {"error": str(e)}
 
-    def _process_single_image(self, img_cv2) -> str:
+    def preprocess(self, img_cv2) -> Optional[np.ndarray]:
+        """Normalize and binarize an image for OCR. None for a blank page."""
+        page = self.normalize(img_cv2)
+        return None if page is None else self.binarize(page.image)
+
+    def normalize(self, img_cv2) -> Optional[NormalizedPage]:
         """
-        Applies Computer Vision preprocessing and runs Tesseract.
+        Grayscale crop of the text region, rescaled so that text is about
+        OCR_TARGET_TEXT_HEIGHT px high. None for a blank page.
         """
         # 1. Grayscale (Essential for OCR)
-        gray = cv2.cvtColor(img_cv2, cv2.COLOR_BGR2GRAY)
+        if img_cv2.ndim == 2:
+            gray = img_cv2
+        else:
+            gray = cv2.cvtColor(img_cv2, cv2.COLOR_BGR2GRAY)
+
+        # 2. Text height and extent (margins and background hold nothing for Tesseract)
+        layout = analyze_layout(cv2.medianBlur(gray, 3))
+        if layout is None:
+            return None
+        text_height, (x0, y0, x1, y1) = layout
+        region = gray[y0:y1, x0:x1]
+
+        # 3. Resolution: oversized text is only extra pixels to process, tiny text is misread
+        scale = text_scale(text_height)
+        if scale != 1.0:
+            region = self._resize(region, scale)
+        return NormalizedPage(region, text_height * scale, (x0, y0), scale)
+
+    @staticmethod
+    def _resize(img: np.ndarray, scale: float) -> np.ndarray:
+        size = (max(1, round(img.shape[1] * scale)), max(1, round(img.shape[0] * scale)))
+        return cv2.resize(img, size, interpolation=cv2.INTER_AREA if scale < 1 else cv2.INTER_CUBIC)
+
+    def read(self, page: Optional[NormalizedPage]) -> dict:
+        """
+        OCR of a normalized page: {"text", "confidence", "tier", "words"}.
+        Words carry their confidence and box (in source image pixels) and
+        the tier that read them. A single image_to_string pass (no words)
+        unless OCR_TIERED. Blank pages (None) skip Tesseract.
+        """
+        if page is None:
+            return {"text": "", "confidence": None, "tier": 0, "words": []}
+        if not OCR_TIERED:
+            return {"text": self.recognize(self.binarize(page.image)), "confidence": None, "tier": 1, "words": []}
+
+        words, tier = self._read_tiered(page)
+        for word in words:
+            word["box"] = page.to_source(word["box"])
+        return {"text": words_to_text(words), "confidence": mean_confidence(words), "tier": tier, "words": words}
+
+    def _read_tiered(self, page: NormalizedPage) -> Tuple[List[dict], int]:
+        """Words (boxes in page.image pixels) and the highest tier used."""
+        # 1. Fast pass on downscaled text
+        fast_scale = min(1.0, OCR_FAST_TEXT_HEIGHT / page.text_height)
+        small = page.image if fast_scale == 1.0 else self._resize(page.image, fast_scale)
+        words = self._words(small, psm=6, tier=1, scale=fast_scale)
+        confidence = mean_confidence(words)
+
+        # 2. Second reading with text at the target height: full resolution, or
+        # upscaled when the page text is smaller (the fast pass then already
+        # read it at full resolution, repeating it would give the same words)
+        full_scale = max(1.0, OCR_TARGET_TEXT_HEIGHT / page.text_height)
+        if full_scale == fast_scale:
+            return words, 1
+        full = page.image if full_scale == 1.0 else self._resize(page.image, full_scale)
+
+        # Whole page when most of it is weak...
+        lines = [list(line) for _, line in groupby(words, key=lambda w: tuple(w["line"]))]
+        weak = [i for i, line in enumerate(lines) if mean_confidence(line) < OCR_LINE_CONFIDENCE]
+        if confidence is None or confidence < OCR_PAGE_CONFIDENCE or len(weak) > MAX_LINE_RETRIES:
+            retry = self._words(full, psm=6, tier=2, scale=full_scale)
+            if confidence is None or (mean_confidence(retry) or 0) > confidence:
+                return retry, 2
+            return words, 2
+
+        # ...otherwise only its weak lines, each as a single text line
+        pad = page.text_height / 2
+        height, width = full.shape
+        for i in weak:
+            # Line box (page pixels) -> crop of the tier 2 image
+            x0 = max(int((min(w["box"][0] for w in lines[i]) - pad) * full_scale), 0)
+            y0 = max(int((min(w["box"][1] for w in lines[i]) - pad) * full_scale), 0)
+            x1 = min(int((max(w["box"][0] + w["box"][2] for w in lines[i]) + pad) * full_scale), width)
+            y1 = min(int((max(w["box"][1] + w["box"][3] for w in lines[i]) + pad) * full_scale), height)
+            retry = self._words(full[y0:y1, x0:x1], psm=7, tier=2, scale=full_scale,
+                                offset=(x0 / full_scale, y0 / full_scale))
+            if retry and mean_confidence(retry) > mean_confidence(lines[i]):
+                for word in retry:
+                    word["line"] = lines[i][0]["line"]
+                lines[i] = retry
+        return [w for line in lines for w in line], 2 if weak else 1
+
+    def _words(self, gray: np.ndarray, psm: int, tier: int, scale: float = 1.0, offset=(0, 0)) -> List[dict]:
+        """image_to_data on a binarized copy, boxes mapped to full resolution page pixels."""
+        words = self.backend.image_to_data(self.binarize(gray), psm=psm)
+        for word in words:
+            x, y, w, h = word["box"]
+            word["box"] = [offset[0] + x / scale, offset[1] + y / scale, w / scale, h / scale]
+            word["tier"] = tier
+        return words
 
-        # 2. Denoising (Crucial for the 'Salt & Pepper' noise we added in Phase 3.1)
+    def binarize(self, gray: np.ndarray) -> np.ndarray:
+        """Denoise and binarize a grayscale image."""
+        # 1. Denoising (Crucial for the 'Salt & Pepper' noise we added in Phase 3.1)
         # MedianBlur is excellent for removing salt-and-pepper noise
         denoised = cv2.medianBlur(gray, 3)
 
-        # 3. Thresholding (Binarization)
+        # 2. Thresholding (Binarization)
         # Otsu's thresholding automatically finds the best separation between text and background
         _, thresh = cv2.threshold(denoised, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
 
-        # 4. (Optional) Deskewing could go here if rotation is severe
+        # 3. (Optional) Deskewing could go here if rotation is severe
         # For now, Tesseract 4/5 handles slight rotations well.
+        return thresh
 
-        # 5. Run OCR
+    def recognize(self, thresh: Optional[np.ndarray]) -> str:
+        """Runs Tesseract on a preprocessed image ("" for a blank page, without Tesseract)."""
+        if thresh is None:
+            return ""
         # --psm 6: Assume a single uniform block of text. Good for prescriptions.
-        config = "--psm 6" 
-        text = pytesseract.image_to_string(thresh, lang=self.lang, config=config)
+        text = self.backend.image_to_string(thresh, psm=6)
 
         return text.strip()
-    
\ No newline at end of file
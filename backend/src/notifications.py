@@ -0,0 +1,94 @@
+"""
+Document status push notifications.
+
+Status changes are published with Postgres NOTIFY from inside the transaction
+that writes them (delivered on commit), so they reach every backend node no
+matter which API process or worker made the change. Each API process keeps a
+single LISTEN connection and fans events out to its SSE subscribers.
+"""
+import json
+import time
+import uuid
+import select
+import asyncio
+import threading
+import psycopg2
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from src.database import DATABASE_URL
+
+CHANNEL = "document_status"
+TERMINAL_STATUSES = {"completed", "failed"}
+
+def notify_document_status(db: Session, document_id: uuid.UUID, status):
+    """Queues a NOTIFY in the current transaction."""
+    payload = json.dumps({"id": str(document_id), "status": getattr(status, "value", status)})
+    db.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": CHANNEL, "payload": payload})
+
+class StatusBroadcaster:
+    """
+    Listens on CHANNEL in a background thread and dispatches events to the
+    asyncio queues of subscribers interested in the document.
+    """
+    def __init__(self, dsn: str = DATABASE_URL, reconnect_delay: float = 2.0):
+        self.dsn = dsn
+        self.reconnect_delay = reconnect_delay
+        self._subscribers = {}  # document id (str) -> set of (loop, queue)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def subscribe(self, document_ids) -> asyncio.Queue:
+        self._ensure_started()
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        with self._lock:
+            for doc_id in document_ids:
+                self._subscribers.setdefault(str(doc_id), set()).add((loop, queue))
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        with self._lock:
+            for doc_id in list(self._subscribers):
+                self._subscribers[doc_id] = {s for s in self._subscribers[doc_id] if s[1] is not queue}
+                if not self._subscribers[doc_id]:
+                    del self._subscribers[doc_id]
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._listen_forever, daemon=True, name="status-listener")
+                self._thread.start()
+
+    def _dispatch(self, payload: str):
+        try:
+            event = json.loads(payload)
+        except ValueError:
+            return
+        with self._lock:
+            targets = list(self._subscribers.get(event.get("id"), ()))
+        for loop, queue in targets:
+            loop.call_soon_threadsafe(queue.put_nowait, event)
+
+    def _listen_forever(self):
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(self.dsn)
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {CHANNEL};")
+
+                while True:
+                    # Wake up periodically: poll() raises if the connection dropped
+                    select.select([conn], [], [], 5.0)
+                    conn.poll()
+                    while conn.notifies:
+                        self._dispatch(conn.notifies.pop(0).payload)
+            except Exception as e:
+                print(f"Status listener error: {e}. Reconnecting...")
+                time.sleep(self.reconnect_delay)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+broadcaster = StatusBroadcaster()
@@ -0,0 +1,135 @@
+import os
+import time
+import uuid
+from sqlalchemy.orm import Session
+from src import models, crud
+from src.modules.vision.service import OCRService, join_pages, page_summary
+from src.modules.extraction.service import ExtractionService
+from src.modules.normalization.service import load_default_normalizer
+
+# Upper bound for the OCR/extraction result cache (LRU eviction beyond it)
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+# Prescriptions read, extracted and written back at once by reextract()
+REEXTRACT_BATCH_SIZE = int(os.getenv("REEXTRACT_BATCH_SIZE", "2000"))
+
+class DocumentPipeline:
+    """
+    OCR + Extraction for a single document.
+    Shared by the standalone worker (`src.worker`) and any other caller.
+    Exceptions are propagated so the job queue can decide whether to retry.
+    """
+    def __init__(self, ocr_service: OCRService = None, extraction_service: ExtractionService = None):
+        self.ocr_service = ocr_service or OCRService()
+        self.extraction_service = extraction_service or ExtractionService(normalizer=load_default_normalizer())
+
+    def process(self, db: Session, doc_id: uuid.UUID, pages: list = None):
+        """
+        1. Mark as PROCESSING
+        2. Reuse a cached result for identical bytes, if any
+        3. OCR (Vision) + Extraction (NLP) of each page, committed page by page
+        4. Save the document result to DB + cache
+        Pages already completed by a previous attempt are skipped; `pages`
+        forces those page numbers to be processed again (single page retry).
+        """
+        # Same extractor version as the API's cache lookups (lexicon uploaded since startup)
+        self.extraction_service.reload_normalizer()
+        db_doc = crud.update_document_status(db, doc_id, models.ProcessingStatus.PROCESSING)
+        if not db_doc:
+            raise ValueError(f"Document {doc_id} not found")
+        file_path = db_doc.file_path
+        content_hash = db_doc.content_hash
+        ocr_config = self.ocr_service.config_fingerprint
+
+        # Cache hit (same scan may have been processed since the upload)
+        cached = None if pages else crud.get_cached_result(db, content_hash, ocr_config, self.extraction_service.version)
+        if cached:
+            print(f"Cache hit for {doc_id}")
+            crud.save_cached_pages(db, doc_id, file_path, cached)
+            crud.update_document_text(db, doc_id, cached.raw_text, mark_completed=False,
+                                      page_sources=cached.page_sources)
+            crud.update_prescription_structure(db, doc_id, cached.structured_json, cached.extractor_version)
+            crud.update_document_status(db, doc_id, models.ProcessingStatus.COMPLETED)
+            return
+
+        # 1. Pages to do
+        crud.init_document_pages(db, doc_id, self.ocr_service.page_count(file_path))
+        todo = [
+            page.page_number for page in crud.get_document_pages(db, doc_id)
+            if page.status != models.ProcessingStatus.COMPLETED or (pages and page.page_number in pages)
+        ]
+
+        # 2. OCR (or the embedded text layer of born-digital PDF pages) + Extraction, per page
+        print(f"Starting OCR for {doc_id} ({len(todo)} page(s))")
+        failed = []
+        for result in self.ocr_service.iter_pages(file_path, todo):
+            if "error" in result:
+                print(f"Page {result['page']} of {doc_id} failed: {result['error']}")
+                failed.append(result["page"])
+                crud.save_document_page(db, doc_id, result["page"], status=models.ProcessingStatus.FAILED,
+                                        error=result["error"])
+                continue
+
+            start = time.perf_counter()
+            structured_page = self.extraction_service.extract_from_text(result["text"])
+            timings = {**result["timings"], "extraction_ms": round((time.perf_counter() - start) * 1000, 2)}
+            crud.save_document_page(
+                db, doc_id, result["page"], status=models.ProcessingStatus.COMPLETED, error=None,
+                source=result["source"], text=result["text"], structured_json=structured_page,
+                extractor_version=self.extraction_service.version,
+                confidence=result["confidence"], tier=result["tier"], words=result["words"], timings=timings
+            )
+
+        # Completed pages are kept: the retry of the job only redoes the failed ones
+        if failed:
+            raise RuntimeError(f"{len(failed)} page(s) failed: {failed}")
+
+        # 3. Document result, from its pages. Pages extracted by another
+        # extractor version (earlier attempt, cached document, re-extraction
+        # since) are extracted again from their text first.
+        page_rows = crud.get_document_pages(db, doc_id)
+        for page in page_rows:
+            if page.extractor_version != self.extraction_service.version:
+                crud.save_document_page(db, doc_id, page.page_number,
+                                        structured_json=self.extraction_service.extract_from_text(page.text or ""),
+                                        extractor_version=self.extraction_service.version)
+        page_rows = crud.get_document_pages(db, doc_id)
+        raw_text = join_pages(file_path, [page.text for page in page_rows])
+        page_sources = [
+            page_summary({"page": page.page_number, "source": page.source, "text": page.text,
+                          "confidence": page.confidence, "tier": page.tier})
+            for page in page_rows
+        ]
+        structured_data = self.extraction_service.merge_pages([page.structured_json for page in page_rows])
+        crud.update_document_text(db, doc_id, raw_text, mark_completed=False, page_sources=page_sources)
+        crud.update_prescription_structure(db, doc_id, structured_data, self.extraction_service.version)
+
+        if content_hash:
+            crud.store_cached_result(db, content_hash, ocr_config, self.extraction_service.version,
+                                     raw_text, structured_data, RESULT_CACHE_MAX_BYTES, page_sources)
+
+        # Only now are the results complete (clients fetch them on this event)
+        crud.update_document_status(db, doc_id, models.ProcessingStatus.COMPLETED)
+        print(f"Processing complete for {doc_id}")
+
+    def reextract(self, db: Session, read_db: Session, batch_size: int = REEXTRACT_BATCH_SIZE,
+                  workers: int = None) -> int:
+        """
+        Re-runs extraction on the stored OCR text of every prescription that is
+        not at the current extractor version (no OCR). Rows are streamed from
+        `read_db` (server-side cursor, never committed) and each batch is
+        extracted on the process pool, then written and committed through `db`:
+        an interrupted run resumes where it stopped. Returns the number of
+        prescriptions updated.
+        Per-page extractions (document_pages) keep their own version: they are
+        redone from the page text if the document is rebuilt from its pages.
+        """
+        self.extraction_service.reload_normalizer()
+        version = self.extraction_service.version
+        updated = 0
+        for rows in crud.stream_stale_prescriptions(read_db, version, batch_size):
+            start = time.perf_counter()
+            results = self.extraction_service.extract_many([row.raw_text for row in rows], workers=workers)
+            updated += crud.save_reextracted(db, rows, results, version)
+            print(f"Re-extracted {len(rows)} prescriptions in {time.perf_counter() - start:.1f}s ({updated} so far)")
+        print(f"Re-extraction complete: {updated} prescriptions at extractor version {version}")
+        return updated
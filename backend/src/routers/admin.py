@@ -1,8 +1,13 @@
 import os
+import random
 import shutil
-from fastapi import APIRouter, UploadFile, File, BackgroundTasks, HTTPException
-from src.modules.generator.service import PrescriptionGenerator
-from src.benchmark import BenchmarkRunner
+import datetime
+from typing import Optional, Literal
+from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Query
+from sqlalchemy.orm import Session
+from src.database import get_db
+from src import crud
+from src.benchmark import BenchmarkRun, BENCHMARK_WORKERS, summarize_results
 
 router = APIRouter(
     prefix="/admin",
@@ -11,19 +16,162 @@ router = APIRouter(
 
 UPLOAD_DIR = "/app/uploads"
 SYNTHETIC_DIR = "/app/uploads/synthetic"
+SYNTHETIC_SHARDS_DIR = "/app/uploads/synthetic_shards"
+MIMIC_CSV_PATH = os.path.join(UPLOAD_DIR, "mimic_prescriptions.csv")
+# Bytes copied at once while storing an upload
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+@router.post("/upload-mimic-csv")
+def upload_mimic_csv(file: UploadFile = File(...), db: Session = Depends(get_db)):
+    """
+    Stores the MIMIC PRESCRIPTIONS CSV used by the synthetic generator and the
+    drug lexicon (streamed to disk, never held in memory), then queues its
+    ingestion, in chunks, into the columnar catalog cache (run by a worker).
+    """
+    if not file.filename or not file.filename.lower().endswith(".csv"):
+        raise HTTPException(status_code=400, detail="Expected a .csv file")
+
+    # Written next to the target then renamed: readers never see a partial file
+    tmp_path = f"{MIMIC_CSV_PATH}.uploading"
+    with open(tmp_path, "wb") as buffer:
+        shutil.copyfileobj(file.file, buffer, UPLOAD_CHUNK_SIZE)
+    size = os.path.getsize(tmp_path)
+    os.replace(tmp_path, MIMIC_CSV_PATH)
+
+    job = crud.enqueue_job(db, kind="ingest_catalog", max_attempts=3, payload={"csv_path": MIMIC_CSV_PATH})
+    return {"message": f"Uploaded {file.filename}, building the catalog...", "size_bytes": size,
+            "job_id": str(job.id)}
 
 @router.post("/generate-synthetic-data")
-def generate_synthetic_data(count: int = 5, background_tasks: BackgroundTasks = None):
-    csv_path = os.path.join(UPLOAD_DIR, "mimic_prescriptions.csv")
-    if not os.path.exists(csv_path):
-        csv_path = None
-        
-    generator = PrescriptionGenerator(output_dir=SYNTHETIC_DIR)
-    background_tasks.add_task(generator.generate_batch, count=count, csv_path=csv_path)
-    
-    return {"message": f"Generating {count} documents..."}
+def generate_synthetic_data(
+    count: int = 5,
+    seed: Optional[int] = None,
+    workers: Optional[int] = Query(None, ge=1),
+    sharded: bool = False,
+    db: Session = Depends(get_db)
+):
+    """
+    Queues the rendering of `count` synthetic prescriptions; a worker runs
+    it on a process pool (`workers`, default: CPU count). The same seed
+    always produces the same dataset. `sharded` packs them into shard files
+    (synthetic_shards/) instead of one png + json per document.
+    """
+    if seed is None:
+        seed = random.SystemRandom().randint(0, 2**31 - 1)
+
+    # Same seed, same files: a retried job just writes them again
+    job = crud.enqueue_job(db, kind="generate_synthetic", max_attempts=3, payload={
+        "count": count, "seed": seed, "workers": workers, "sharded": sharded,
+        "output_dir": SYNTHETIC_SHARDS_DIR if sharded else SYNTHETIC_DIR, "csv_path": MIMIC_CSV_PATH
+    })
+    return {"message": f"Generating {count} documents...", "seed": seed, "job_id": str(job.id)}
+
+def _get_run(run_id: str) -> BenchmarkRun:
+    try:
+        run = BenchmarkRun(run_id)
+    except ValueError:
+        run = None
+    if run is None or not run.exists():
+        raise HTTPException(status_code=404, detail="Benchmark run not found")
+    return run
+
+def _with_progress(status: dict) -> dict:
+    total = status.get("total")
+    status["progress"] = round(status.get("done", 0) / total, 4) if total else None
+    return status
 
 @router.post("/run-benchmark")
-def run_benchmark_test():
-    runner = BenchmarkRunner()
-    return runner.run_full_benchmark()
+def run_benchmark_test(
+    workers: Optional[int] = Query(None, ge=1),
+    limit: Optional[int] = Query(None, ge=1),
+    dataset: Optional[Literal["files", "shards"]] = None,
+    db: Session = Depends(get_db)
+):
+    """
+    Queues a benchmark run on the synthetic dataset (the packed shards when
+    present, unless `dataset` says otherwise). A worker executes it; follow
+    it with GET /admin/benchmarks/{run_id}.
+    """
+    workers = workers or BENCHMARK_WORKERS
+    run = BenchmarkRun.create({"workers": workers, "limit": limit, "dataset_format": dataset})
+    job = crud.enqueue_job(
+        db, kind="benchmark", max_attempts=1,
+        payload={"run_id": run.run_id, "workers": workers, "limit": limit, "dataset": dataset}
+    )
+    run.update_status(job_id=str(job.id))
+    return {"message": "Benchmark queued", "run_id": run.run_id, "job_id": str(job.id)}
+
+@router.get("/benchmarks")
+def list_benchmarks():
+    """All stored benchmark runs, most recent first."""
+    return [_with_progress(status) for status in BenchmarkRun.list_runs()]
+
+@router.get("/benchmarks/{run_id}")
+def get_benchmark(run_id: str):
+    """State and progress of a run (with its summary once finished)."""
+    return _with_progress(_get_run(run_id).read_status())
+
+@router.get("/benchmarks/{run_id}/results")
+def get_benchmark_results(
+    run_id: str,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000)
+):
+    """
+    Metrics over the documents processed so far (also while the run is in
+    progress) and a page of the per-document results.
+    """
+    run = _get_run(run_id)
+    status = _with_progress(run.read_status())
+    rows = run.read_results()
+
+    # Throughput so far: elapsed time since the run started
+    started_at = status.get("started_at")
+    elapsed = None
+    if started_at:
+        end = status.get("finished_at") or datetime.datetime.utcnow().isoformat()
+        elapsed = (datetime.datetime.fromisoformat(end) - datetime.datetime.fromisoformat(started_at)).total_seconds()
+
+    return {
+        "run_id": run.run_id,
+        "state": status["state"],
+        "progress": status["progress"],
+        "metrics": summarize_results(rows, elapsed) if rows else None,
+        "offset": offset,
+        "results": rows[offset:offset + limit]
+    }
+
+@router.post("/benchmarks/{run_id}/cancel")
+def cancel_benchmark(run_id: str):
+    """Stops a queued or running benchmark; results so far are kept."""
+    run = _get_run(run_id)
+    state = run.read_status()["state"]
+    if state not in ("queued", "running"):
+        raise HTTPException(status_code=409, detail=f"Benchmark run is already {state}")
+    run.request_cancel()
+    return {"message": "Cancellation requested", "run_id": run.run_id}
+
+@router.post("/rebuild-metrics")
+def rebuild_metrics(db: Session = Depends(get_db)):
+    """
+    Recomputes the stored validation metrics and aggregates behind /statistics/global
+    (e.g. after changing MetricsService). Runs in a worker.
+    """
+    job = crud.enqueue_job(db, kind="rebuild_metrics", max_attempts=1)
+    return {"message": "Metrics rebuild queued", "job_id": str(job.id)}
+
+@router.post("/reextract")
+def reextract(
+    batch_size: Optional[int] = Query(None, ge=1),
+    workers: Optional[int] = Query(None, ge=1),
+    db: Session = Depends(get_db)
+):
+    """
+    Re-runs extraction on the stored OCR text of the prescriptions that are not
+    at the current extractor version (e.g. after bumping EXTRACTOR_VERSION).
+    Runs in a worker, batch by batch; a retried or repeated job skips the
+    prescriptions already done.
+    """
+    job = crud.enqueue_job(db, kind="reextract", max_attempts=3,
+                           payload={"batch_size": batch_size, "workers": workers})
+    return {"message": "Re-extraction queued", "job_id": str(job.id)}
@@ -1,12 +1,18 @@
 import os
-import shutil
+import json
 import uuid
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, BackgroundTasks
+import asyncio
+from typing import List, Dict, Any, Optional
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Request, Response, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from src.database import get_db, SessionLocal
 from src import models, schemas, crud
-from src.modules.vision.service import OCRService
-from src.modules.extraction.service import ExtractionService
+from src.notifications import broadcaster, TERMINAL_STATUSES
+from src.storage import save_upload
+from src.modules.vision.service import ocr_config_fingerprint
+from src.modules.extraction.service import current_extractor_version
 from fastapi.responses import FileResponse
 
 router = APIRouter(
@@ -14,80 +20,240 @@ router = APIRouter(
     tags=["documents"]
 )
 
-# Services
-ocr_service = OCRService()
-extraction_service = ExtractionService()
-UPLOAD_DIR = "/app/uploads"
+ALLOWED_CONTENT_TYPES = ["application/pdf", "image/jpeg", "image/png"]
+# Seconds between SSE keep-alives; statuses are also re-read from the DB at this
+# pace as a safety net for notifications missed while the listener reconnected.
+EVENT_KEEPALIVE_SECONDS = 15
+# Upper bound for the ids of one batch status/results request
+MAX_BATCH_IDS = 1000
 
-# --- BACKGROUND TASK LOGIC ---
-def process_document_task(doc_id: uuid.UUID, file_path: str):
+# --- STATUS STREAM (Server-Sent Events) ---
+def _load_statuses(document_ids: list) -> dict:
+    db = SessionLocal()
+    try:
+        return {str(d.id): d.status.value for d in crud.get_documents_by_ids(db, document_ids)}
+    finally:
+        db.close()
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def _status_event_stream(request: Request, document_ids: list):
     """
-    1. OCR (Vision)
-    2. Extraction (NLP)
-    3. Save to DB
+    Pushes status transitions until every document reached a terminal status.
+    Subscribes before reading the current statuses so no transition is missed.
     """
-    db = SessionLocal()
+    queue = broadcaster.subscribe(document_ids)
     try:
-        # 1. OCR
-        print(f"Starting OCR for {doc_id}")
-        raw_text = ocr_service.process_file(file_path)
-        crud.update_document_text(db, doc_id, raw_text)
+        pending = {str(doc_id) for doc_id in document_ids}
+        last_sent = {}
 
-        # 2. Extraction
-        print(f"Starting Extraction for {doc_id}")
-        structured_data = extraction_service.extract_from_text(raw_text)
-        crud.update_prescription_structure(db, doc_id, structured_data)
+        def emit(statuses: dict) -> list:
+            messages = []
+            for doc_id, status in statuses.items():
+                if doc_id in pending and last_sent.get(doc_id) != status:
+                    last_sent[doc_id] = status
+                    if status in TERMINAL_STATUSES:
+                        pending.discard(doc_id)
+                    messages.append(_sse("status", {"id": doc_id, "status": status}))
+            return messages
 
-        print(f"Processing complete for {doc_id}")
-    except Exception as e:
-        print(f"Error processing {doc_id}: {e}")
-        # Set status to FAILED
-        crud.update_document_status(db, doc_id, models.ProcessingStatus.FAILED, error_message=str(e))
+        # 1. Current state
+        snapshot = await run_in_threadpool(_load_statuses, document_ids)
+        for doc_id in pending - set(snapshot):
+            pending.discard(doc_id)
+            yield _sse("not_found", {"id": doc_id})
+        for message in emit(snapshot):
+            yield message
+
+        # 2. Live transitions
+        while pending:
+            if await request.is_disconnected():
+                break
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=EVENT_KEEPALIVE_SECONDS)
+                statuses = {event["id"]: event["status"]}
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                statuses = await run_in_threadpool(_load_statuses, list(pending))
+            for message in emit(statuses):
+                yield message
+
+        yield _sse("done", {"ids": [str(doc_id) for doc_id in document_ids]})
     finally:
-        db.close()
+        broadcaster.unsubscribe(queue)
+
+def _event_response(request: Request, document_ids: list) -> StreamingResponse:
+    return StreamingResponse(
+        _status_event_stream(request, document_ids),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 # --- ENDPOINTS ---
 @router.post("/upload", response_model=schemas.DocumentResponse)
 def upload_document(
-    background_tasks: BackgroundTasks,
     file: UploadFile = File(...), 
+    site: Optional[str] = Form(None), # Uploading site/clinic (per-site statistics)
     db: Session = Depends(get_db)
 ):
     """
-    Phase 4 Goal: Saves file, creates DB entry, triggers OCR.
+    Saves file, creates DB entry and queues the OCR job.
+    Processing happens in the standalone worker (`python -m src.worker`).
+    Re-uploads of an already processed scan complete immediately from the result cache.
     """
     # 1. Validation
-    if file.content_type not in ["application/pdf", "image/jpeg", "image/png"]:
+    if file.content_type not in ALLOWED_CONTENT_TYPES:
         raise HTTPException(status_code=400, detail="Invalid file type")
 
-    # 2. Save File
-    file_extension = file.filename.split(".")[-1]
-    unique_filename = f"{uuid.uuid4()}.{file_extension}"
-    file_path = os.path.join(UPLOAD_DIR, unique_filename)
-
+    # 2. Save File (content-addressed, hashed while streaming)
     try:
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        file_path, content_hash = save_upload(file.file, file.filename)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-    # 3. Create DB Entry
-    doc = crud.create_document(db=db, filename=file.filename, file_path=file_path)
+    # 3. Cache hit: reuse the stored results, nothing to process
+    cached = crud.get_cached_result(db, content_hash, ocr_config_fingerprint(), current_extractor_version())
+    if cached:
+        return crud.create_document_from_cache(db, file.filename, file_path, content_hash, cached, site=site)
 
-    # 4. Trigger Background Task Immediately
-    background_tasks.add_task(process_document_task, doc.id, file_path)
+    # 4. Create DB Entry + Job (same transaction)
+    doc = crud.create_document(db=db, filename=file.filename, file_path=file_path, content_hash=content_hash, site=site)
 
     return doc
 
+@router.post("/batch", response_model=list[schemas.DocumentResponse])
+def upload_documents_batch(
+    files: List[UploadFile] = File(...),
+    site: Optional[str] = Form(None),
+    db: Session = Depends(get_db)
+):
+    """
+    Uploads many files in one multipart request.
+    All documents and their jobs are inserted in a single transaction.
+    Returns the created documents in the order the files were sent.
+    """
+    # 1. Validation (reject the whole batch before writing anything)
+    invalid = [f.filename for f in files if f.content_type not in ALLOWED_CONTENT_TYPES]
+    if invalid:
+        raise HTTPException(status_code=400, detail=f"Invalid file type: {', '.join(invalid)}")
+
+    # 2. Save Files
+    uploads = []
+    try:
+        for file in files:
+            file_path, content_hash = save_upload(file.file, file.filename)
+            uploads.append({"filename": file.filename, "file_path": file_path, "content_hash": content_hash})
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    # 3. Cache lookup (one query for the batch)
+    cached = crud.get_cached_results(
+        db, [u["content_hash"] for u in uploads], ocr_config_fingerprint(), current_extractor_version()
+    )
+
+    # 4. Bulk insert documents + jobs
+    return crud.create_documents_bulk(db, uploads, cached, site=site)
+
 @router.get("/", response_model=list[schemas.DocumentResponse])
 def list_documents(
+    response: Response,
     validated: bool = None, # Query param: ?validated=true/false
+    limit: int = Query(100, ge=1, le=500),
+    cursor: Optional[str] = None, # Value of X-Next-Cursor from the previous page
+    include_total: bool = False,
     db: Session = Depends(get_db)
 ):
     """
     Retorna a lista de documentos para a biblioteca.
+    Paginated by cursor: the next page's cursor is sent in the X-Next-Cursor
+    header (absent on the last page). With include_total=true, the
+    X-Total-Count-Estimate header carries the planner's row estimate.
     """
-    return crud.get_documents(db, validated=validated)
+    try:
+        docs = crud.get_documents(db, validated=validated, limit=limit, cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if len(docs) == limit:
+        response.headers["X-Next-Cursor"] = crud.encode_cursor(docs[-1])
+    if include_total:
+        response.headers["X-Total-Count-Estimate"] = str(crud.estimate_documents_count(db, validated))
+    return docs
+
+def _check_batch(body: schemas.DocumentBatchRequest, response_schema):
+    if len(body.ids) > MAX_BATCH_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_IDS} ids per request")
+    if body.fields:
+        unknown = set(body.fields) - set(response_schema.model_fields)
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    return set(body.fields) if body.fields else None
+
+@router.post("/status:batch", response_model=list[Dict[str, Any]])
+def get_documents_status_batch(body: schemas.DocumentBatchRequest, db: Session = Depends(get_db)):
+    """
+    Status of many documents in one request (unknown ids are omitted).
+    `fields` restricts the returned keys (`id` is always included).
+    """
+    fields = _check_batch(body, schemas.DocumentResponse)
+    include = fields | {"id"} if fields else None
+
+    docs = crud.get_documents_by_ids(db, body.ids)
+    return [schemas.DocumentResponse.model_validate(d).model_dump(include=include) for d in docs]
+
+@router.post("/results:batch", response_model=list[Dict[str, Any]])
+def get_documents_results_batch(body: schemas.DocumentBatchRequest, db: Session = Depends(get_db)):
+    """
+    Extraction results of many documents in one request, with the
+    Prescription rows loaded in the same query. Documents whose results are
+    not ready (or unknown ids) are omitted.
+    `fields` restricts the returned keys (`document_id` is always included).
+    """
+    fields = _check_batch(body, schemas.PrescriptionResponse)
+    include = fields | {"document_id"} if fields else None
+
+    docs = crud.get_documents_by_ids(db, body.ids, with_prescription=True)
+    return [
+        schemas.PrescriptionResponse.model_validate(d.prescription).model_dump(include=include)
+        for d in docs if d.prescription
+    ]
+
+@router.get("/events")
+def stream_documents_status(request: Request, ids: str):
+    """
+    Server-Sent Events stream of status changes for several documents
+    (e.g. an upload batch). Query param: ?ids=<uuid>,<uuid>,...
+    Sends the current status first, then every transition, and closes once
+    all documents are completed or failed.
+    """
+    try:
+        document_ids = [uuid.UUID(i) for i in ids.split(",") if i.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid document id")
+    if not document_ids:
+        raise HTTPException(status_code=400, detail="No document id given")
+    return _event_response(request, document_ids)
+
+@router.post("/events")
+def stream_documents_status_batch(request: Request, body: schemas.DocumentIdsRequest):
+    """
+    Same stream as GET /documents/events, with the ids in the JSON body
+    (for large upload batches that would not fit in a URL).
+    """
+    if not body.ids:
+        raise HTTPException(status_code=400, detail="No document id given")
+    return _event_response(request, body.ids)
+
+@router.get("/{document_id}/events")
+def stream_document_status(document_id: uuid.UUID, request: Request):
+    """
+    Server-Sent Events stream of status changes for one document.
+    """
+    # No request-scoped session: it would stay checked out for the whole stream
+    if not _load_statuses([document_id]):
+        raise HTTPException(status_code=404, detail="Document not found")
+    return _event_response(request, [document_id])
 
 @router.get("/{document_id}/file")
 def get_document_file(document_id: str, db: Session = Depends(get_db)):
@@ -132,6 +298,40 @@ def get_document_result(document_id: str, db: Session = Depends(get_db)):
         
     return db_doc.prescription
 
+@router.get("/{document_id}/pages", response_model=List[schemas.DocumentPageResponse])
+def get_document_pages(document_id: str, include_words: bool = False, db: Session = Depends(get_db)):
+    """
+    Per-page results (text, extraction, OCR confidence, timings), each
+    available as soon as its page is done. Word boxes with `include_words`.
+    """
+    db_doc = crud.get_document(db, document_id)
+    if not db_doc:
+        raise HTTPException(status_code=404, detail="Document not found")
+
+    exclude = None if include_words else {"words"}
+    return [
+        schemas.DocumentPageResponse.model_validate(page).model_dump(exclude=exclude)
+        for page in crud.get_document_pages(db, db_doc.id)
+    ]
+
+@router.post("/{document_id}/pages/{page_number}/retry")
+def retry_document_page(document_id: str, page_number: int, db: Session = Depends(get_db)):
+    """
+    Processes one page again (e.g. after it failed) in a worker, then
+    rebuilds the document result from its pages.
+    """
+    # Locked until the job is queued: concurrent retries and workers wait
+    db_doc = crud.lock_document(db, document_id)
+    if not db_doc:
+        raise HTTPException(status_code=404, detail="Document not found")
+    if not crud.get_document_pages(db, db_doc.id, [page_number]):
+        raise HTTPException(status_code=404, detail="Page not found")
+    if db_doc.status in (models.ProcessingStatus.PENDING, models.ProcessingStatus.PROCESSING):
+        raise HTTPException(status_code=409, detail="Document is already being processed")
+
+    job = crud.requeue_document_page(db, db_doc, page_number)
+    return {"message": f"Page {page_number} queued", "job_id": str(job.id)}
+
 @router.put("/{document_id}/validate", response_model=schemas.PrescriptionResponse)
 def validate_document(
     document_id: str, 
@@ -1,20 +1,49 @@
+import datetime
+from typing import Optional, Literal
 from fastapi import APIRouter, Depends
 from sqlalchemy.orm import Session
 from src.database import get_db
-from src import models
-from src.modules.evaluation.service import MetricsService
+from src import crud
 
 router = APIRouter(prefix="/statistics", tags=["statistics"])
-metrics_service = MetricsService()
+
+def _format_row(row) -> dict:
+    count = row.count or 0
+    if count == 0:
+        return {"count": 0}
+    return {
+        "count": count,
+        "avg_precision": round(row.sum_precision / count, 2),
+        "avg_recall": round(row.sum_recall / count, 2),
+        "avg_f1": round(row.sum_f1 / count, 2),
+        "avg_similarity": round(row.sum_similarity / count, 2),
+        "true_positives": row.sum_true_positives,
+        "false_positives": row.sum_false_positives,
+        "false_negatives": row.sum_false_negatives
+    }
 
 @router.get("/global")
-def get_global_stats(db: Session = Depends(get_db)):
+def get_global_stats(
+    since: Optional[datetime.date] = None,
+    until: Optional[datetime.date] = None,
+    site: Optional[str] = None,
+    group_by: Optional[Literal["site", "day"]] = None,
+    db: Session = Depends(get_db)
+):
     """
     Returns aggregated performance metrics based on human validation.
+    Reads the running aggregates maintained at validation time (one row per
+    site and day), optionally restricted to a date window and/or a site,
+    with an optional per-site or per-day breakdown.
     """
-    # Fetch all VALIDATED prescriptions
-    prescriptions = db.query(models.Prescription).filter(
-        models.Prescription.is_validated == True
-    ).all()
+    totals = crud.get_metrics_summary(db, since=since, until=until, site=site)[0]
+    if not totals.count:
+        return {"count": 0, "message": "No validated documents found."}
 
-    return metrics_service.aggregate_stats(prescriptions)
\ No newline at end of file
+    stats = _format_row(totals)
+    if group_by:
+        rows = crud.get_metrics_summary(db, since=since, until=until, site=site, group_by=group_by)
+        stats["breakdown"] = [
+            {group_by: str(row.key), **_format_row(row)} for row in rows if row.count
+        ]
+    return stats
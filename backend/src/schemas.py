@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 from datetime import datetime
 from uuid import UUID
 from src.models import ProcessingStatus
@@ -19,6 +19,31 @@ class DocumentResponse(DocumentBase):
     class Config:
         from_attributes = True  # Allows Pydantic to read SQLAlchemy models
 
+class DocumentIdsRequest(BaseModel):
+    ids: List[UUID]
+
+class DocumentBatchRequest(DocumentIdsRequest):
+    # Optional projection, e.g. ["id", "status"]. All fields when omitted.
+    fields: Optional[List[str]] = None
+
+# --- Page Schemas ---
+class DocumentPageResponse(BaseModel):
+    page_number: int
+    status: ProcessingStatus
+    source: Optional[str]
+    text: Optional[str]
+    structured_json: Optional[Dict[str, Any]]
+    extractor_version: Optional[str] = None
+    confidence: Optional[float]
+    tier: Optional[int]
+    words: Optional[List[Dict[str, Any]]] = None
+    timings: Optional[Dict[str, float]]
+    error: Optional[str]
+    updated_at: Optional[datetime]
+
+    class Config:
+        from_attributes = True
+
 # --- Prescription Schemas ---
 class PrescriptionUpdate(BaseModel):
     structured_json: Dict[str, Any]
@@ -28,6 +53,7 @@ class PrescriptionResponse(BaseModel):
     id: UUID
     document_id: UUID
     raw_text: Optional[str]
+    page_sources: Optional[List[Dict[str, Any]]] = None
     structured_json: Optional[Dict[str, Any]]
     is_validated: bool
 
@@ -0,0 +1,46 @@
+import os
+import uuid
+import hashlib
+
+UPLOAD_DIR = "/app/uploads"
+# Content-addressed store: identical bytes are kept on disk only once
+BLOB_DIR = os.path.join(UPLOAD_DIR, "blobs")
+CHUNK_SIZE = 1024 * 1024
+
+def save_upload(fileobj, filename: str):
+    """
+    Streams an uploaded file to disk while hashing it (SHA-256).
+    The file is stored under its content hash, so re-uploading the same scan
+    reuses the existing file. Returns (file_path, content_hash).
+    """
+    os.makedirs(BLOB_DIR, exist_ok=True)
+    extension = filename.split(".")[-1].lower() if "." in filename else "bin"
+    tmp_path = os.path.join(BLOB_DIR, f".upload-{uuid.uuid4()}.tmp")
+
+    # 1. Copy + hash in a single pass
+    sha256 = hashlib.sha256()
+    try:
+        with open(tmp_path, "wb") as buffer:
+            while True:
+                chunk = fileobj.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                sha256.update(chunk)
+                buffer.write(chunk)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    # 2. Move into place (or drop the duplicate)
+    content_hash = sha256.hexdigest()
+    shard_dir = os.path.join(BLOB_DIR, content_hash[:2])
+    os.makedirs(shard_dir, exist_ok=True)
+    file_path = os.path.join(shard_dir, f"{content_hash}.{extension}")
+
+    if os.path.exists(file_path):
+        os.remove(tmp_path)
+    else:
+        os.replace(tmp_path, file_path)
+
+    return file_path, content_hash
@@ -0,0 +1,164 @@
+"""
+Standalone job worker.
+
+Claims jobs from the `jobs` table (SELECT ... FOR UPDATE SKIP LOCKED), keeps
+them leased with a heartbeat thread and retries failures with backoff.
+Any number of workers can run against the same database:
+
+    python -m src.worker
+"""
+import os
+import signal
+import socket
+import threading
+import time
+import traceback
+from src.database import SessionLocal, engine
+from src import models, crud
+from src.migrations import run_migrations
+from src.pipeline import DocumentPipeline, REEXTRACT_BATCH_SIZE
+from src.benchmark import BenchmarkRunner, BenchmarkRun, BENCHMARK_WORKERS
+from src.modules.generator.service import PrescriptionGenerator
+from src.modules.catalog.service import load_catalog
+
+# Configuration
+WORKER_ID = os.getenv("WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}"
+LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "120"))
+HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", "30"))
+POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "1.0"))
+RETRY_BASE_DELAY = float(os.getenv("JOB_RETRY_BASE_DELAY", "5"))
+
+class Heartbeat(threading.Thread):
+    """Extends the job lease periodically while the handler is running."""
+    def __init__(self, job_id, worker_id: str):
+        super().__init__(daemon=True)
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self.stopped = threading.Event()
+        self.lost = False
+
+    def run(self):
+        while not self.stopped.wait(HEARTBEAT_SECONDS):
+            db = SessionLocal()
+            try:
+                if not crud.heartbeat_job(db, self.job_id, self.worker_id, LEASE_SECONDS):
+                    print(f"[{self.worker_id}] Lost lease on job {self.job_id}")
+                    self.lost = True
+                    return
+            except Exception as e:
+                print(f"[{self.worker_id}] Heartbeat error for job {self.job_id}: {e}")
+            finally:
+                db.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+class Worker:
+    def __init__(self, worker_id: str = WORKER_ID):
+        self.worker_id = worker_id
+        self.pipeline = DocumentPipeline()
+        # Reused by every benchmark job (keeps a single Tesseract engine)
+        self.benchmark_runner = BenchmarkRunner()
+        self.running = True
+
+        # Job kind -> handler(db, job)
+        self.handlers = {
+            "process_document": self.handle_process_document,
+            "rebuild_metrics": self.handle_rebuild_metrics,
+            "benchmark": self.handle_benchmark,
+            "reextract": self.handle_reextract,
+            "generate_synthetic": self.handle_generate_synthetic,
+            "ingest_catalog": self.handle_ingest_catalog,
+        }
+
+    def handle_process_document(self, db, job: models.Job):
+        # A payload with "pages" re-processes only those pages
+        self.pipeline.process(db, job.document_id, pages=(job.payload or {}).get("pages"))
+
+    def handle_rebuild_metrics(self, db, job: models.Job):
+        crud.rebuild_metrics(db)
+
+    def handle_benchmark(self, db, job: models.Job):
+        payload = job.payload or {}
+        self.benchmark_runner.run_full_benchmark(
+            workers=payload.get("workers") or BENCHMARK_WORKERS,
+            limit=payload.get("limit"),
+            run=BenchmarkRun(payload["run_id"]),
+            dataset=payload.get("dataset")
+        )
+
+    def handle_reextract(self, db, job: models.Job):
+        payload = job.payload or {}
+        # Separate session for the cursor: the batches are committed through db
+        read_db = SessionLocal()
+        try:
+            self.pipeline.reextract(db, read_db, batch_size=payload.get("batch_size") or REEXTRACT_BATCH_SIZE,
+                                    workers=payload.get("workers"))
+        finally:
+            read_db.close()
+
+    def handle_generate_synthetic(self, db, job: models.Job):
+        payload = job.payload or {}
+        csv_path = payload.get("csv_path")
+        PrescriptionGenerator(output_dir=payload["output_dir"]).generate_batch(
+            payload["count"], csv_path=csv_path if csv_path and os.path.exists(csv_path) else None,
+            seed=payload["seed"], workers=payload.get("workers"), sharded=payload.get("sharded", False)
+        )
+
+    def handle_ingest_catalog(self, db, job: models.Job):
+        # No-op when the catalog of this CSV version is already built
+        load_catalog(job.payload["csv_path"])
+
+    def stop(self, *_):
+        print(f"[{self.worker_id}] Stopping after current job...")
+        self.running = False
+
+    def run_once(self) -> bool:
+        """Claims and runs a single job. Returns False if the queue was empty."""
+        db = SessionLocal()
+        try:
+            job = crud.claim_job(db, self.worker_id, LEASE_SECONDS, base_delay=RETRY_BASE_DELAY)
+            if not job:
+                return False
+
+            print(f"[{self.worker_id}] Claimed job {job.id} ({job.kind}), attempt {job.attempts}/{job.max_attempts}")
+            heartbeat = Heartbeat(job.id, self.worker_id)
+            heartbeat.start()
+            try:
+                handler = self.handlers.get(job.kind)
+                if handler is None:
+                    raise ValueError(f"Unknown job kind: {job.kind}")
+                handler(db, job)
+            except Exception as e:
+                heartbeat.stop()
+                db.rollback()
+                traceback.print_exc()
+                retried = crud.fail_job(db, job.id, self.worker_id, str(e), base_delay=RETRY_BASE_DELAY)
+                print(f"[{self.worker_id}] Job {job.id} failed ({'will retry' if retried else 'giving up'}): {e}")
+            else:
+                heartbeat.stop()
+                crud.complete_job(db, job.id, self.worker_id)
+            return True
+        finally:
+            db.close()
+
+    def run_forever(self):
+        print(f"[{self.worker_id}] Worker started (lease={LEASE_SECONDS}s, heartbeat={HEARTBEAT_SECONDS}s)")
+        while self.running:
+            try:
+                if not self.run_once():
+                    time.sleep(POLL_SECONDS)
+            except Exception as e:
+                # DB unavailable etc. Back off and keep going.
+                print(f"[{self.worker_id}] Worker loop error: {e}")
+                time.sleep(POLL_SECONDS * 5)
+
+if __name__ == "__main__":
+    models.Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
+
+    worker = Worker()
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+    worker.run_forever()
@@ -1,8 +1,13 @@
 import requests
 import os
+import json
 import time
 
 BACKEND_URL = os.getenv("BACKEND_URL", "http://backend:8000")
+# Files sent per /documents/batch request (keeps each multipart body reasonable)
+UPLOAD_BATCH_SIZE = 100
+# Documents per library page
+PAGE_SIZE = 100
 
 def check_health():
     try:
@@ -11,51 +16,70 @@ def check_health():
     except:
         return False
 
-def upload_document(file_bytes, filename, content_type):
-    files = {"file": (filename, file_bytes, content_type)}
-    response = requests.post(f"{BACKEND_URL}/documents/upload", files=files)
-    response.raise_for_status()
-    return response.json() # Returns doc info with ID
+def upload_documents(files, on_progress=None, site=None):
+    """
+    Uploads many files through /documents/batch.
+    files: list of (file_bytes, filename, content_type).
+    Returns the created documents, in order.
+    """
+    documents = []
+    for start in range(0, len(files), UPLOAD_BATCH_SIZE):
+        chunk = files[start:start + UPLOAD_BATCH_SIZE]
+        payload = [("files", (filename, file_bytes, content_type)) for file_bytes, filename, content_type in chunk]
+        response = requests.post(f"{BACKEND_URL}/documents/batch", files=payload, data={"site": site} if site else None)
+        response.raise_for_status()
+        documents.extend(response.json())
 
-def get_document_list(validated=None):
-    params = {}
+        if on_progress:
+            on_progress(len(documents), len(files))
+    return documents
+
+def get_document_page(validated=None, cursor=None, limit=PAGE_SIZE):
+    """
+    One page of the library, newest first.
+    Returns (documents, next_cursor, total_estimate); next_cursor is None on the last page.
+    """
+    params = {"limit": limit, "include_total": "true"}
     if validated is not None:
         params["validated"] = str(validated).lower()
-        
+    if cursor:
+        params["cursor"] = cursor
+
     resp = requests.get(f"{BACKEND_URL}/documents/", params=params)
     resp.raise_for_status()
-    return resp.json()
+    total = resp.headers.get("X-Total-Count-Estimate")
+    return resp.json(), resp.headers.get("X-Next-Cursor"), int(total) if total else None
 
 def get_document_file_bytes(document_id):
     resp = requests.get(f"{BACKEND_URL}/documents/{document_id}/file")
     resp.raise_for_status()
     return resp.content, resp.headers.get("Content-Type")
 
-def poll_status(document_id):
-    """Loops until status is completed or failed."""
-    while True:
-        resp = requests.get(f"{BACKEND_URL}/documents/{document_id}/status")
-        if resp.status_code != 200:
-            return None
-        
-        data = resp.json()
-        if data["status"] == "completed":
-            return data
-        if data["status"] == "failed":
-            raise Exception("Le traitement du document a échoué.")
-        
-        
-        time.sleep(1) # Wait 1 second before checking again
+def watch_status(document_ids, timeout=None):
+    """
+    Follows the backend's Server-Sent Events stream for the given documents.
+    Yields {"id": ..., "status": ...} on every status change (the current status
+    first), and stops once all documents are completed/failed or after `timeout` seconds.
+    Unknown (e.g. deleted) documents are yielded once with status "not_found".
+    """
+    deadline = time.time() + timeout if timeout else None
 
-def get_document_status_simple(document_id):
-    """Checks status once (non-blocking)."""
-    try:
-        resp = requests.get(f"{BACKEND_URL}/documents/{document_id}/status", timeout=2)
-        if resp.status_code == 200:
-            return resp.json()["status"]
-    except:
-        pass
-    return None
+    # Read timeout > server keep-alive interval (15s)
+    with requests.post(f"{BACKEND_URL}/documents/events", json={"ids": [str(i) for i in document_ids]},
+                       stream=True, timeout=(5, 30)) as resp:
+        resp.raise_for_status()
+        event = None
+        for line in resp.iter_lines(decode_unicode=True):
+            if deadline and time.time() > deadline:
+                return
+            if line.startswith("event:"):
+                event = line[len("event:"):].strip()
+            elif line.startswith("data:") and event == "status":
+                yield json.loads(line[len("data:"):])
+            elif line.startswith("data:") and event == "not_found":
+                yield {**json.loads(line[len("data:"):]), "status": "not_found"}
+            elif line.startswith("data:") and event == "done":
+                return
 
 def get_results(document_id):
     resp = requests.get(f"{BACKEND_URL}/documents/{document_id}/result")
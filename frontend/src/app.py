@@ -1,21 +1,28 @@
 import streamlit as st
 import pandas as pd
 import time
+import datetime
 from api import (
     check_health, 
-    upload_document, 
-    poll_status, 
+    upload_documents, 
+    watch_status, 
     get_results, 
     validate_results, 
-    get_document_list, 
-    get_document_file_bytes,
-    get_document_status_simple
+    get_document_page, 
+    get_document_file_bytes
 )
 from utils import convert_to_fhir
 import requests
 import os
 
 BACKEND_URL = os.getenv("BACKEND_URL", "http://backend:8000")
+# Seconds the Library page follows the status stream before refreshing itself
+STATUS_STREAM_TIMEOUT = 60
+# Reconnections after a failed status stream (backend down...), with a growing delay
+STATUS_STREAM_MAX_RETRIES = 5
+STATUS_STREAM_MAX_DELAY = 30
+# Statuses after which a document is no longer followed
+FINAL_STATUSES = ("completed", "failed", "not_found")
 
 # --- CONFIGURATION ---
 st.set_page_config(page_title="InterHop - Analyse d'Ordonnances", layout="wide", page_icon="🏥")
@@ -54,24 +61,50 @@ def go_to_validation(doc_id):
 if page == "Bibliothèque":
     st.title("📂 Bibliothèque de Documents")
 
-    # --- POLLING (Auto-Refresh) ---
-    if st.session_state.get("last_uploaded_id"):
-        curr_status = get_document_status_simple(st.session_state.last_uploaded_id)
-        
-        if curr_status == "completed":
-             st.toast("Document traité avec succès ! Prêt pour validation.", icon="✅")
-             st.session_state.last_uploaded_id = None
-             # st.balloons() # Optional
-             
-        elif curr_status == "failed":
-             st.toast("❌ Échec du traitement du document.", icon="❌")
-             st.session_state.last_uploaded_id = None
-             
-        elif curr_status in ["pending", "processing"]:
-             # Wait and auto-reload
-             time.sleep(2) 
-             st.rerun()
-             
+    # --- LIVE STATUS (pushed by the backend) ---
+    if st.session_state.get("pending_doc_ids"):
+        pending_ids = st.session_state.pending_doc_ids
+        statuses = {}
+        progress = st.progress(0.0, text="⚙️ Analyse IA en cours...")
+
+        stream_error = None
+        try:
+            for update in watch_status(pending_ids, timeout=STATUS_STREAM_TIMEOUT):
+                statuses[update["id"]] = update["status"]
+                finished = sum(1 for s in statuses.values() if s in FINAL_STATUSES)
+                progress.progress(finished / len(pending_ids), text=f"⚙️ Analyse IA: {finished}/{len(pending_ids)}")
+        except Exception as e:
+            stream_error = e
+
+        failed = [i for i, s in statuses.items() if s in ("failed", "not_found")]
+        remaining = [i for i in pending_ids if statuses.get(i) not in FINAL_STATUSES]
+        progress.empty()
+
+        if remaining and stream_error is None:
+            # Stream timed out: reconnect (the backend resends the current statuses)
+            st.session_state.pending_doc_ids = remaining
+            st.session_state.status_stream_failures = 0
+            st.rerun()
+
+        if remaining:
+            # Stream failed (backend down...): reconnect with a growing delay, a few times
+            failures = st.session_state.get("status_stream_failures", 0) + 1
+            st.session_state.status_stream_failures = failures
+            if failures <= STATUS_STREAM_MAX_RETRIES:
+                st.session_state.pending_doc_ids = remaining
+                st.warning(f"Suivi en direct indisponible ({stream_error}), nouvel essai {failures}/{STATUS_STREAM_MAX_RETRIES}...")
+                time.sleep(min(2 ** failures, STATUS_STREAM_MAX_DELAY))
+                st.rerun()
+
+        st.session_state.pending_doc_ids = None
+        st.session_state.status_stream_failures = 0
+        if remaining:
+            st.error(f"Suivi en direct indisponible: {stream_error}. Les statuts restent visibles ci-dessous.")
+        elif failed:
+            st.toast(f"❌ Échec du traitement de {len(failed)} document(s).", icon="❌")
+        else:
+            st.toast("Documents traités avec succès ! Prêts pour validation.", icon="✅")
+
     # ZONE A: UPLOAD (Collapsible)
     with st.expander("➕ Nouveau Document (Upload)", expanded=True):
         st.write("Chargez une ou plusieurs ordonnances.")
@@ -81,29 +114,25 @@ if page == "Bibliothèque":
             accept_multiple_files=True
         )
         
+        site = st.text_input("Établissement (optionnel)", key="upload_site")
+
         if uploaded_files:
             if st.button("🚀 Envoyer Tout", type="primary"):
                 progress_bar = st.progress(0)
                 total = len(uploaded_files)
-                
-                for idx, uploaded_file in enumerate(uploaded_files):
-                    try:
-                        # 1. Upload
-                        doc_info = upload_document(
-                            uploaded_file.getvalue(), 
-                            uploaded_file.name, 
-                            uploaded_file.type
-                        )
-                        # 2. Track last one for polling
-                        st.session_state.last_uploaded_id = doc_info['id']
-                        
-                        # Update progress
-                        progress_bar.progress((idx + 1) / total)
-                        time.sleep(0.1) # UI feel
-                        
-                    except Exception as e:
-                        st.error(f"Erreur avec {uploaded_file.name}: {e}")
-                
+
+                try:
+                    docs = upload_documents(
+                        [(f.getvalue(), f.name, f.type) for f in uploaded_files],
+                        on_progress=lambda done, count: progress_bar.progress(done / count),
+                        site=site or None
+                    )
+                    # Follow their processing live
+                    if docs:
+                        st.session_state.pending_doc_ids = [d['id'] for d in docs]
+                except Exception as e:
+                    st.error(f"Erreur lors de l'envoi: {e}")
+
                 st.toast(f"{total} documents envoyés!", icon="🚀")
                 time.sleep(1) 
                 st.rerun()
@@ -115,8 +144,10 @@ if page == "Bibliothèque":
 
     def render_doc_table(validated_status, button_label):
         """Helper to render the list and selection logic"""
+        # Stack of page cursors for this tab (None = first page)
+        cursors = st.session_state.setdefault(f"cursors_{validated_status}", [None])
         try:
-            docs = get_document_list(validated=validated_status)
+            docs, next_cursor, total_estimate = get_document_page(validated=validated_status, cursor=cursors[-1])
         except Exception as e:
             st.error(f"Erreur de chargement: {e}")
             return
@@ -161,6 +192,17 @@ if page == "Bibliothèque":
                 use_container_width=True, 
                 hide_index=True
             )
+
+            # Pagination
+            nav_prev, nav_info, nav_next = st.columns([1, 2, 1])
+            if nav_prev.button("◀ Précédent", key=f"prev_{validated_status}", disabled=len(cursors) == 1):
+                cursors.pop()
+                st.rerun()
+            if total_estimate is not None:
+                nav_info.caption(f"Page {len(cursors)} · ~{total_estimate} documents")
+            if nav_next.button("Suivant ▶", key=f"next_{validated_status}", disabled=not next_cursor):
+                cursors.append(next_cursor)
+                st.rerun()
             
             # Selection Mechanism
             # Using selectbox as a stable selector
@@ -248,6 +290,8 @@ elif page == "Validation":
                 "drug_name": st.column_config.TextColumn("Médicament", required=True),
                 "dosage": st.column_config.TextColumn("Dosage"),
                 "raw_instruction": st.column_config.TextColumn("Instructions"),
+                "standardized_code": st.column_config.TextColumn("Code"),
+                "code_confidence": st.column_config.NumberColumn("Confiance", format="%.2f", disabled=True),
             }
 
             edited_df = st.data_editor(
@@ -311,8 +355,14 @@ elif page == "Statistiques":
     if st.button("🔄 Actualiser les données"):
         st.rerun()
 
+    period = st.selectbox("Période", ["Tout", "7 derniers jours", "30 derniers jours"])
+    params = {"group_by": "site"}
+    if period != "Tout":
+        days = 7 if period.startswith("7") else 30
+        params["since"] = (datetime.date.today() - datetime.timedelta(days=days)).isoformat()
+
     try:
-        resp = requests.get(f"{BACKEND_URL}/statistics/global")
+        resp = requests.get(f"{BACKEND_URL}/statistics/global", params=params)
         if resp.status_code == 200:
             stats = resp.json()
             
@@ -327,6 +377,22 @@ elif page == "Statistiques":
                 
                 st.markdown("---")
                 st.success(f"L'IA a correctement identifié {stats['avg_recall']*100:.0f}% des médicaments finaux.")
+
+                # Per-site breakdown
+                breakdown = stats.get("breakdown", [])
+                if len(breakdown) > 1:
+                    st.markdown("### 🏥 Par établissement")
+                    st.dataframe(
+                        pd.DataFrame([{
+                            "Établissement": row["site"] or "Non renseigné",
+                            "Docs Validés": row["count"],
+                            "Précision": row["avg_precision"],
+                            "Rappel": row["avg_recall"],
+                            "Score F1": row["avg_f1"]
+                        } for row in breakdown]),
+                        use_container_width=True,
+                        hide_index=True
+                    )
                 
         else:
             st.error("Erreur lors de la récupération des statistiques.")